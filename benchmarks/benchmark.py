@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to measure the performance of scanning folders and filling the models.
+Synthetic folder trees are created in a temporary folder.
+Each measurement runs in its own process so that the peak memory is for that measurement only and GTK3 and GTK4 are never loaded together.
+The results are written as JSON so that runs on different commits can be compared with --compare.
+
+Examples:
+    python3 benchmarks/benchmark.py --sizes 1000,10000,100000 --output before.json
+    python3 benchmarks/benchmark.py --sizes 1000,10000,100000 --compare before.json
+'''
+
+# System libraries.
+import sys
+import os
+import time
+import json
+import shutil
+import resource
+import argparse
+import platform
+import tempfile
+import subprocess
+
+# Application libraries.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import common.scanner as scanner
+
+
+
+# The cases that do not need a display.
+HEADLESS_CASES = ['scan', 'scan-stat', 'first-row', 'model-gtk4', 'model-gtk4-liststore', 'model-gtk3']
+# The cases that need a display or an offscreen GDK backend.
+DISPLAY_CASES = ['bind-gtk4']
+# The largest number of rows to bind in the bind-gtk4 case.
+MAX_BIND_ROWS = 10000
+
+
+
+def makeTree(folderName, numFiles, depth, numFolders):
+    '''
+    Create a synthetic folder tree.
+    The top folder gets numFiles empty files and numFolders sub folders.
+    Each sub folder gets 1% of the files and the same number of sub folders, down to the specified depth.
+
+    :param str folderName: The folder to create the tree in.
+    :param int numFiles: The number of files in the top folder.
+    :param int depth: The number of levels of sub folders.
+    :param int numFolders: The number of sub folders in each folder.
+    '''
+    os.makedirs(folderName, exist_ok=True)
+    extensions = ['.jpg', '.png', '.txt', '.py', '']
+    for index in range(numFiles):
+        # A mix of name lengths, numbers and extensions.
+        fileName = f'file {index % 97:02d}-{index}{extensions[index % len(extensions)]}'
+        with open(os.path.join(folderName, fileName), 'wb'):
+            pass
+    if depth > 0:
+        for index in range(numFolders):
+            makeTree(os.path.join(folderName, f'folder{index}'), max(1, numFiles // 100), depth - 1, numFolders)
+
+
+
+def peakRssKb():
+    '''
+    Returns the peak resident memory of this process in KB.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        # macOS returns bytes.
+        peak = peak // 1024
+    return peak
+
+
+
+def runCase(case, folderName):
+    '''
+    Run a single measurement in this process.
+
+    :param str case: The name of the case.
+    :param str folderName: The folder to scan.
+    :returns: A dictionary of the results.
+    '''
+    result = {'case': case, 'startRssKb': peakRssKb()}
+
+    if case in ('scan', 'scan-stat'):
+        startTime = time.perf_counter()
+        entries = list(scanner.scanFolder(folderName, withStat=(case == 'scan-stat')))
+        result['seconds'] = time.perf_counter() - startTime
+        result['entries'] = len(entries)
+
+    elif case == 'first-row':
+        # The time until the first batch is ready for the model, as the windows receive it.
+        startTime = time.perf_counter()
+        batches = scanner.batches(scanner.scanFolder(folderName))
+        firstBatch = next(batches, [])
+        result['firstRowSeconds'] = time.perf_counter() - startTime
+        numEntries = len(firstBatch)
+        for batch in batches:
+            numEntries += len(batch)
+        result['seconds'] = time.perf_counter() - startTime
+        result['entries'] = numEntries
+
+    elif case in ('model-gtk4', 'model-gtk4-liststore'):
+        import gi
+        gi.require_version('Gtk', '4.0')
+        from gi.repository import Gio
+        from gtk4.file_list_model import MyFileRow, FileListModel
+        entries = list(scanner.scanFolder(folderName))
+        startTime = time.perf_counter()
+        if case == 'model-gtk4':
+            model = FileListModel(folderName)
+            for batch in scanner.batches(entries):
+                model.splice(model.get_n_items(), 0, batch)
+        else:
+            # The Gio.ListStore of one GObject per file that the window used to use.
+            model = Gio.ListStore.new(MyFileRow)
+            for batch in scanner.batches(entries):
+                model.splice(model.get_n_items(), 0, [MyFileRow(entry.name, entry.path, entry.isFolder) for entry in batch])
+        result['seconds'] = time.perf_counter() - startTime
+        result['entries'] = model.get_n_items()
+
+    elif case == 'model-gtk3':
+        import gi
+        gi.require_version('Gtk', '3.0')
+        from gi.repository import Gtk
+        entries = list(scanner.scanFolder(folderName))
+        startTime = time.perf_counter()
+        model = Gtk.ListStore(str)
+        for batch in scanner.batches(entries):
+            for entry in batch:
+                model.insert_with_valuesv(-1, [0], [entry.name])
+        result['seconds'] = time.perf_counter() - startTime
+        result['entries'] = model.iter_n_children(None)
+
+    elif case == 'bind-gtk4':
+        import gi
+        gi.require_version('Gtk', '4.0')
+        from gi.repository import Gtk
+        import gtk4.main_window
+        from gtk4.file_list_model import FileListModel
+
+        class ListItem():
+            ''' Stand in for the Gtk.ListItem that the factory passes to the setup and bind handlers. '''
+            def __init__(self):
+                self.child = None
+                self.item = None
+            def set_child(self, child):
+                self.child = child
+            def get_child(self):
+                return self.child
+            def get_item(self):
+                return self.item
+
+        class Window():
+            ''' Stand in for the parts of the window that the setup, bind and unbind handlers use.  Thumbnails are turned off. '''
+            thumbnailSize = 0
+            thumbnailLoader = None
+            thumbnailImages = {}
+            def _treeRowExpanded(self, row, param):
+                pass
+
+        model = FileListModel(folderName)
+        model.splice(0, 0, list(scanner.scanFolder(folderName)))
+        treelist = Gtk.TreeListModel.new(model, False, False, lambda item: None)
+        window = Window()
+        # The child widgets come from the setup handler of the window, so the bind handler finds the widgets it expects.
+        listItem = ListItem()
+        gtk4.main_window.MainWindow.setupExpanderLabel(window, None, listItem)
+        numRows = min(treelist.get_n_items(), MAX_BIND_ROWS)
+        startTime = time.perf_counter()
+        for index in range(numRows):
+            listItem.item = treelist.get_row(index)
+            gtk4.main_window.MainWindow.bindMyFileRow(window, None, listItem)
+            gtk4.main_window.MainWindow.unbindMyFileRow(window, None, listItem)
+        result['seconds'] = time.perf_counter() - startTime
+        result['entries'] = numRows
+        result['secondsPerRow'] = result['seconds'] / max(1, numRows)
+
+    else:
+        raise ValueError(f'Unknown case "{case}".')
+
+    if result['seconds'] > 0:
+        result['entriesPerSecond'] = result['entries'] / result['seconds']
+    result['peakRssKb'] = peakRssKb()
+    return result
+
+
+
+def runCaseProcess(case, folderName, gdkBackend):
+    '''
+    Run a single measurement in a new process.
+
+    :param str case: The name of the case.
+    :param str folderName: The folder to scan.
+    :param str gdkBackend: The GDK backend for the cases that need a display or None.
+    :returns: A dictionary of the results.
+    '''
+    environment = dict(os.environ)
+    if gdkBackend is not None:
+        environment['GDK_BACKEND'] = gdkBackend
+    completed = subprocess.run([sys.executable, os.path.realpath(__file__), '--case', case, '--folder', folderName], capture_output=True, text=True, env=environment)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or len(lines) == 0 or not lines[-1].startswith('{'):
+        lines = (completed.stderr + completed.stdout).strip().splitlines()
+        return {'case': case, 'error': lines[-1] if len(lines) > 0 else f'Exit code {completed.returncode}.'}
+    return json.loads(lines[-1])
+
+
+
+def getCommit():
+    '''
+    Returns the git commit of the working tree or None.
+    '''
+    try:
+        completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.realpath(__file__)))
+    except OSError:
+        return None
+    if completed.returncode != 0:
+        return None
+    return completed.stdout.strip()
+
+
+
+def compareResults(oldResults, newResults):
+    '''
+    Print the change in time for each case and size between two runs.
+
+    :param dict oldResults: The results of the earlier run.
+    :param dict newResults: The results of the later run.
+    '''
+    oldTimes = {(result['case'], result['size']): result['seconds'] for result in oldResults['results'] if 'seconds' in result}
+    print(f'Compared with {oldResults.get("commit")}.')
+    for result in newResults['results']:
+        key = (result['case'], result['size'])
+        if 'seconds' in result and key in oldTimes and oldTimes[key] > 0:
+            ratio = result['seconds'] / oldTimes[key]
+            print(f'{result["case"]:22} {result["size"]:>9} {oldTimes[key]:10.4f}s {result["seconds"]:10.4f}s {ratio:6.2f}x')
+
+
+
+if __name__ == '__main__':
+    # Process the command line arguments.
+    argParse = argparse.ArgumentParser(prog='benchmark', description='Measure the performance of scanning folders and filling the models.')
+    argParse.add_argument('--sizes', help='Comma separated numbers of files in the top folder.', default='1000,10000,100000')
+    argParse.add_argument('--depth', help='The number of levels of sub folders.', type=int, default=0)
+    argParse.add_argument('--folders', help='The number of sub folders in each folder.', type=int, default=10)
+    argParse.add_argument('--cases', help='Comma separated cases to run.', default=','.join(HEADLESS_CASES))
+    argParse.add_argument('--gdk-backend', help='Also run the cases that need a display with this GDK backend, for example "broadway" or "x11" under Xvfb.', default=None)
+    argParse.add_argument('--output', help='The file to write the JSON results to.  Default is stdout.', default=None)
+    argParse.add_argument('--compare', help='A JSON results file from an earlier run to compare with.', default=None)
+    argParse.add_argument('--keep', help='Keep the synthetic folder trees.', action='store_true')
+    argParse.add_argument('--case', help=argparse.SUPPRESS, default=None)
+    argParse.add_argument('--folder', help=argparse.SUPPRESS, default=None)
+    args = argParse.parse_args()
+
+    if args.case is not None:
+        # Run a single case in this process for runCaseProcess().
+        print(json.dumps(runCase(args.case, args.folder)))
+        sys.exit(0)
+
+    cases = args.cases.split(',')
+    if args.gdk_backend is not None:
+        cases += [case for case in DISPLAY_CASES if case not in cases]
+
+    results = []
+    treesFolder = tempfile.mkdtemp(prefix='gtk_treeview_benchmark_')
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            folderName = os.path.join(treesFolder, f'tree{size}')
+            makeTree(folderName, size, args.depth, args.folders)
+            for case in cases:
+                result = runCaseProcess(case, folderName, args.gdk_backend)
+                result['size'] = size
+                print(f'{case:22} {size:>9} {result.get("seconds", result.get("error"))}', file=sys.stderr)
+                results.append(result)
+    finally:
+        if args.keep:
+            print(f'The folder trees are in "{treesFolder}".', file=sys.stderr)
+        else:
+            shutil.rmtree(treesFolder, ignore_errors=True)
+
+    output = {
+        'commit': getCommit(),
+        'python': platform.python_version(),
+        'system': platform.system(),
+        'depth': args.depth,
+        'folders': args.folders,
+        'results': results,
+    }
+    if args.output is None:
+        print(json.dumps(output, indent=4))
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=4)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            compareResults(json.load(file), output)
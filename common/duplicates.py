@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to find the files with the same contents under a folder.
+The files are grouped by size first, so only the files whose size is shared are read at all.
+Those are grouped by a hash of their first and last blocks and only the files still grouped are read in full.
+The hashes are made in a pool of worker processes and kept in an SQLite cache by path, size and modified time, so looking again only reads the files that have changed.
+It is used by the duplicates window of the GTK4 front end.
+'''
+
+import os
+import stat
+import mmap
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import multiprocessing
+import concurrent.futures
+
+# Application libraries.
+import common.scanner as scanner
+import common.folder_index as folder_index
+
+
+
+logger = logging.getLogger(__name__)
+
+# The number of bytes hashed at the start and at the end of a file for the partial hash.
+PARTIAL_BYTES = 64 * 1024
+# The size of the blocks of a full hash when a file can not be memory mapped.
+BLOCK_BYTES = 1024 * 1024
+# The number of files hashed by one task in a worker process.
+TASK_FILES = 64
+# The number of paths looked up in the hash cache by one query.  SQLite allows at least 999 parameters in a query.
+QUERY_PATHS = 500
+# The default number of worker processes.
+MAX_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+# The version of the tables of the hash cache.  The tables are made again when this changes.
+SCHEMA_VERSION = 1
+# The stages of a search, in order.
+STAGE_SCAN = 'Scanning'
+STAGE_PARTIAL = 'Hashing the start and end'
+STAGE_FULL = 'Hashing in full'
+
+
+
+class DuplicateGroup():
+    '''
+    Class to represent some files with the same contents.
+
+    :ivar int size: The size of each file in bytes.
+    :ivar list paths: The paths of the files in natural order.
+    '''
+    __slots__ = ('size', 'paths')
+
+
+
+    def __init__(self, size, paths):
+        ''' Class constructor for the :py:class:`DuplicateGroup` class. '''
+        self.size = size
+        self.paths = paths
+
+
+
+    def getWastedBytes(self):
+        ''' Returns the number of bytes that deleting all the files but one would free. '''
+        return self.size * (len(self.paths) - 1)
+
+
+
+def getDefaultCacheFileName():
+    ''' Returns the default file of the hash cache, beside the folder index. '''
+    return os.path.join(os.path.dirname(folder_index.getDefaultFileName()), 'hashes.sqlite')
+
+
+
+def hashFile(path, size, isPartial):
+    '''
+    Returns the hash of a file.
+    A partial hash only reads the first and last :py:const:`PARTIAL_BYTES`, which is enough to tell most files of the same size apart.
+    A full hash reads the file through a memory map, so the data is not copied into Python.
+
+    :param str path: The path of the file.
+    :param int size: The size of the file when it was scanned.  The file is not hashed if its size has changed.
+    :param bool isPartial: True for the partial hash.
+    :returns: The digest or None if the file can not be read.
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    try:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size != size:
+                return None
+            if isPartial:
+                digest.update(file.read(PARTIAL_BYTES))
+                if size > 2 * PARTIAL_BYTES:
+                    file.seek(-PARTIAL_BYTES, os.SEEK_END)
+                digest.update(file.read(PARTIAL_BYTES))
+            else:
+                try:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        digest.update(mapped)
+                except (ValueError, OSError):
+                    # Some file systems can not map files.
+                    while True:
+                        block = file.read(BLOCK_BYTES)
+                        if not block:
+                            break
+                        digest.update(block)
+    except OSError:
+        return None
+    return digest.digest()
+
+
+
+def hashFiles(files, isPartial):
+    '''
+    Returns the hashes of some files.  This runs in a worker process.
+
+    :param list files: The (path, size) of the files.
+    :param bool isPartial: True for the partial hashes.
+    :returns: The list of digests or None.
+    '''
+    return [hashFile(path, size, isPartial) for path, size in files]
+
+
+
+class HashCache():
+    '''
+    Class to represent the persistent cache of the hashes of files.
+    A hash is only used while the file has the same size and modified time.
+    All the methods read or write the database, so call them from a worker thread.
+
+    :ivar str fileName: The database file.
+    '''
+
+
+
+    def __init__(self, fileName=None):
+        '''
+        Class constructor for the :py:class:`HashCache` class.
+        The database is opened when it is first used.
+
+        :param str fileName: The database file or None for :py:func:`getDefaultCacheFileName`.
+        '''
+        self.fileName = fileName if fileName is not None else getDefaultCacheFileName()
+        self.connection = None
+        self.lock = threading.Lock()
+
+
+
+    def _connect(self):
+        '''
+        Returns the connection to the database, opening it and making the tables if needed.
+        Call this with :py:attr:`lock` held.
+        '''
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+            connection = sqlite3.connect(self.fileName, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                connection.execute('DROP TABLE IF EXISTS hashes')
+                connection.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+            connection.execute('CREATE TABLE IF NOT EXISTS hashes (path BLOB PRIMARY KEY, size INTEGER, mtime INTEGER, partial BLOB, full BLOB)')
+            connection.commit()
+            self.connection = connection
+        return self.connection
+
+
+
+    def get(self, files, isPartial):
+        '''
+        Returns the cached hashes of some files.
+
+        :param list files: The (path, size, mtime) of the files, with the modified time in nanoseconds.
+        :param bool isPartial: True for the partial hashes.
+        :returns: A dictionary of the hashes by path.  The files without a valid hash are missing.
+        '''
+        column = 'partial' if isPartial else 'full'
+        # The (size, mtime, hash) of the cached files by encoded path.
+        rows = {}
+        try:
+            with self.lock:
+                connection = self._connect()
+                for start in range(0, len(files), QUERY_PATHS):
+                    paths = [os.fsencode(path) for path, size, mtime in files[start:start + QUERY_PATHS]]
+                    query = 'SELECT path, size, mtime, {} FROM hashes WHERE path IN ({})'.format(column, ','.join('?' * len(paths)))
+                    for path, size, mtime, digest in connection.execute(query, paths):
+                        rows[path] = (size, mtime, digest)
+        except sqlite3.Error as error:
+            logger.warning('Can not read the hash cache "%s". %s', self.fileName, error)
+        hashes = {}
+        for path, size, mtime in files:
+            row = rows.get(os.fsencode(path))
+            if row is not None and row[0] == size and row[1] == mtime and row[2] is not None:
+                hashes[path] = row[2]
+        return hashes
+
+
+
+    def put(self, files, hashes, isPartial):
+        '''
+        Add the hashes of some files.
+
+        :param list files: The (path, size, mtime) of the files, with the modified time in nanoseconds.
+        :param list hashes: The hashes of the files, None for the files that could not be read.
+        :param bool isPartial: True for the partial hashes.
+        '''
+        rows = [(os.fsencode(path), size, mtime, digest) for (path, size, mtime), digest in zip(files, hashes) if digest is not None]
+        try:
+            with self.lock:
+                connection = self._connect()
+                if isPartial:
+                    # A new partial hash means the full hash, if any, is out of date.
+                    connection.executemany('REPLACE INTO hashes (path, size, mtime, partial, full) VALUES (?, ?, ?, ?, NULL)', rows)
+                else:
+                    connection.executemany('INSERT INTO hashes (path, size, mtime, full) VALUES (?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET full=excluded.full WHERE size=excluded.size AND mtime=excluded.mtime', rows)
+                connection.commit()
+        except sqlite3.Error as error:
+            logger.warning('Can not write the hash cache "%s". %s', self.fileName, error)
+
+
+
+    def close(self):
+        ''' Close the database. '''
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+
+def listFolder(folderName, isCancelled=None):
+    '''
+    Returns the entries of a folder from the scanner.
+    This has the same arguments and result as :py:meth:`~common.scan_service.ScanService.listFolder`, which shares the listings of the windows instead.
+
+    :param str folderName: The folder.
+    :param isCancelled: Optional function that returns True to stop early.
+    :returns: A tuple of None for the stamp and the list of :py:class:`~common.scanner.ScanEntry` objects.
+    '''
+    return (None, list(scanner.iterateFolder(folderName, isCancelled=isCancelled)))
+
+
+
+def scanFiles(folderName, isCancelled=None, listFolder=listFolder):
+    '''
+    Returns the regular files under a folder by size.
+    The folders are listed by the scanner, or by the scan service so that the folders already listed are not read again, and only the files are stat()ed.
+    Symbolic links are not followed and a file with several hard links is only listed once, the links are not duplicates of each other.
+    Empty files are left out.
+
+    :param str folderName: The folder.
+    :param isCancelled: Optional function that returns True to stop early.
+    :param listFolder: Function that takes a folder and isCancelled and returns the stamp and the list of :py:class:`~common.scanner.ScanEntry` objects, or None if cancelled.
+    :returns: A dictionary of lists of (path, size, mtime) by size, with the modified time in nanoseconds.
+    '''
+    filesBySize = {}
+    inodes = set()
+    stack = [folderName]
+    while len(stack) > 0:
+        if isCancelled is not None and isCancelled():
+            break
+        listing = listFolder(stack.pop(), isCancelled)
+        if listing is None:
+            break
+        for entry in listing[1]:
+            try:
+                # The scanner follows symbolic links to tell folders from files, this does not.
+                fileStat = os.lstat(entry.path)
+            except OSError:
+                continue
+            if stat.S_ISDIR(fileStat.st_mode):
+                stack.append(entry.path)
+                continue
+            if not stat.S_ISREG(fileStat.st_mode) or fileStat.st_size == 0:
+                continue
+            if fileStat.st_nlink > 1:
+                inode = (fileStat.st_dev, fileStat.st_ino)
+                if inode in inodes:
+                    continue
+                inodes.add(inode)
+            filesBySize.setdefault(fileStat.st_size, []).append((entry.path, fileStat.st_size, fileStat.st_mtime_ns))
+    return filesBySize
+
+
+
+class DuplicateFinder():
+    '''
+    Class to find the duplicate files under a folder with a pool of worker processes.
+    The pool is only started when there are files to hash and is kept for the next search.
+
+    :ivar HashCache hashCache: The persistent cache of the hashes or None to not cache them.
+    '''
+
+
+
+    def __init__(self, hashCache=None, maxWorkers=MAX_WORKERS, listFolder=listFolder):
+        '''
+        Class constructor for the :py:class:`DuplicateFinder` class.
+
+        :param HashCache hashCache: The persistent cache of the hashes or None to not cache them.
+        :param int maxWorkers: The number of worker processes.
+        :param listFolder: Function that lists a folder, see :py:func:`scanFiles`.  Pass :py:meth:`~common.scan_service.ScanService.listFolder` to use the listings of the windows.
+        '''
+        self.hashCache = hashCache
+        self.maxWorkers = maxWorkers
+        self.listFolder = listFolder
+        self.executor = None
+        self.lock = threading.Lock()
+
+
+
+    def _getExecutor(self):
+        ''' Returns the pool, starting it if needed.  Spawn rather than fork, the main process has GTK and threads. '''
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.maxWorkers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+
+
+    def _hashGroups(self, groups, isPartial, stage, isCancelled, onProgress):
+        '''
+        Split groups of files by their hashes.
+
+        :param list groups: The lists of (path, size, mtime) of the files that might be the same.
+        :param bool isPartial: True for the partial hashes.
+        :param str stage: The stage for the progress.
+        :param isCancelled: Function that returns True to stop early.
+        :param onProgress: Function that takes the stage, the number of files done and the number of files.
+        :returns: The lists of the files with the same hash that have more than one file.
+        '''
+        files = [file for group in groups for file in group]
+        hashes = self.hashCache.get(files, isPartial) if self.hashCache is not None else {}
+        missing = [file for file in files if file[0] not in hashes]
+        numDone = len(files) - len(missing)
+        onProgress(stage, numDone, len(files))
+        if len(missing) > 0:
+            executor = self._getExecutor()
+            futures = {}
+            for start in range(0, len(missing), TASK_FILES):
+                task = missing[start:start + TASK_FILES]
+                futures[executor.submit(hashFiles, [(path, size) for path, size, mtime in task], isPartial)] = task
+            # The new hashes are written to the cache in one transaction at the end, also when the search is cancelled.
+            hashedFiles = []
+            newHashes = []
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    if isCancelled():
+                        for other in futures:
+                            other.cancel()
+                        return []
+                    task = futures[future]
+                    try:
+                        taskHashes = future.result()
+                    except Exception as error:
+                        logger.warning('Can not hash %d files. %s', len(task), error)
+                        taskHashes = [None] * len(task)
+                    for (path, size, mtime), digest in zip(task, taskHashes):
+                        if digest is not None:
+                            hashes[path] = digest
+                    hashedFiles.extend(task)
+                    newHashes.extend(taskHashes)
+                    numDone += len(task)
+                    onProgress(stage, numDone, len(files))
+            finally:
+                if self.hashCache is not None and len(hashedFiles) > 0:
+                    self.hashCache.put(hashedFiles, newHashes, isPartial)
+
+        newGroups = []
+        for group in groups:
+            byHash = {}
+            for file in group:
+                digest = hashes.get(file[0])
+                if digest is not None:
+                    byHash.setdefault(digest, []).append(file)
+            newGroups.extend([files for files in byHash.values() if len(files) > 1])
+        return newGroups
+
+
+
+    def find(self, folderName, isCancelled=None, onProgress=None):
+        '''
+        Returns the groups of files with the same contents under a folder.
+        Call this on a worker thread.
+
+        :param str folderName: The folder.
+        :param isCancelled: Optional function that returns True to stop early.
+        :param onProgress: Optional function that takes the stage, the number of files done and the number of files.
+        :returns: The list of :py:class:`DuplicateGroup` objects, the most wasted bytes first, or None if cancelled.
+        '''
+        isCancelled = isCancelled if isCancelled is not None else lambda: False
+        onProgress = onProgress if onProgress is not None else lambda stage, numDone, numFiles: None
+        startTime = time.perf_counter()
+        onProgress(STAGE_SCAN, 0, 0)
+        filesBySize = scanFiles(folderName, isCancelled, self.listFolder)
+        numFiles = sum([len(files) for files in filesBySize.values()])
+        groups = [files for files in filesBySize.values() if len(files) > 1]
+        if isCancelled():
+            return None
+        numCandidates = sum([len(files) for files in groups])
+
+        groups = self._hashGroups(groups, True, STAGE_PARTIAL, isCancelled, onProgress)
+        if isCancelled():
+            return None
+        # A small file is read in full by its partial hash, so it needs no full hash.
+        doneGroups = [files for files in groups if files[0][1] <= 2 * PARTIAL_BYTES]
+        groups = [files for files in groups if files[0][1] > 2 * PARTIAL_BYTES]
+        groups = doneGroups + self._hashGroups(groups, False, STAGE_FULL, isCancelled, onProgress)
+        if isCancelled():
+            return None
+
+        duplicates = [DuplicateGroup(files[0][1], sorted([path for path, size, mtime in files], key=scanner.naturalKey)) for files in groups]
+        duplicates.sort(key=lambda group: (-group.getWastedBytes(), group.paths[0]))
+        logger.info('Found %d groups of duplicates in %d files, %d with a shared size, in %.3fs.', len(duplicates), numFiles, numCandidates, time.perf_counter() - startTime)
+        return duplicates
+
+
+
+    def shutdown(self):
+        ''' Stop the worker processes and close the hash cache. '''
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self.hashCache is not None:
+            self.hashCache.close()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module for an index of the files in a folder by extension.
+'''
+
+import os
+import heapq
+import array
+import bisect
+
+
+
+# The key for the folders in the index.  A file extension can not contain '/'.
+FOLDERS = '/'
+
+# The number of extensions shown in the counts when no extensions are selected.
+TITLE_EXTENSIONS = 3
+
+
+
+def parseExtensions(text):
+    '''
+    Returns the extensions in a comma separated list such as 'jpg,png' or '.jpg, .PNG'.
+
+    :param str text: The comma separated extensions.
+    :returns: The set of lower case extensions including the '.' or None if the text has no extensions.
+    '''
+    extensions = set()
+    for extension in text.split(','):
+        extension = extension.strip().lower()
+        if extension == '':
+            continue
+        if not extension.startswith('.'):
+            extension = f'.{extension}'
+        extensions.add(extension)
+    if len(extensions) == 0:
+        return None
+    return extensions
+
+
+
+def getExtension(name):
+    '''
+    Returns the lower case extension of a file including the '.' or an empty string.
+    This matches :py:attr:`~common.scanner.ScanEntry.extension`.
+
+    :param str name: The name of the file.
+    '''
+    return os.path.splitext(name)[1].lower()
+
+
+
+class ExtensionIndex():
+    '''
+    Class to represent the positions of the rows of a list by extension.
+    Folders are kept under :py:const:`FOLDERS` so that they can always be shown.
+    The number of files with each extension is the length of its list, so the counts come from the same pass.
+
+    :ivar int size: The number of rows in the index.
+    '''
+
+
+
+    def __init__(self):
+        ''' Class constructor for the :py:class:`ExtensionIndex` class. '''
+        self.size = 0
+        # The ascending positions of the rows by extension.
+        self.positions = {}
+
+
+
+    def addEntries(self, entries):
+        '''
+        Add rows to the end of the index.
+        The extensions have already been worked out by the scan.
+
+        :param list entries: The :py:class:`~common.scanner.ScanEntry` objects.
+        '''
+        self.splice(self.size, 0, [FOLDERS if entry.isFolder else entry.extension for entry in entries])
+
+
+
+    def splice(self, position, numberToRemove, extensions):
+        '''
+        Remove rows and insert new rows at the specified position, the same as a splice on the list.
+        Only the positions after the change are moved, nothing is rebuilt.
+
+        :param int position: The position of the first row to remove.
+        :param int numberToRemove: The number of rows to remove.
+        :param list extensions: The extensions of the new rows, :py:const:`FOLDERS` for a folder.
+        '''
+        added = {}
+        for index, extension in enumerate(extensions):
+            added.setdefault(extension, array.array('I')).append(position + index)
+        delta = len(extensions) - numberToRemove
+        end = position + numberToRemove
+        if position == self.size:
+            # Appending only touches the end of the lists.
+            for extension, newPositions in added.items():
+                self.positions.setdefault(extension, array.array('I')).extend(newPositions)
+            self.size += delta
+            return
+        for extension in set(self.positions) | set(added):
+            posting = self.positions.get(extension)
+            if posting is None:
+                posting = array.array('I')
+            start = bisect.bisect_left(posting, position)
+            if start == len(posting) and extension not in added:
+                # Every row with this extension is before the change.
+                continue
+            tail = bisect.bisect_left(posting, end)
+            newPosting = posting[:start]
+            newPosting.extend(added.get(extension, ()))
+            if delta == 0:
+                newPosting.extend(posting[tail:])
+            else:
+                newPosting.extend(value + delta for value in posting[tail:])
+            if len(newPosting) == 0:
+                self.positions.pop(extension, None)
+            else:
+                self.positions[extension] = newPosting
+        self.size += delta
+
+
+
+    def getPositions(self, extensions, withFolders=True):
+        '''
+        Returns the ascending positions of the rows with any of the extensions.
+
+        :param extensions: The extensions to select.
+        :param bool withFolders: True to include the folders.
+        '''
+        postings = [self.positions[extension] for extension in extensions if extension in self.positions]
+        if withFolders and FOLDERS in self.positions:
+            postings.append(self.positions[FOLDERS])
+        if len(postings) == 1:
+            return list(postings[0])
+        return list(heapq.merge(*postings))
+
+
+
+    def getCounts(self):
+        '''
+        Returns the number of files with each extension.
+        Folders are not included.
+        '''
+        return {extension: len(posting) for extension, posting in self.positions.items() if extension != FOLDERS}
+
+
+
+    def getTitle(self, extensions=None):
+        '''
+        Returns the text for the title of the files column, for example 'Files (120: 40 .jpg, 30 .png, 50 other)'.
+
+        :param extensions: The selected extensions, which are always counted, or None to count the most common extensions.
+        '''
+        counts = self.getCounts()
+        if len(counts) == 0:
+            return f'Files ({self.size})'
+        if extensions is None:
+            shown = sorted(counts, key=lambda extension: counts[extension], reverse=True)[:TITLE_EXTENSIONS]
+        else:
+            shown = sorted(extensions)
+        details = [f'{counts.get(extension, 0)} {extension if extension != "" else "none"}' for extension in shown]
+        numOther = sum(counts.values()) - sum(counts.get(extension, 0) for extension in shown)
+        if numOther > 0:
+            details.append(f'{numOther} other')
+        return f'Files ({self.size}: {", ".join(details)})'
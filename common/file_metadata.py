@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to read the size, modified time and content type of the files in a folder.
+The files are read on a worker thread in batches, so the windows show a placeholder until a batch arrives.
+'''
+
+import os
+import stat
+import time
+import array
+import mimetypes
+
+# Application libraries.
+import common.scanner as scanner
+
+
+
+# The text shown in a cell until its metadata arrives.
+PLACEHOLDER = '…'
+# The size and modified time of a file that has not been read yet or can not be read.
+UNKNOWN = -1
+# The content type of a folder.
+FOLDER_TYPE = 'inode/directory'
+# The content type of a file with an unknown extension.
+DEFAULT_TYPE = 'application/octet-stream'
+
+
+
+def getContentType(name, isFolder):
+    '''
+    Returns the content type of a file from its name.
+    Only the name is used, the file is not read.
+
+    :param str name: The name of the file.
+    :param bool isFolder: True if the file is a folder.
+    '''
+    if isFolder:
+        return FOLDER_TYPE
+    contentType, encoding = mimetypes.guess_type(name, strict=False)
+    return contentType if contentType is not None else DEFAULT_TYPE
+
+
+
+def formatModified(modified):
+    '''
+    Returns a modified time as text for a cell.
+
+    :param float modified: The modified time in seconds since the epoch or :py:const:`UNKNOWN`.
+    '''
+    if modified == UNKNOWN:
+        return PLACEHOLDER
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(modified))
+
+
+
+class MetadataBatch():
+    '''
+    Class to represent the metadata of some of the rows of a list.
+    The values are in arrays so that a batch can be handed to the main thread in one go.
+
+    :ivar array positions: The positions of the rows.
+    :ivar array sizes: The sizes in bytes or :py:const:`UNKNOWN`.
+    :ivar array modified: The modified times or :py:const:`UNKNOWN`.
+    :ivar list contentTypes: The content types.
+    '''
+    __slots__ = ('positions', 'sizes', 'modified', 'contentTypes')
+
+
+
+    def __init__(self):
+        ''' Class constructor for the :py:class:`MetadataBatch` class. '''
+        self.positions = array.array('I')
+        self.sizes = array.array('q')
+        self.modified = array.array('d')
+        self.contentTypes = []
+
+
+
+    def __len__(self):
+        return len(self.positions)
+
+
+
+def readMetadata(folderName, names, positions=None, isCancelled=None):
+    '''
+    Generator for the metadata of files in a folder as :py:class:`MetadataBatch` objects.
+    This does a stat on every file so call it on a worker thread.
+    The batches start small and then double in size, the same as :py:func:`~common.scanner.batches`.
+
+    :param str folderName: The folder that holds the files.
+    :param list names: The names of the rows in the list.
+    :param positions: Optional positions of the rows to read, otherwise every row is read.
+    :param isCancelled: Optional function that returns True to stop early.
+    '''
+    if positions is None:
+        positions = range(len(names))
+    for batchPositions in scanner.batches(positions):
+        if isCancelled is not None and isCancelled():
+            return
+        batch = MetadataBatch()
+        for position in batchPositions:
+            name = names[position]
+            try:
+                fileStat = os.stat(os.path.join(folderName, name))
+                size = fileStat.st_size
+                modified = fileStat.st_mtime
+                isFolder = stat.S_ISDIR(fileStat.st_mode)
+            except OSError:
+                size = UNKNOWN
+                modified = UNKNOWN
+                isFolder = False
+            batch.positions.append(position)
+            batch.sizes.append(size)
+            batch.modified.append(modified)
+            batch.contentTypes.append(getContentType(name, isFolder))
+        yield batch
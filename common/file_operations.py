@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to delete, copy and move files on a pool of worker threads.
+The results are handed back in batches, so that a window can update its rows a batch at a time instead of scanning the folder again.
+It is used by the Edit menu of the GTK3 front end.
+'''
+
+import os
+import time
+import shutil
+import threading
+import concurrent.futures
+
+
+
+# The kinds of operations.
+DELETE = 'delete'
+COPY = 'copy'
+MOVE = 'move'
+# The default number of worker threads.
+MAX_WORKERS = 4
+# The time in seconds between the batches of results.
+PROGRESS_SECONDS = 0.1
+
+
+
+class Cancelled(Exception):
+    ''' Exception raised inside a copy when its operation is cancelled. '''
+
+
+
+class OperationBatch():
+    '''
+    Class to represent the results of some of the files of an operation.
+
+    :ivar list removed: The paths of the files that no longer exist.
+    :ivar list created: The paths of the new files.
+    :ivar list errors: The (path, message) of the files that failed.
+    :ivar int numDone: The number of files of the operation finished so far, including this batch.
+    '''
+    __slots__ = ('removed', 'created', 'errors', 'numDone')
+
+
+
+    def __init__(self, numDone):
+        ''' Class constructor for the :py:class:`OperationBatch` class. '''
+        self.removed = []
+        self.created = []
+        self.errors = []
+        self.numDone = numDone
+
+
+
+def getFreeName(folderName, name, takenNames=()):
+    '''
+    Returns a name that does not exist yet in a folder, based on a name.
+    The name is returned unchanged if it is free, otherwise ' (copy)' or ' (copy 2)' and so on is added before the extension.
+
+    :param str folderName: The folder.
+    :param str name: The wanted name.
+    :param set takenNames: Optional names that count as taken although they do not exist yet.
+    '''
+    isTaken = lambda name: name in takenNames or os.path.lexists(os.path.join(folderName, name))
+    if not isTaken(name):
+        return name
+    stem, extension = os.path.splitext(name)
+    if stem == '':
+        # A hidden file such as '.profile' has no extension.
+        stem, extension = name, ''
+    number = 1
+    while True:
+        newName = '{} (copy){}'.format(stem, extension) if number == 1 else '{} (copy {}){}'.format(stem, number, extension)
+        if not isTaken(newName):
+            return newName
+        number += 1
+
+
+
+class FileOperation():
+    '''
+    Class to represent one delete, copy or move of some files.
+    Each file is done as a task on the worker threads of a :py:class:`FileOperations` object.
+    A folder is done as one task, with all its contents.
+
+    :ivar str kind: One of :py:const:`DELETE`, :py:const:`COPY` or :py:const:`MOVE`.
+    :ivar list paths: The paths of the files.
+    :ivar str destinationFolder: The folder to copy or move the files to, None to delete.
+    :ivar int numDone: The number of files finished so far.
+    '''
+
+
+
+    def __init__(self, kind, paths, destinationFolder, callback):
+        '''
+        Class constructor for the :py:class:`FileOperation` class.
+
+        :param str kind: One of :py:const:`DELETE`, :py:const:`COPY` or :py:const:`MOVE`.
+        :param list paths: The paths of the files.
+        :param str destinationFolder: The folder to copy or move the files to, None to delete.
+        :param callback: Function that takes this operation, an :py:class:`OperationBatch` and True for the last batch.
+        '''
+        self.kind = kind
+        self.paths = paths
+        self.destinationFolder = destinationFolder
+        self.callback = callback
+        self.numDone = 0
+        self.event = threading.Event()
+        # The names taken by this operation in the destination folder.  Two files with the same name can be copied at the same time.
+        self.takenNames = set()
+        self.lock = threading.Lock()
+
+
+
+    def isCancelled(self):
+        ''' Returns True if the operation has been cancelled. '''
+        return self.event.is_set()
+
+
+
+    def cancel(self):
+        '''
+        Cancel the operation.
+        The files that have not started are skipped and a copy in progress stops at its next file.
+        The files that have finished are not undone.
+        '''
+        self.event.set()
+
+
+
+    def _copyFile(self, source, destination, follow_symlinks=True):
+        ''' Copy function for shutil.copytree() that stops when the operation is cancelled. '''
+        if self.event.is_set():
+            raise Cancelled()
+        return shutil.copy2(source, destination, follow_symlinks=follow_symlinks)
+
+
+
+    def _getDestination(self, path):
+        ''' Returns a free path in the destination folder for a file and reserves it. '''
+        with self.lock:
+            name = getFreeName(self.destinationFolder, os.path.basename(path), self.takenNames)
+            self.takenNames.add(name)
+        return os.path.join(self.destinationFolder, name)
+
+
+
+    def _run(self, path):
+        '''
+        Delete, copy or move one file.  This runs on a worker thread.
+
+        :param str path: The path of the file.
+        :returns: A tuple of the removed path or None, the created path or None and the (path, message) of an error or None.
+        '''
+        if self.event.is_set():
+            return (None, None, None)
+        isFolder = os.path.isdir(path) and not os.path.islink(path)
+        destination = None
+        try:
+            if self.kind == DELETE:
+                if isFolder:
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                return (path, None, None)
+            if self.kind == MOVE and os.path.dirname(path) == self.destinationFolder:
+                # Moving a file to its own folder does nothing.
+                return (None, None, None)
+            destination = self._getDestination(path)
+            if self.kind == COPY:
+                if isFolder:
+                    shutil.copytree(path, destination, symlinks=True, copy_function=self._copyFile)
+                else:
+                    shutil.copy2(path, destination, follow_symlinks=False)
+                return (None, destination, None)
+            shutil.move(path, destination, copy_function=self._copyFile)
+            return (path, destination, None)
+        except Cancelled:
+            # Remove the part of the folder that was copied.  A move is cancelled before the source is removed.
+            shutil.rmtree(destination, ignore_errors=True)
+            return (None, None, None)
+        except (OSError, shutil.Error) as error:
+            # A folder copied or deleted in part still shows its new state.
+            created = destination if destination is not None and os.path.lexists(destination) else None
+            removed = path if not os.path.lexists(path) else None
+            return (removed, created, (path, str(error)))
+
+
+
+class FileOperations():
+    '''
+    Class to run file operations on a pool of worker threads.
+    The callback of an operation is called on a worker thread with the batches of results.
+    The callback must hand the batches to the main thread.
+    '''
+
+
+
+    def __init__(self, maxWorkers=MAX_WORKERS):
+        '''
+        Class constructor for the :py:class:`FileOperations` class.
+        The threads are only started by the first operation.
+
+        :param int maxWorkers: The number of worker threads.
+        '''
+        self.maxWorkers = maxWorkers
+        self.executor = None
+        self.lock = threading.Lock()
+
+
+
+    def start(self, kind, paths, destinationFolder, callback):
+        '''
+        Start an operation.
+
+        :param str kind: One of :py:const:`DELETE`, :py:const:`COPY` or :py:const:`MOVE`.
+        :param list paths: The paths of the files.
+        :param str destinationFolder: The folder to copy or move the files to, None to delete.
+        :param callback: Function that takes the operation, an :py:class:`OperationBatch` and True for the last batch.
+        :returns: The :py:class:`FileOperation` object.
+        '''
+        operation = FileOperation(kind, paths, destinationFolder, callback)
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(self.maxWorkers, thread_name_prefix='FileOperations')
+            futures = [self.executor.submit(operation._run, path) for path in paths]
+        # The results are collected on a thread of their own so that the workers never wait for the callback.
+        thread = threading.Thread(target=self._collect, args=(operation, futures), daemon=True)
+        thread.start()
+        return operation
+
+
+
+    def _collect(self, operation, futures):
+        '''
+        Collect the results of an operation into batches.  This runs on a thread of its own.
+
+        :param FileOperation operation: The operation.
+        :param list futures: The futures of the files.
+        '''
+        batch = OperationBatch(0)
+        reportTime = time.monotonic() + PROGRESS_SECONDS
+        for future in concurrent.futures.as_completed(futures):
+            if future.cancelled():
+                removed, created, error = (None, None, None)
+            else:
+                try:
+                    removed, created, error = future.result()
+                except Exception as exception:
+                    removed, created, error = (None, None, (None, str(exception)))
+            operation.numDone += 1
+            if removed is not None:
+                batch.removed.append(removed)
+            if created is not None:
+                batch.created.append(created)
+            if error is not None:
+                batch.errors.append(error)
+            if time.monotonic() > reportTime and operation.numDone < len(futures):
+                batch.numDone = operation.numDone
+                operation.callback(operation, batch, False)
+                batch = OperationBatch(0)
+                reportTime = time.monotonic() + PROGRESS_SECONDS
+        batch.numDone = operation.numDone
+        operation.callback(operation, batch, True)
+
+
+
+    def shutdown(self):
+        ''' Stop the worker threads once the files in progress have finished. '''
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to read the previews of files on a worker thread.
+A text file shows its first lines, any other file shows a hex dump of its first bytes and an image shows a scaled down copy.
+Only the start of a file is mapped into memory, so a preview costs the same for a file of any size.
+The windows pass in the function that decodes the images.
+'''
+
+import os
+import mmap
+import stat
+import codecs
+import threading
+import concurrent.futures
+
+# Application libraries.
+import common.file_metadata as file_metadata
+
+
+
+# The kinds of preview.
+KIND_NONE = 0
+KIND_TEXT = 1
+KIND_HEX = 2
+KIND_IMAGE = 3
+# The largest number of bytes read for a text preview.
+MAX_TEXT_BYTES = 16 * 1024
+# The largest number of lines in a text preview.
+MAX_TEXT_LINES = 200
+# The number of bytes in a hex dump and on each line of it.
+HEX_BYTES = 4096
+HEX_LINE_BYTES = 16
+# The largest width and height of an image preview in pixels.
+IMAGE_SIZE = 256
+# The time in milliseconds that the selection must stay on a row before its preview is read.
+PREVIEW_DELAY = 100
+
+
+
+class Preview():
+    '''
+    Class to represent the preview of a file.
+
+    :ivar str path: The path of the file.
+    :ivar int kind: One of :py:const:`KIND_NONE`, :py:const:`KIND_TEXT`, :py:const:`KIND_HEX` or :py:const:`KIND_IMAGE`.
+    :ivar str text: The text to show, the text of the file, the hex dump or a message.
+    :ivar object image: The decoded image for :py:const:`KIND_IMAGE` or None.
+    '''
+    __slots__ = ('path', 'kind', 'text', 'image')
+
+
+
+    def __init__(self, path, kind, text='', image=None):
+        ''' Class constructor for the :py:class:`Preview` class. '''
+        self.path = path
+        self.kind = kind
+        self.text = text
+        self.image = image
+
+
+
+def formatHex(data, offset=0):
+    '''
+    Returns a hex dump of some bytes with the offset, the bytes and the printable characters on each line.
+
+    :param bytes data: The bytes.
+    :param int offset: The offset of the first byte in the file.
+    '''
+    lines = []
+    for start in range(0, len(data), HEX_LINE_BYTES):
+        line = data[start:start + HEX_LINE_BYTES]
+        characters = ''.join([chr(byte) if 32 <= byte < 127 else '.' for byte in line])
+        lines.append('{:08x}  {:<{width}}  {}'.format(offset + start, line.hex(' '), characters, width=3 * HEX_LINE_BYTES - 1))
+    return '\n'.join(lines)
+
+
+
+def decodeText(data, isComplete):
+    '''
+    Returns the first lines of some bytes as text or None if the bytes do not look like UTF-8 text.
+    A character cut off at the end of the bytes is allowed unless the bytes are the whole file.
+
+    :param bytes data: The first bytes of a file.
+    :param bool isComplete: True if the bytes are the whole file.
+    '''
+    if b'\0' in data:
+        return None
+    try:
+        text = codecs.getincrementaldecoder('utf-8')().decode(data, final=isComplete)
+    except UnicodeDecodeError:
+        return None
+    lines = text.split('\n')
+    if len(lines) > MAX_TEXT_LINES:
+        lines = lines[:MAX_TEXT_LINES]
+        isComplete = False
+    text = '\n'.join(lines)
+    return text if isComplete else text + '\n' + file_metadata.PLACEHOLDER
+
+
+
+def readPreview(path, decodeImage=None):
+    '''
+    Returns the preview of a file.
+    The file is read through a memory map of its first bytes, the rest of the file is never touched.
+    This reads the file so call it on a worker thread.
+
+    :param str path: The path of the file.
+    :param decodeImage: Optional function that takes the path of an image and the largest size and returns the decoded image or None.
+    :returns: A :py:class:`Preview` object.
+    '''
+    try:
+        fileStat = os.stat(path)
+    except OSError as error:
+        return Preview(path, KIND_NONE, error.strerror)
+    if stat.S_ISDIR(fileStat.st_mode):
+        return Preview(path, KIND_NONE, 'Folder')
+    if not stat.S_ISREG(fileStat.st_mode):
+        # Opening a pipe or a device might block or have side effects.
+        return Preview(path, KIND_NONE, 'Special file')
+    contentType = file_metadata.getContentType(os.path.basename(path), False)
+    if decodeImage is not None and contentType.startswith('image/'):
+        image = decodeImage(path, IMAGE_SIZE)
+        if image is not None:
+            return Preview(path, KIND_IMAGE, contentType, image)
+    if fileStat.st_size == 0:
+        return Preview(path, KIND_TEXT, '')
+    length = min(fileStat.st_size, max(MAX_TEXT_BYTES, HEX_BYTES))
+    try:
+        with open(path, 'rb') as file:
+            try:
+                with mmap.mmap(file.fileno(), length, access=mmap.ACCESS_READ) as mapped:
+                    data = mapped[:length]
+            except (ValueError, OSError):
+                # Some file systems can not map files.
+                data = file.read(length)
+    except OSError as error:
+        return Preview(path, KIND_NONE, error.strerror)
+    text = decodeText(data[:MAX_TEXT_BYTES], fileStat.st_size <= MAX_TEXT_BYTES)
+    if text is not None:
+        return Preview(path, KIND_TEXT, text)
+    return Preview(path, KIND_HEX, formatHex(data[:HEX_BYTES]))
+
+
+
+class PreviewLoader():
+    '''
+    Class to read the preview of the selected file on a worker thread.
+    Only the latest request matters, a new request cancels the one waiting and the preview of a superseded request is dropped.
+    The callback is called on the worker thread with the :py:class:`Preview` and must hand it to the main thread.
+    '''
+
+
+
+    def __init__(self, callback, decodeImage=None):
+        '''
+        Class constructor for the :py:class:`PreviewLoader` class.
+
+        :param callback: Function that takes a :py:class:`Preview`.
+        :param decodeImage: Optional function that takes the path of an image and the largest size and returns the decoded image or None.
+        '''
+        self.callback = callback
+        self.decodeImage = decodeImage
+        # One thread, so that quick changes of the selection never read several files at once.
+        self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='Preview')
+        self.future = None
+        # Increases with each request, so that an older preview is not shown.
+        self.serial = 0
+        self.lock = threading.Lock()
+
+
+
+    def request(self, path):
+        '''
+        Read the preview of a file, replacing any earlier request.
+
+        :param str path: The path of the file.
+        '''
+        with self.lock:
+            self.serial += 1
+            if self.future is not None:
+                self.future.cancel()
+            self.future = self.executor.submit(self._read, path, self.serial)
+
+
+
+    def cancel(self):
+        ''' Cancel the current request, for example when the selection is cleared. '''
+        with self.lock:
+            self.serial += 1
+            if self.future is not None:
+                self.future.cancel()
+                self.future = None
+
+
+
+    def _read(self, path, serial):
+        ''' Read a preview.  This runs on the worker thread. '''
+        if serial != self.serial:
+            return
+        preview = readPreview(path, self.decodeImage)
+        if serial == self.serial:
+            self.callback(preview)
+
+
+
+    def shutdown(self):
+        ''' Stop the worker thread. '''
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to keep the listings and metadata of scanned folders in an SQLite database, so that a folder can be shown at once when the program starts again.
+A listing is only trusted until the folder is scanned again in the background, its stamp says if the folder has changed.
+Each listing is one row with the names and metadata packed into blobs, so reading a large folder is a few blob reads rather than a query per file.
+'''
+
+import os
+import time
+import array
+import sqlite3
+import logging
+import threading
+
+# Application libraries.
+import common.scanner as scanner
+import common.listing_cache as listing_cache
+import common.file_metadata as file_metadata
+
+
+
+logger = logging.getLogger(__name__)
+
+# The version of the tables.  The tables are made again when this changes.
+SCHEMA_VERSION = 1
+# The default largest number of folders in the index.  The least recently used folders are removed.
+MAX_FOLDERS = 1000
+
+
+
+def getDefaultFileName():
+    ''' Returns the default file of the index in the user cache folder. '''
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cacheHome, 'gtk-treeview-test', 'folders.sqlite')
+
+
+
+class FolderIndex():
+    '''
+    Class to represent the persistent index of folder listings.
+    All the methods read or write the database, so call them from a worker thread.
+    The connection is shared by the threads and used by one thread at a time.
+
+    :ivar str fileName: The database file.
+    :ivar int maxFolders: The largest number of folders in the index.
+    '''
+
+
+
+    def __init__(self, fileName=None, maxFolders=MAX_FOLDERS):
+        '''
+        Class constructor for the :py:class:`FolderIndex` class.
+        The database is opened when it is first used.
+
+        :param str fileName: The database file or None for :py:func:`getDefaultFileName`.
+        :param int maxFolders: The largest number of folders in the index.
+        '''
+        self.fileName = fileName if fileName is not None else getDefaultFileName()
+        self.maxFolders = maxFolders
+        self.connection = None
+        self.lock = threading.Lock()
+
+
+
+    def _connect(self):
+        '''
+        Returns the connection to the database, opening it and making the tables if needed.
+        Call this with :py:attr:`lock` held.
+        '''
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+            connection = sqlite3.connect(self.fileName, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                connection.execute('DROP TABLE IF EXISTS folders')
+                connection.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+            connection.execute('CREATE TABLE IF NOT EXISTS folders (folder BLOB PRIMARY KEY, device INTEGER, inode INTEGER, mtime INTEGER, used REAL, count INTEGER, names BLOB, folders BLOB, sizes BLOB, modified BLOB)')
+            connection.commit()
+            self.connection = connection
+        return self.connection
+
+
+
+    def get(self, folderName):
+        '''
+        Returns the indexed listing of a folder.
+        The listing might be out of date, compare the stamp with :py:func:`~common.listing_cache.folderStamp` to find out.
+
+        :param str folderName: The folder.
+        :returns: A tuple of the stamp and the list of :py:class:`~common.scanner.ScanEntry` objects in natural order, or None if the folder is not indexed.
+        '''
+        try:
+            with self.lock:
+                connection = self._connect()
+                row = connection.execute('SELECT device, inode, mtime, count, names, folders, sizes, modified FROM folders WHERE folder=?', (os.fsencode(folderName), )).fetchone()
+                if row is None:
+                    return None
+                connection.execute('UPDATE folders SET used=? WHERE folder=?', (time.time(), os.fsencode(folderName)))
+                connection.commit()
+        except sqlite3.Error as error:
+            logger.warning('Can not read the folder index "%s". %s', self.fileName, error)
+            return None
+        device, inode, mtime, count, names, folders, sizesBlob, modifiedBlob = row
+        names = [os.fsdecode(name) for name in names.split(b'\0')] if count > 0 else []
+        sizes = array.array('q')
+        sizes.frombytes(sizesBlob)
+        modified = array.array('d')
+        modified.frombytes(modifiedBlob)
+        if len(names) != count or len(folders) != count or len(sizes) != count or len(modified) != count:
+            return None
+        entries = []
+        for index, name in enumerate(names):
+            entry = scanner.ScanEntry(name, os.path.join(folderName, name), folders[index] != 0, None)
+            if sizes[index] != file_metadata.UNKNOWN:
+                entry.size = sizes[index]
+                entry.modified = modified[index]
+            entries.append(entry)
+        return ((device, inode, mtime), entries)
+
+
+
+    def put(self, folderName, stamp, names, folders, sizes=None, modified=None):
+        '''
+        Add or replace the listing of a folder.
+        A folder modified just before it was scanned is not indexed, for the same reason as the listing cache.
+
+        :param str folderName: The folder.
+        :param tuple stamp: The value of :py:func:`~common.listing_cache.folderStamp` from before the folder was scanned.
+        :param list names: The names of the files in natural order.
+        :param bytes folders: 1 for each folder and 0 for each file.
+        :param array sizes: Optional sizes of the files or :py:const:`~common.file_metadata.UNKNOWN`.
+        :param array modified: Optional modified times of the files or :py:const:`~common.file_metadata.UNKNOWN`.
+        '''
+        if stamp is None or time.time() - stamp[2] / 1e9 < listing_cache.RACY_SECONDS:
+            return
+        if sizes is None:
+            sizes = array.array('q', [file_metadata.UNKNOWN]) * len(names)
+        if modified is None:
+            modified = array.array('d', [file_metadata.UNKNOWN]) * len(names)
+        packedNames = b'\0'.join([os.fsencode(name) for name in names])
+        try:
+            with self.lock:
+                connection = self._connect()
+                connection.execute('REPLACE INTO folders (folder, device, inode, mtime, used, count, names, folders, sizes, modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (os.fsencode(folderName), stamp[0], stamp[1], stamp[2], time.time(), len(names), packedNames, bytes(folders), array.array('q', sizes).tobytes(), array.array('d', modified).tobytes()))
+                connection.execute('DELETE FROM folders WHERE folder NOT IN (SELECT folder FROM folders ORDER BY used DESC LIMIT ?)', (self.maxFolders, ))
+                connection.commit()
+        except sqlite3.Error as error:
+            logger.warning('Can not write the folder index "%s". %s', self.fileName, error)
+
+
+
+    def putMetadata(self, folderName, names, batches):
+        '''
+        Update the sizes and modified times of an indexed folder.
+        Nothing changes unless the indexed names are the same names in the same order.
+
+        :param str folderName: The folder.
+        :param list names: The names of the files that the metadata is for.
+        :param list batches: The :py:class:`~common.file_metadata.MetadataBatch` objects read for the names.
+        '''
+        sizes = array.array('q', [file_metadata.UNKNOWN]) * len(names)
+        modified = array.array('d', [file_metadata.UNKNOWN]) * len(names)
+        for batch in batches:
+            for index, position in enumerate(batch.positions):
+                sizes[position] = batch.sizes[index]
+                modified[position] = batch.modified[index]
+        packedNames = b'\0'.join([os.fsencode(name) for name in names])
+        try:
+            with self.lock:
+                connection = self._connect()
+                connection.execute('UPDATE folders SET sizes=?, modified=? WHERE folder=? AND count=? AND names=?', (sizes.tobytes(), modified.tobytes(), os.fsencode(folderName), len(names), packedNames))
+                connection.commit()
+        except sqlite3.Error as error:
+            logger.warning('Can not write the folder index "%s". %s', self.fileName, error)
+
+
+
+    def close(self):
+        ''' Close the database. '''
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to add up the sizes of the files under folders on a pool of worker threads.
+The files directly in each folder are added up once and cached with the stamp of the folder.
+The total of each folder is cached too and the total of a parent is built from the cached totals of its subfolders, so sizing a parent after its children only reads the parent.
+'''
+
+import os
+import time
+import threading
+import collections
+import concurrent.futures
+
+# Application libraries.
+import common.listing_cache as listing_cache
+
+
+
+# The default number of worker threads.  The threads mostly wait for the file system, so there are more than the processors.
+MAX_WORKERS = min(8, 2 * (os.cpu_count() or 1))
+# The default largest number of folders in the cache.
+MAX_FOLDERS = 200000
+# The time in seconds between the partial totals of a folder.
+PROGRESS_SECONDS = 0.2
+
+
+
+class FolderSizes():
+    '''
+    Class to add up the sizes of the files under folders for the rows that are shown.
+    Each requested folder is walked on a worker thread and the callback gets a growing partial total while it is walked, then the final total.
+    One instance can be shared by several windows, each request names the callback of its window and a walk is only stopped when every callback has cancelled it.
+    The callback is called on a worker thread with the path, the total in bytes and True for the final total.
+    The callback must hand the total to the main thread.
+    Symbolic links are not followed and count as their own size, a file with hard links counts once for each link.
+    A cached total is used while the stamp of its folder has not changed.
+    A change further down is only seen after :py:meth:`invalidate` for the changed path, which drops the totals of its ancestors, or after :py:meth:`clear`.
+    A file that changes size does not change the modified time of its folder either.
+
+    :ivar int maxFolders: The largest number of folders in the cache.
+    '''
+
+
+
+    def __init__(self, callback=None, maxWorkers=MAX_WORKERS, maxFolders=MAX_FOLDERS):
+        '''
+        Class constructor for the :py:class:`FolderSizes` class.
+        The threads are only started by the first request.
+
+        :param callback: Function that takes the path of a folder, its total size and True if the total is final.  This is the callback of the requests that do not name one.
+        :param int maxWorkers: The number of worker threads.
+        :param int maxFolders: The largest number of folders in the cache.
+        '''
+        self.callback = callback
+        self.maxWorkers = maxWorkers
+        self.maxFolders = maxFolders
+        self.executor = None
+        # The (future, event, callbacks) of the requests that have not finished by folder path.  Setting the event stops the walk.
+        self.pending = {}
+        # The [stamp, fileBytes, subfolders, total] of the walked folders, least recently used first.  The total is None until every subfolder has been added up.
+        self.folders = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+
+
+    def request(self, path, callback=None):
+        '''
+        Ask for the total size of a folder.
+        If the folder has already been asked for and has not finished then the callback is added to that request.
+
+        :param str path: The path of the folder.
+        :param callback: The callback for this request or None for the callback of the instance.
+        '''
+        callback = callback if callback is not None else self.callback
+        with self.lock:
+            waiting = self.pending.get(path)
+            if waiting is not None:
+                waiting[2].add(callback)
+                return
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(self.maxWorkers, thread_name_prefix='FolderSizes')
+            event = threading.Event()
+            future = self.executor.submit(self._walk, path, event)
+            self.pending[path] = (future, event, {callback})
+        future.add_done_callback(lambda future: self._requestDone(path, future))
+
+
+
+    def cancelExcept(self, paths, callback=None):
+        '''
+        Remove a callback from the requests except for some folders.
+        The requests with no callback left are stopped.
+        The folders already walked stay in the cache, so asking again later carries on quickly.
+
+        :param set paths: The paths of the folders to keep.
+        :param callback: The callback of the requests or None for the callback of the instance.
+        '''
+        callback = callback if callback is not None else self.callback
+        with self.lock:
+            for path, (future, event, callbacks) in list(self.pending.items()):
+                if path not in paths:
+                    callbacks.discard(callback)
+                    if len(callbacks) == 0:
+                        future.cancel()
+                        event.set()
+                        del self.pending[path]
+
+
+
+    def clear(self, callback=None):
+        '''
+        Stop the requests of a callback and empty the cache, so that the next totals read every file again.
+        The requests of the other callbacks carry on and read the folders again as they go.
+
+        :param callback: The callback of the requests or None for the callback of the instance.
+        '''
+        self.cancelExcept(set(), callback)
+        with self.lock:
+            self.folders.clear()
+
+
+
+    def invalidate(self, path):
+        '''
+        Forget the totals that a change to a file or folder affects, for example one reported by a folder monitor.
+        The cached folder itself is dropped and only the totals of its ancestors are dropped, the other branches keep theirs.
+
+        :param str path: The path that was created, removed or changed.
+        '''
+        with self.lock:
+            self.folders.pop(path, None)
+            self._invalidateAncestors(path)
+
+
+
+    def _invalidateAncestors(self, path):
+        ''' Drop the cached totals of the folders above a path.  Call this with :py:attr:`lock` held. '''
+        while True:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return
+            path = parent
+            cached = self.folders.get(path)
+            if cached is not None:
+                cached[3] = None
+
+
+
+    def _requestDone(self, path, future):
+        ''' Done callback for a request.  This is called on a worker thread. '''
+        with self.lock:
+            if self.pending.get(path, (None, ))[0] is future:
+                del self.pending[path]
+
+
+
+    def _report(self, path, event, total, isFinal):
+        ''' Pass a total to the callbacks of the request for a folder, unless the request has been stopped. '''
+        with self.lock:
+            waiting = self.pending.get(path)
+            callbacks = list(waiting[2]) if waiting is not None and waiting[1] is event and not event.is_set() else []
+        for callback in callbacks:
+            callback(path, total, isFinal)
+
+
+
+    def _readFolder(self, folderName):
+        '''
+        Returns the total size of the files directly in a folder, the paths of its subfolders and the total size of everything under it.
+        The cached values are used if the folder has not changed.
+
+        :param str folderName: The folder.
+        :returns: A tuple of the size in bytes, the list of subfolder paths and the cached total or None.
+        '''
+        stamp = listing_cache.folderStamp(folderName)
+        if stamp is None:
+            return (0, [], 0)
+        with self.lock:
+            cached = self.folders.get(folderName)
+            if cached is not None and cached[0] == stamp:
+                self.folders.move_to_end(folderName)
+                return (cached[1], cached[2], cached[3])
+            if cached is not None:
+                # The folder has changed, so the totals above it are out of date.
+                del self.folders[folderName]
+                self._invalidateAncestors(folderName)
+        fileBytes = 0
+        subfolders = []
+        try:
+            with os.scandir(folderName) as iterator:
+                for entry in iterator:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subfolders.append(entry.path)
+                        else:
+                            fileBytes += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        except OSError:
+            return (0, [], 0)
+        # A folder modified just before it was read might change again without its stamp changing.
+        if time.time() - stamp[2] / 1e9 >= listing_cache.RACY_SECONDS:
+            with self.lock:
+                self.folders[folderName] = [stamp, fileBytes, subfolders, None]
+                self.folders.move_to_end(folderName)
+                while len(self.folders) > self.maxFolders:
+                    self.folders.popitem(last=False)
+        return (fileBytes, subfolders, None)
+
+
+
+    def _setTotal(self, folderName, total):
+        ''' Cache the total size of everything under a folder, if the folder is still cached. '''
+        with self.lock:
+            cached = self.folders.get(folderName)
+            if cached is not None:
+                cached[3] = total
+
+
+
+    def _walk(self, path, event):
+        '''
+        Add up the sizes of the files under a folder.
+        The folders are visited depth first and each total is cached when all its subfolders are done, a subfolder with a cached total is not entered.
+        This runs on a worker thread and calls the callback with the partial totals.
+
+        :param str path: The folder.
+        :param threading.Event event: Set to stop the walk.
+        '''
+        fileBytes, subfolders, total = self._readFolder(path)
+        # The folders being added up as [folderName, subfolders, index of the next subfolder, total so far].
+        frames = [[path, subfolders, 0, fileBytes]] if total is None else []
+        partial = fileBytes
+        reportTime = time.monotonic() + PROGRESS_SECONDS
+        while len(frames) > 0:
+            if event.is_set():
+                return
+            frame = frames[-1]
+            folderName, subfolders, index, folderTotal = frame
+            if index < len(subfolders):
+                frame[2] += 1
+                fileBytes, childSubfolders, childTotal = self._readFolder(subfolders[index])
+                if childTotal is None:
+                    frames.append([subfolders[index], childSubfolders, 0, fileBytes])
+                    partial += fileBytes
+                else:
+                    frame[3] += childTotal
+                    partial += childTotal
+            else:
+                frames.pop()
+                self._setTotal(folderName, folderTotal)
+                if len(frames) > 0:
+                    frames[-1][3] += folderTotal
+                else:
+                    total = folderTotal
+            if time.monotonic() > reportTime:
+                self._report(path, event, partial, False)
+                reportTime = time.monotonic() + PROGRESS_SECONDS
+        self._report(path, event, total, True)
+
+
+
+    def shutdown(self):
+        ''' Stop the requests and the worker threads. '''
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+            for future, event, callbacks in self.pending.values():
+                event.set()
+            self.pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
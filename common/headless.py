@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to scan a folder without a window and write the rows to stdout as JSON Lines or CSV.
+It runs the scanning, filtering, metadata and sorting code that the windows use, so the hot path can be measured on a machine without a display.
+The statistics are written to stderr so that they do not mix with the rows.
+This module does not depend on GTK and must never import gi.
+'''
+
+import os
+import sys
+import csv
+import json
+import time
+import array
+import resource
+
+# Application libraries.
+import common.scanner as scanner
+import common.name_index as name_index
+import common.extension_index as extension_index
+import common.file_metadata as file_metadata
+import common.incremental_sort as incremental_sort
+
+
+
+# The output formats.
+FORMAT_JSONL = 'jsonl'
+FORMAT_CSV = 'csv'
+FORMATS = (FORMAT_JSONL, FORMAT_CSV)
+# The sort orders.
+SORT_NAME = 'name'
+SORT_SIZE = 'size'
+SORT_MODIFIED = 'modified'
+SORTS = (SORT_NAME, SORT_SIZE, SORT_MODIFIED)
+# The columns of the output.
+COLUMNS = ['name', 'isFolder', 'size', 'modified', 'contentType']
+
+
+
+def _readStorageBytes():
+    '''
+    Returns the number of bytes this process has read from storage so far.
+    This counts the reads of folders and inodes that os.scandir() and os.stat() cause, which the read() calls do not show.
+
+    :returns: The number of bytes or None if the operating system does not say.
+    '''
+    try:
+        with open('/proc/self/io', 'r') as file:
+            for line in file:
+                if line.startswith('read_bytes:'):
+                    return int(line.split(':')[1])
+    except (OSError, ValueError):
+        pass
+    blocks = resource.getrusage(resource.RUSAGE_SELF).ru_inblock
+    return 512 * blocks if blocks > 0 else None
+
+
+
+def _getPeakMemory():
+    ''' Returns the peak resident memory of this process in bytes. '''
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return maxRss if sys.platform == 'darwin' else 1024 * maxRss
+
+
+
+class _Writer():
+    ''' Class to write rows to a file as JSON Lines or CSV. '''
+
+
+
+    def __init__(self, file, outputFormat):
+        '''
+        Class constructor for the :py:class:`_Writer` class.
+
+        :param file: The text file to write to.
+        :param str outputFormat: One of :py:const:`FORMATS`.
+        '''
+        self.file = file
+        self.outputFormat = outputFormat
+        self.numRows = 0
+        if outputFormat == FORMAT_CSV:
+            self.csvWriter = csv.writer(file)
+            self.csvWriter.writerow(COLUMNS)
+
+
+
+    def write(self, rows):
+        '''
+        Write some rows.
+
+        :param list rows: The rows as lists of the values of :py:const:`COLUMNS`.
+        '''
+        if self.outputFormat == FORMAT_CSV:
+            self.csvWriter.writerows(rows)
+        else:
+            # Not escaped to ASCII, so a name that is not valid UTF-8 keeps its surrogates and the output writes them back as the original bytes.
+            self.file.write(''.join([json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows]))
+        self.numRows += len(rows)
+
+
+
+def scanOnly(folderName, outputFormat=FORMAT_JSONL, sortKey=SORT_NAME, reverse=False, query='', extensions=None, output=None, statistics=None):
+    '''
+    Scan a folder and write its rows.
+    With the default name order the rows are written a batch at a time as the metadata is read.
+    The other orders need all the metadata first.
+
+    :param str folderName: The folder to scan.
+    :param str outputFormat: One of :py:const:`FORMATS`.
+    :param str sortKey: One of :py:const:`SORTS`.
+    :param bool reverse: True to sort in descending order.
+    :param str query: Only write the rows whose names contain this text.
+    :param set extensions: Only write the folders and the files with these extensions, or None for every file.
+    :param output: The text file to write the rows to, stdout by default.
+    :param statistics: The text file to write the statistics to, stderr by default.
+    :returns: The exit code for the program.
+    '''
+    output = output if output is not None else sys.stdout
+    statistics = statistics if statistics is not None else sys.stderr
+    if not os.path.isdir(folderName):
+        statistics.write(f'"{folderName}" is not a folder.\n')
+        return 1
+    startTime = time.perf_counter()
+    startBytes = _readStorageBytes()
+
+    # Scan in natural order, the same as the windows.
+    entries = list(scanner.scanFolder(folderName))
+    names = [entry.name for entry in entries]
+    scanTime = time.perf_counter()
+
+    # Filter with the same indexes as the windows.
+    positions = None
+    if extensions is not None:
+        extensionIndex = extension_index.ExtensionIndex()
+        extensionIndex.addEntries(entries)
+        positions = extensionIndex.getPositions(extensions)
+    if query != '':
+        # One query does not pay for building a trigram index.
+        positions = name_index.searchLinear(names, query, positions)
+    if positions is None:
+        positions = range(len(entries))
+    positions = array.array('I', positions)
+
+    writer = _Writer(output, outputFormat)
+    if sortKey == SORT_NAME and not reverse:
+        for batch in file_metadata.readMetadata(folderName, names, positions):
+            writer.write([[names[position], entries[position].isFolder, batch.sizes[index], batch.modified[index], batch.contentTypes[index]] for index, position in enumerate(batch.positions)])
+    else:
+        sizes = array.array('q')
+        modified = array.array('d')
+        contentTypes = []
+        for batch in file_metadata.readMetadata(folderName, names, positions):
+            sizes.extend(batch.sizes)
+            modified.extend(batch.modified)
+            contentTypes.extend(batch.contentTypes)
+        # Sort the filtered rows with the same incremental sort as the GTK4 window, run to the end.
+        values = range(len(positions)) if sortKey == SORT_NAME else sizes if sortKey == SORT_SIZE else modified
+        sorter = incremental_sort.IncrementalSort(len(positions), lambda start, stop: list(values[start:stop]), reverse)
+        while not sorter.step():
+            pass
+        for start in range(0, len(sorter.result), scanner.MAX_BATCH_SIZE):
+            writer.write([[names[positions[index]], entries[positions[index]].isFolder, sizes[index], modified[index], contentTypes[index]] for index in sorter.result[start:start + scanner.MAX_BATCH_SIZE]])
+    output.flush()
+
+    endTime = time.perf_counter()
+    endBytes = _readStorageBytes()
+    elapsed = endTime - startTime
+    statistics.write(f'Scanned {len(entries)} entries in {scanTime - startTime:.3f}s, wrote {writer.numRows} rows in {elapsed:.3f}s.\n')
+    statistics.write(f'Throughput {len(entries) / elapsed if elapsed > 0 else 0:.0f} entries/s.\n')
+    if startBytes is not None and endBytes is not None:
+        statistics.write(f'Read {endBytes - startBytes} bytes from storage.\n')
+    statistics.write(f'Peak memory {_getPeakMemory() / (1024 * 1024):.1f}MiB.\n')
+    return 0
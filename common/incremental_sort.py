@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to sort a large list a slice at a time, so that a window can sort in idle time without blocking.
+A sorted list of positions can also follow changes to the list without being sorted again.
+It is used by the sort model of the GTK4 front end and by the headless mode.
+'''
+
+import array
+import bisect
+
+
+
+# The number of items sorted or merged by each step.
+CHUNK_SIZE = 32768
+
+
+
+class IncrementalSort():
+    '''
+    Class to sort the positions of a list by precomputed keys with a bounded amount of work per call of :py:meth:`step`.
+    First the keys are read and sorted in chunks, then the chunks are merged in pairs a slice at a time.
+    Each slice of a merge finds its end with a binary search and is merged by the built in sort, which finds the two runs.
+    The sort is stable, so rows with equal keys stay in the order of the list.
+
+    :ivar list result: The positions in sorted order, None until the sort is finished.
+    '''
+
+
+
+    def __init__(self, count, readKeys, reverse=False, chunkSize=CHUNK_SIZE):
+        '''
+        Class constructor for the :py:class:`IncrementalSort` class.
+
+        :param int count: The number of positions to sort.
+        :param readKeys: Function that takes a start and a stop position and returns the list of the keys of those positions.  The keys must be numbers.
+        :param bool reverse: True to sort in descending order.
+        :param int chunkSize: The number of positions sorted or merged by each step.
+        '''
+        self.count = count
+        self.readKeys = readKeys
+        self.reverse = reverse
+        self.chunkSize = chunkSize
+        self.result = None
+        # The keys by position, negated for a descending sort.
+        self.keys = []
+        # The sorted runs waiting to be merged and the runs merged in this pass, in list order.
+        self.runs = []
+        self.mergedRuns = []
+        # The merge in progress as [first, second, firstIndex, secondIndex, merged].
+        self.merge = None
+
+
+
+    def step(self):
+        '''
+        Do the next slice of the sort.
+
+        :returns: True when the sort is finished and :py:attr:`result` is set.
+        '''
+        if self.result is not None:
+            return True
+
+        start = len(self.keys)
+        if start < self.count:
+            keys = self.readKeys(start, min(start + self.chunkSize, self.count))
+            if self.reverse:
+                keys = [-key for key in keys]
+            self.keys.extend(keys)
+            run = list(range(start, len(self.keys)))
+            run.sort(key=self.keys.__getitem__)
+            self.runs.append(run)
+            return False
+
+        if self.merge is None:
+            if len(self.runs) < 2:
+                self.runs = self.mergedRuns + self.runs
+                self.mergedRuns = []
+                if len(self.runs) < 2:
+                    self.result = self.runs[0] if len(self.runs) == 1 else []
+                    self.keys = []
+                    return True
+            self.merge = [self.runs.pop(0), self.runs.pop(0), 0, 0, []]
+        self._mergeSlice()
+        return False
+
+
+
+    def _mergeSlice(self):
+        ''' Merge the next slice of the two runs in :py:attr:`merge`. '''
+        first, second, firstIndex, secondIndex, merged = self.merge
+        getKey = self.keys.__getitem__
+        firstEnd = min(firstIndex + self.chunkSize, len(first))
+        secondEnd = min(secondIndex + self.chunkSize, len(second))
+        if firstEnd == len(first) and secondEnd == len(second):
+            # The rest of both runs.
+            pass
+        elif secondEnd == len(second) or (firstEnd < len(first) and getKey(first[firstEnd - 1]) <= getKey(second[secondEnd - 1])):
+            # Everything in the second run before the last key of this slice of the first run.
+            secondEnd = bisect.bisect_left(second, getKey(first[firstEnd - 1]), secondIndex, key=getKey)
+        else:
+            # Everything in the first run up to and including the last key of this slice of the second run.
+            firstEnd = bisect.bisect_right(first, getKey(second[secondEnd - 1]), firstIndex, key=getKey)
+        slice = first[firstIndex:firstEnd] + second[secondIndex:secondEnd]
+        slice.sort(key=getKey)
+        merged.extend(slice)
+        if firstEnd == len(first) and secondEnd == len(second):
+            self.mergedRuns.append(merged)
+            self.merge = None
+        else:
+            self.merge[2] = firstEnd
+            self.merge[3] = secondEnd
+
+
+
+def remapPositions(positions, position, numRemoved, numAdded):
+    '''
+    Returns the positions of rows in a list after a splice on the list.
+    The removed rows are dropped and the rows after the change are moved.
+
+    :param positions: The positions before the splice.
+    :param int position: The position of the splice.
+    :param int numRemoved: The number of rows removed.
+    :param int numAdded: The number of rows inserted.
+    :returns: The array of the positions after the splice.
+    '''
+    delta = numAdded - numRemoved
+    end = position + numRemoved
+    return array.array('I', [index if index < position else index + delta for index in positions if index < position or index >= end])
+
+
+
+def mergePositions(positions, newPositions, getKey):
+    '''
+    Returns sorted positions with more positions merged in.
+    Each new position is found with a binary search and the runs between them are copied as slices, so the keys of the sorted positions are not read again.
+
+    :param positions: The positions sorted by getKey.
+    :param newPositions: The positions to add.
+    :param getKey: Function that takes a position and returns its key.
+    :returns: A tuple of the array of the merged positions and the first and last place in the old positions where a position was added.
+    '''
+    newPositions = sorted(newPositions, key=getKey)
+    if len(newPositions) == 0:
+        return (positions, 0, 0)
+    places = [bisect.bisect_right(positions, getKey(newPosition), key=getKey) for newPosition in newPositions]
+    merged = array.array('I')
+    previous = 0
+    for place, newPosition in zip(places, newPositions):
+        merged.extend(positions[previous:place])
+        merged.append(newPosition)
+        previous = place
+    merged.extend(positions[previous:])
+    return (merged, places[0], places[-1])
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to keep the listings of recently scanned folders in memory.
+'''
+
+import os
+import time
+import collections
+
+
+
+# The default largest total number of entries in the cache.
+MAX_ENTRIES = 1000000
+# A folder modified less than this number of seconds before it was scanned is not cached.
+# The modified time might not change again if the folder changes again within the file system timestamp resolution.
+RACY_SECONDS = 2.0
+
+
+
+def folderStamp(folderName):
+    '''
+    Returns the stamp used to decide if a cached listing is still valid.
+    Adding, removing or renaming a file changes the modified time of the folder.
+    Read this before scanning the folder so that changes during the scan make the listing invalid.
+
+    :param str folderName: The folder.
+    :returns: A tuple of the device, inode and modified time in nanoseconds or None if the folder can not be read.
+    '''
+    try:
+        stat = os.stat(folderName)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+
+
+
+class ListingCache():
+    '''
+    Class to represent a least recently used cache of folder listings.
+    A listing is any object, for example a list of :py:class:`~common.scanner.ScanEntry` objects or a list of rows for a model.
+    The cache is not thread safe, use it from the main thread only.
+
+    :ivar int maxEntries: The largest total number of entries in the listings.
+    :ivar int numEntries: The current total number of entries in the listings.
+    :ivar int hits: The number of times :py:meth:`get` returned a listing.
+    :ivar int misses: The number of times :py:meth:`get` did not return a listing.
+    '''
+
+
+
+    def __init__(self, maxEntries=MAX_ENTRIES):
+        '''
+        Class constructor for the :py:class:`ListingCache` class.
+
+        :param int maxEntries: The largest total number of entries in the listings.
+        '''
+        self.maxEntries = maxEntries
+        self.numEntries = 0
+        self.hits = 0
+        self.misses = 0
+        # The (stamp, listing, numEntries) tuples by folder name, least recently used first.
+        self.listings = collections.OrderedDict()
+
+
+
+    def get(self, folderName):
+        '''
+        Returns the cached listing of a folder if the folder has not changed since it was scanned.
+
+        :param str folderName: The folder.
+        :returns: The listing or None.
+        '''
+        cached = self.listings.get(folderName)
+        if cached is not None:
+            if cached[0] == folderStamp(folderName):
+                self.listings.move_to_end(folderName)
+                self.hits += 1
+                return cached[1]
+            self.remove(folderName)
+        self.misses += 1
+        return None
+
+
+
+    def put(self, folderName, stamp, listing, numEntries):
+        '''
+        Add the listing of a folder to the cache.
+        The least recently used listings are removed to keep the cache within :py:attr:`maxEntries`.
+
+        :param str folderName: The folder.
+        :param tuple stamp: The value of :py:func:`folderStamp` from before the folder was scanned.
+        :param object listing: The listing to cache.
+        :param int numEntries: The number of entries in the listing.
+        '''
+        self.remove(folderName)
+        if stamp is None or numEntries > self.maxEntries:
+            return
+        if time.time() - stamp[2] / 1e9 < RACY_SECONDS:
+            return
+        self.listings[folderName] = (stamp, listing, numEntries)
+        self.numEntries += numEntries
+        while self.numEntries > self.maxEntries:
+            oldFolderName, oldCached = self.listings.popitem(last=False)
+            self.numEntries -= oldCached[2]
+
+
+
+    def remove(self, folderName):
+        '''
+        Remove the listing of a folder from the cache.
+
+        :param str folderName: The folder.
+        '''
+        cached = self.listings.pop(folderName, None)
+        if cached is not None:
+            self.numEntries -= cached[2]
+
+
+
+    def clear(self):
+        ''' Remove all the listings from the cache. '''
+        self.listings.clear()
+        self.numEntries = 0
+
+
+
+    def getStatistics(self):
+        '''
+        Returns the statistics of the cache.
+
+        :returns: A dictionary with the hits, misses, listings and entries.
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'listings': len(self.listings), 'entries': self.numEntries}
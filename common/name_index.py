@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module for a substring index over file names.
+'''
+
+import array
+import bisect
+
+
+
+# The length of the substrings in the index.
+GRAM_LENGTH = 3
+
+
+
+def normalise(text):
+    '''
+    Returns the text in the form that is compared, so searches ignore case.
+
+    :param str text: The name or the query.
+    '''
+    return text.casefold()
+
+
+
+def searchLinear(names, query, ids=None):
+    '''
+    Returns the positions of the names that contain the query by checking every name.
+    This is used for short queries and when there is no index.
+
+    :param list names: The names.
+    :param str query: The text to find.
+    :param ids: Optional positions to check instead of all of them.
+    :returns: The ascending list of the positions of the matching names.
+    '''
+    query = normalise(query)
+    if ids is None:
+        return [id for id, name in enumerate(names) if query in normalise(name)]
+    return [id for id in ids if query in normalise(names[id])]
+
+
+
+class NameIndex():
+    '''
+    Class to represent a trigram index over a list of names.
+    Each three character substring maps to the ascending positions of the names that contain it.
+    A query of three or more characters only checks the names in the shortest list of its trigrams.
+    A query that extends the previous query only checks the previous results.
+    The names are kept under ids that do not change when names are inserted or removed in the middle, see :py:meth:`splice`.
+
+    :ivar int size: The number of names in the index.
+    '''
+
+
+
+    def __init__(self, names=None):
+        '''
+        Class constructor for the :py:class:`NameIndex` class.
+
+        :param list names: Optional names to add.
+        '''
+        self.size = 0
+        # The normalised names by id, None for a removed name.
+        self.names = []
+        # The id of the name at each position or None while the ids are the positions.
+        self.ids = None
+        # The position of each id, worked out again when the ids have changed.
+        self.idPositions = None
+        # The positions of the names by trigram.
+        self.grams = {}
+        # The previous query and its results.
+        self.lastQuery = None
+        self.lastResults = None
+        if names is not None:
+            self.addNames(names)
+
+
+
+    def addNames(self, names):
+        '''
+        Add names to the end of the index.
+        The position of a name is the number of names added before it.
+
+        :param names: The names to add.
+        '''
+        names = list(names)
+        if self.ids is not None:
+            self.ids.extend(range(len(self.names), len(self.names) + len(names)))
+        self._addIds(names)
+
+
+
+    def _addIds(self, names):
+        '''
+        Give names the next ids and add them to the posting lists.
+        The caller puts the ids at their positions.
+
+        :param list names: The names to add.
+        '''
+        grams = self.grams
+        for name in names:
+            name = normalise(name)
+            id = len(self.names)
+            self.names.append(name)
+            self.size += 1
+            for gram in {name[index:index + GRAM_LENGTH] for index in range(len(name) - GRAM_LENGTH + 1)}:
+                posting = grams.get(gram)
+                if posting is None:
+                    grams[gram] = array.array('I', [id])
+                else:
+                    posting.append(id)
+        self.lastQuery = None
+        self.lastResults = None
+        self.idPositions = None
+
+
+
+    def splice(self, position, numberToRemove, names):
+        '''
+        Remove names and insert new names at the specified position, the same as a splice on the list.
+        The removed names are marked as removed and the new names get new ids, so no posting list is rebuilt.
+        The index is compacted when the removed names outnumber the names in it.
+
+        :param int position: The position of the first name to remove.
+        :param int numberToRemove: The number of names to remove.
+        :param list names: The names to insert.
+        '''
+        if position == self.size and numberToRemove == 0:
+            self.addNames(names)
+            return
+        if position == 0 and numberToRemove == self.size:
+            # Every name is replaced, for example when another folder is shown.
+            self._reset(names)
+            return
+        if self.ids is None:
+            self.ids = array.array('I', range(self.size))
+        for id in self.ids[position:position + numberToRemove]:
+            self.names[id] = None
+        end = len(self.names)
+        self.ids[position:position + numberToRemove] = array.array('I', range(end, end + len(names)))
+        self.size -= numberToRemove
+        self._addIds(names)
+        if len(self.names) - self.size > self.size:
+            self._compact()
+
+
+
+    def _compact(self):
+        ''' Build the index again from the names that have not been removed, so that the ids are the positions again. '''
+        self._reset([self.names[id] for id in self.ids])
+
+
+
+    def _reset(self, names):
+        '''
+        Replace all the names in the index.
+
+        :param list names: The new names.
+        '''
+        self.size = 0
+        self.names = []
+        self.ids = None
+        self.grams = {}
+        self.addNames(names)
+
+
+
+    def _getPositions(self, ids):
+        '''
+        Returns the ascending positions of the names with some ids.
+
+        :param list ids: The ids of names that have not been removed.
+        '''
+        if self.ids is None:
+            return ids
+        if self.idPositions is None:
+            self.idPositions = array.array('I', [0]) * len(self.names)
+            for position, id in enumerate(self.ids):
+                self.idPositions[id] = position
+        idPositions = self.idPositions
+        return sorted([idPositions[id] for id in ids])
+
+
+
+    def search(self, query):
+        '''
+        Returns the positions of the names that contain the query.
+
+        :param str query: The text to find.
+        :returns: The ascending list of the positions of the matching names.
+        '''
+        query = normalise(query)
+        if query == '':
+            return list(range(self.size))
+
+        # The candidates are the shortest posting list of the trigrams in the query.
+        candidates = None
+        if len(query) >= GRAM_LENGTH:
+            for index in range(len(query) - GRAM_LENGTH + 1):
+                posting = self.grams.get(query[index:index + GRAM_LENGTH])
+                if posting is None:
+                    # No name has this trigram.
+                    candidates = []
+                    break
+                if candidates is None or len(posting) < len(candidates):
+                    candidates = posting
+
+        # A refined query only needs to check the previous results.
+        if self.lastQuery is not None and self.lastQuery in query:
+            if candidates is None or len(self.lastResults) < len(candidates):
+                candidates = self.lastResults
+
+        names = self.names
+        if candidates is None:
+            results = [id for id, name in enumerate(names) if name is not None and query in name]
+        else:
+            results = [id for id in candidates if names[id] is not None and query in names[id]]
+        self.lastQuery = query
+        self.lastResults = results
+        return self._getPositions(results)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to record timed spans and counters while the program runs and write them as a Chrome trace.
+Open the trace in chrome://tracing or https://ui.perfetto.dev to see where the time goes.
+Nothing is recorded unless :py:func:`start` is called, usually by the --profile option.
+Call :py:func:`start` before importing the windows, :py:func:`timed` leaves the functions unchanged when profiling is off.
+'''
+
+import os
+import time
+import json
+import atexit
+import logging
+import functools
+import threading
+
+
+
+logger = logging.getLogger(__name__)
+
+# True to record the spans.
+enabled = False
+
+# The file to write the trace to.
+fileName = None
+
+# The time profiling started.  The times in the trace are from here.
+startTime = time.perf_counter()
+
+# The recorded trace events.  Appending to a list is safe from any thread.
+events = []
+
+# The time of the previous frame or None.
+previousFrameTime = None
+
+
+
+def start(traceFileName):
+    '''
+    Start recording and write the trace to a file when the program exits.
+
+    :param str traceFileName: The file to write the trace to.
+    '''
+    global enabled, fileName, startTime
+    enabled = True
+    fileName = traceFileName
+    startTime = time.perf_counter()
+    atexit.register(write)
+
+
+
+def _now():
+    ''' Returns the time since :py:data:`startTime` in microseconds. '''
+    return 1e6 * (time.perf_counter() - startTime)
+
+
+
+class _Span():
+    ''' Class to represent a span that is being timed.  Use it as a context manager. '''
+    __slots__ = ('name', 'category', 'args', 'beginTime')
+
+
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.beginTime = 0.0
+
+
+
+    def __enter__(self):
+        self.beginTime = _now()
+        return self
+
+
+
+    def __exit__(self, excType, excValue, traceback):
+        endTime = _now()
+        event = {'name': self.name, 'cat': self.category, 'ph': 'X', 'ts': self.beginTime, 'dur': endTime - self.beginTime, 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if self.args:
+            event['args'] = self.args
+        events.append(event)
+        return False
+
+
+
+class _NoSpan():
+    ''' Class to represent a span when profiling is off.  It does nothing. '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+
+
+NO_SPAN = _NoSpan()
+
+
+
+def span(name, category='app', **args):
+    '''
+    Returns a context manager that records the time of the code in the with block.
+
+    :param str name: The name of the span.
+    :param str category: The category of the span.
+    :param args: Values to show with the span in the trace.
+    '''
+    if not enabled:
+        return NO_SPAN
+    return _Span(name, category, args)
+
+
+
+def timed(name=None, category='app'):
+    '''
+    Decorator to record the time of every call of a function.
+    If profiling is off when the function is defined then the function is returned unchanged, so it costs nothing.
+
+    :param str name: The name of the spans or None to use the name of the function.
+    :param str category: The category of the spans.
+    '''
+    def decorator(function):
+        if not enabled:
+            return function
+        spanName = name if name is not None else function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Span(spanName, category, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+
+def counter(name, **values):
+    '''
+    Record the values of a counter.
+
+    :param str name: The name of the counter.
+    :param values: The numbers to record.
+    '''
+    if enabled:
+        events.append({'name': name, 'ph': 'C', 'ts': _now(), 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': values})
+
+
+
+def frame():
+    '''
+    Record that a frame has been painted.
+    The time since the previous frame is recorded as a counter, so slow frames show as peaks.
+    Call this from the 'after-paint' signal of the frame clock.
+    '''
+    global previousFrameTime
+    if not enabled:
+        return
+    frameTime = _now()
+    if previousFrameTime is not None:
+        counter('Frame', ms=(frameTime - previousFrameTime) / 1000)
+    previousFrameTime = frameTime
+
+
+
+def write():
+    ''' Write the recorded events to :py:data:`fileName` as a Chrome trace. '''
+    if not enabled or fileName is None:
+        return
+    threadNames = {thread.ident: thread.name for thread in threading.enumerate()}
+    metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': threadName}} for ident, threadName in threadNames.items()]
+    try:
+        with open(fileName, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, file)
+    except OSError as error:
+        logger.error('Can not write the profile to "%s". %s', fileName, error)
+        return
+    logger.info('Wrote %d profile events to "%s".', len(events), fileName)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module for the scan service that all the windows of the application share.
+The folders are listed and their metadata read on one bounded pool of worker threads.
+A folder asked for by several windows at the same time is only listed once, the other windows wait for that listing.
+The listings and the metadata are cached for all the windows, so a window opened on a folder that another window has shown does not scan it again.
+The service also holds the thumbnail loader, the folder sizes and the duplicate finder, so the windows share one pool of each.
+It is used by the GTK4 front end, the GTK3 window lists its folder itself.
+'''
+
+import os
+import time
+import logging
+import threading
+import collections
+import concurrent.futures
+
+# Application libraries.
+import common.scanner as scanner
+import common.listing_cache as listing_cache
+import common.file_metadata as file_metadata
+import common.folder_index as folder_index
+import common.thumbnails as thumbnails
+import common.folder_sizes as folder_sizes
+import common.duplicates as duplicates
+
+
+
+# The default number of worker threads.  Each listing or metadata read is one task.
+MAX_WORKERS = min(8, 2 * (os.cpu_count() or 1))
+# The time in seconds that a metadata read is shared with later requests.
+# A file that changes size does not change the stamp of its folder, so the metadata is only trusted for a short time.
+METADATA_SECONDS = 10.0
+# The default largest number of folders with cached metadata.
+MAX_METADATA_FOLDERS = 64
+# The default largest total number of entries in the cached folder entries.
+MAX_CACHED_ENTRIES = 200000
+
+logger = logging.getLogger(__name__)
+
+
+
+class _Flight():
+    '''
+    Class to represent a listing or a metadata read that is in progress.
+    The other requests for the same folder wait for it to finish.
+
+    :ivar threading.Event event: Set when the read has finished.
+    :ivar object result: The result or None if the read was cancelled.
+    '''
+    __slots__ = ('event', 'result')
+
+
+
+    def __init__(self):
+        ''' Class constructor for the :py:class:`_Flight` class. '''
+        self.event = threading.Event()
+        self.result = None
+
+
+
+def _logException(future):
+    ''' Done callback to log the exception of a task. '''
+    if not future.cancelled() and future.exception() is not None:
+        logger.error('Scan service task failed.', exc_info=future.exception())
+
+
+
+class ScanService():
+    '''
+    Class to represent the scan service of the application.
+    The methods that read the file system block, so call them from a task started with :py:meth:`submit`.
+
+    :ivar ListingCache listingCache: The cached listings of the folders.  Use it with :py:attr:`lock` held.
+    :ivar ListingCache entryCache: The cached (stamp, entries) of the folders listed by :py:meth:`listFolder`.  Use it with :py:attr:`lock` held.
+    :ivar FolderIndex folderIndex: The persistent index of folder listings or None if it is turned off.
+    :ivar ThumbnailLoader thumbnailLoader: The thumbnail loader of the windows.  Each window names its callback in its requests.
+    :ivar FolderSizes folderSizes: The folder sizes of the windows.  Each window names its callback in its requests.
+    :ivar DuplicateFinder duplicateFinder: The duplicate finder of the windows, which lists the folders through :py:meth:`listFolder`.
+    :ivar int numListings: The number of times a folder was listed.
+    :ivar int numShared: The number of listings that were shared from another request.
+    '''
+
+
+
+    def __init__(self, maxWorkers=MAX_WORKERS, maxEntries=listing_cache.MAX_ENTRIES, isIndexed=False):
+        '''
+        Class constructor for the :py:class:`ScanService` class.
+
+        :param int maxWorkers: The number of worker threads.
+        :param int maxEntries: The largest total number of entries in the cached listings.
+        :param bool isIndexed: True to keep the listings in the persistent folder index.
+        '''
+        self.executor = concurrent.futures.ThreadPoolExecutor(maxWorkers, thread_name_prefix='ScanService')
+        self.listingCache = listing_cache.ListingCache(maxEntries)
+        self.entryCache = listing_cache.ListingCache(MAX_CACHED_ENTRIES)
+        self.folderIndex = folder_index.FolderIndex() if isIndexed else None
+        # The pools of these are only started by their first requests.
+        self.thumbnailLoader = thumbnails.ThumbnailLoader()
+        self.folderSizes = folder_sizes.FolderSizes()
+        self.duplicateFinder = duplicates.DuplicateFinder(duplicates.HashCache(), listFolder=self.listFolder)
+        self.numListings = 0
+        self.numShared = 0
+        # The listings in progress by folder name.
+        self.listings = {}
+        # The metadata reads in progress by folder name.
+        self.metadataReads = {}
+        # The (time, stamp, names, batches) of the recent metadata reads by folder name, least recently used first.
+        self.metadata = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+
+
+    def submit(self, function, *args):
+        '''
+        Run a function on the worker threads.
+
+        :param function: The function.
+        :param args: The arguments of the function.
+        :returns: The concurrent.futures.Future of the task.
+        '''
+        future = self.executor.submit(function, *args)
+        # A thread of its own would print an exception, a future keeps it unless it is logged.
+        future.add_done_callback(_logException)
+        return future
+
+
+
+    def _join(self, flights, key):
+        '''
+        Returns the flight in progress for a key and False, or a new flight for the caller to run and True.
+        Call this with :py:attr:`lock` held.
+        '''
+        flight = flights.get(key)
+        if flight is not None:
+            return (flight, False)
+        flight = _Flight()
+        flights[key] = flight
+        return (flight, True)
+
+
+
+    def _land(self, flights, key, flight, result):
+        ''' Finish a flight with its result and wake the requests waiting for it. '''
+        with self.lock:
+            if flights.get(key) is flight:
+                del flights[key]
+        flight.result = result
+        flight.event.set()
+
+
+
+    def getListing(self, folderName):
+        '''
+        Returns the cached listing of a folder if the folder has not changed since it was scanned.
+        The listings are shared by all the windows.
+
+        :param str folderName: The folder.
+        :returns: The listing or None.
+        '''
+        with self.lock:
+            return self.listingCache.get(folderName)
+
+
+
+    def putListing(self, folderName, stamp, listing, numEntries):
+        '''
+        Add the listing of a folder to the shared cache, see :py:meth:`~common.listing_cache.ListingCache.put`.
+        The listing is shared by the windows, so it must not be changed once it is added.
+
+        :param str folderName: The folder.
+        :param tuple stamp: The stamp of the folder from before it was scanned.
+        :param object listing: The listing to cache.
+        :param int numEntries: The number of entries in the listing.
+        '''
+        with self.lock:
+            self.listingCache.put(folderName, stamp, listing, numEntries)
+
+
+
+    def listFolder(self, folderName, isCancelled=None, onBatch=None):
+        '''
+        Returns the entries of a folder.
+        The cached entries are used if the folder has not changed.
+        If another request is listing the folder then this waits for its entries instead of listing the folder again.
+        Call this from a worker thread.
+
+        :param str folderName: The folder.
+        :param isCancelled: Optional function that returns True to stop early.
+        :param onBatch: Optional function that takes a list of :py:class:`~common.scanner.ScanEntry` objects.  It is called as the entries are read or with the entries of the other request.
+        :returns: A tuple of the stamp from before the listing and the list of entries in natural order, or None if cancelled.
+        '''
+        isCancelled = isCancelled if isCancelled is not None else lambda: False
+        while True:
+            with self.lock:
+                shared = self.entryCache.get(folderName)
+                if shared is None:
+                    flight, isLeader = self._join(self.listings, folderName)
+                    if isLeader:
+                        break
+            if shared is None:
+                while not flight.event.wait(0.1):
+                    if isCancelled():
+                        return None
+                # A cancelled listing has no result, so this request lists the folder instead.
+                shared = flight.result
+            if shared is not None:
+                with self.lock:
+                    self.numShared += 1
+                if onBatch is not None:
+                    for batch in scanner.batches(shared[1]):
+                        if isCancelled():
+                            return None
+                        onBatch(batch)
+                return shared
+
+        result = None
+        try:
+            stamp = listing_cache.folderStamp(folderName)
+            entries = []
+            for batch in scanner.batches(scanner.scanFolder(folderName, isCancelled=isCancelled)):
+                if isCancelled():
+                    break
+                entries.extend(batch)
+                if onBatch is not None:
+                    onBatch(batch)
+            if not isCancelled():
+                result = (stamp, entries)
+                with self.lock:
+                    self.numListings += 1
+                    self.entryCache.put(folderName, stamp, result, len(entries))
+        finally:
+            self._land(self.listings, folderName, flight, result)
+        return result
+
+
+
+    def readMetadata(self, folderName, names, positions=None, isCancelled=None):
+        '''
+        Generator for the metadata of files in a folder, the same as :py:func:`~common.file_metadata.readMetadata`.
+        A read of every row is shared with the other requests for the same names for :py:const:`METADATA_SECONDS`.
+        If another request is reading the same names then this waits for its batches.
+
+        :param str folderName: The folder that holds the files.
+        :param list names: The names of the rows in the list.
+        :param positions: Optional positions of the rows to read, otherwise every row is read.
+        :param isCancelled: Optional function that returns True to stop early.
+        '''
+        if positions is not None:
+            yield from file_metadata.readMetadata(folderName, names, positions, isCancelled)
+            return
+        isCancelled = isCancelled if isCancelled is not None else lambda: False
+        stamp = listing_cache.folderStamp(folderName)
+        while True:
+            with self.lock:
+                cached = self.metadata.get(folderName)
+                if cached is not None and time.monotonic() - cached[0] < METADATA_SECONDS and cached[1] == stamp and cached[2] == names:
+                    self.metadata.move_to_end(folderName)
+                    # The batches are yielded after the lock is released, the caller may take its time over each one.
+                    batches = list(cached[3])
+                else:
+                    batches = None
+                    flight, isLeader = self._join(self.metadataReads, folderName)
+            if batches is not None:
+                yield from batches
+                return
+            if isLeader:
+                break
+            while not flight.event.wait(0.1):
+                if isCancelled():
+                    return
+            if flight.result is not None and flight.result[2] == names:
+                yield from flight.result[3]
+                return
+            if flight.result is not None:
+                # The other request was for different names, read them here.
+                yield from file_metadata.readMetadata(folderName, names, None, isCancelled)
+                return
+
+        result = None
+        try:
+            batches = []
+            for batch in file_metadata.readMetadata(folderName, names, None, isCancelled):
+                batches.append(batch)
+                yield batch
+            if not isCancelled():
+                result = (time.monotonic(), stamp, names, batches)
+                with self.lock:
+                    self.metadata[folderName] = result
+                    self.metadata.move_to_end(folderName)
+                    while len(self.metadata) > MAX_METADATA_FOLDERS:
+                        self.metadata.popitem(last=False)
+        finally:
+            self._land(self.metadataReads, folderName, flight, result)
+
+
+
+    def forget(self, folderName):
+        '''
+        Remove the cached listing and metadata of a folder, so that the next request reads it again.
+
+        :param str folderName: The folder.
+        '''
+        with self.lock:
+            self.listingCache.remove(folderName)
+            self.entryCache.remove(folderName)
+            self.metadata.pop(folderName, None)
+
+
+
+    def getStatistics(self):
+        ''' Returns a dictionary of the number of scans, the number shared and the statistics of the listing cache. '''
+        with self.lock:
+            return dict(scans=self.numListings, shared=self.numShared, **self.listingCache.getStatistics())
+
+
+
+    def shutdown(self):
+        ''' Stop the worker threads and processes and close the folder index and the hash cache. '''
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.thumbnailLoader.shutdown()
+        self.folderSizes.shutdown()
+        self.duplicateFinder.shutdown()
+        if self.folderIndex is not None:
+            self.folderIndex.close()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to scan the files in a folder.
+This module does not depend on GTK so it is shared by the GTK3 and GTK4 windows.
+It can be imported on a machine without a display.
+'''
+
+import os
+import re
+import locale
+import operator
+
+
+
+# The number of entries in the first batch from :py:func:`batches`.
+FIRST_BATCH_SIZE = 64
+# The largest number of entries in a batch from :py:func:`batches`.
+MAX_BATCH_SIZE = 4096
+
+# The runs of digits in a name.
+NUMBERS = re.compile(r'(\d+)')
+
+
+
+class ScanEntry():
+    '''
+    Class to represent a file found by :py:func:`scanFolder`.
+
+    :ivar str name: The name of the file.
+    :ivar str path: The full path of the file.
+    :ivar bool isFolder: True if the file is a folder.
+    :ivar str extension: The lower case extension of the file including the '.' or an empty string.
+    :ivar int size: The size of the file in bytes or None if not known.
+    :ivar float modified: The modified time of the file or None if not known.
+    :ivar int inode: The inode number of the file or None if not known.
+    '''
+    __slots__ = ('name', 'path', 'isFolder', 'extension', 'size', 'modified', 'inode')
+
+
+
+    def __init__(self, name, path, isFolder, inode, size=None, modified=None):
+        '''
+        Class constructor for the :py:class:`ScanEntry` class.
+
+        :param str name: The name of the file.
+        :param str path: The full path of the file.
+        :param bool isFolder: True if the file is a folder.
+        :param int inode: The inode number of the file or None if not known.
+        :param int size: The size of the file in bytes or None if not known.
+        :param float modified: The modified time of the file or None if not known.
+        '''
+        self.name = name
+        self.path = path
+        self.isFolder = isFolder
+        self.extension = os.path.splitext(name)[1].lower()
+        self.inode = inode
+        self.size = size
+        self.modified = modified
+
+
+
+    def __repr__(self):
+        return f'ScanEntry({self.name!r})'
+
+
+
+def entryFromDirEntry(dirEntry, withStat=False):
+    '''
+    Returns a :py:class:`ScanEntry` for an entry from os.scandir().
+    The type and inode come from the folder listing so no extra system calls are needed unless withStat is True.
+
+    :param os.DirEntry dirEntry: The entry from os.scandir().
+    :param bool withStat: True to read the size and modified time.
+    '''
+    try:
+        isFolder = dirEntry.is_dir()
+    except OSError:
+        isFolder = False
+    entry = ScanEntry(dirEntry.name, dirEntry.path, isFolder, dirEntry.inode())
+    if withStat:
+        try:
+            stat = dirEntry.stat()
+            entry.size = stat.st_size
+            entry.modified = stat.st_mtime
+        except OSError:
+            pass
+    return entry
+
+
+
+def entryFromPath(path, withStat=False):
+    '''
+    Returns a :py:class:`ScanEntry` for a single file or None if the file does not exist.
+
+    :param str path: The full path of the file.
+    :param bool withStat: True to keep the size and modified time.
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        try:
+            # Perhaps a broken symbolic link.
+            stat = os.lstat(path)
+        except OSError:
+            return None
+    entry = ScanEntry(os.path.basename(path), path, os.path.isdir(path), stat.st_ino)
+    if withStat:
+        entry.size = stat.st_size
+        entry.modified = stat.st_mtime
+    return entry
+
+
+
+# Sort key to sort entries by name.
+sortByName = operator.attrgetter('name')
+
+
+
+def naturalKey(name):
+    '''
+    Returns the sort key for a name in natural order, so 'file2' is before 'file10'.
+    The text between the numbers is compared with the collation of the current locale ignoring case.
+    The name itself is the last part of the key so that different names never have equal keys.
+
+    :param str name: The name of the file.
+    '''
+    parts = NUMBERS.split(name)
+    parts[0::2] = [locale.strxfrm(part.casefold()) for part in parts[0::2]]
+    parts[1::2] = [int(part) for part in parts[1::2]]
+    return (parts, name)
+
+
+
+def sortNatural(entry):
+    '''
+    Sort key to sort entries by name in natural order.
+    The key is worked out once per entry by the sort.
+
+    :param ScanEntry entry: The entry.
+    '''
+    return naturalKey(entry.name)
+
+
+
+def extensionFilter(extensions):
+    '''
+    Returns a filter function for :py:func:`scanFolder` that only accepts the specified extensions.
+
+    :param extensions: The lower case extensions to accept including the '.', for example ['.jpg', '.png'].
+    :returns: A function that takes a :py:class:`ScanEntry` and returns True to accept it.
+    '''
+    extensions = frozenset(extensions)
+    return lambda entry: entry.extension in extensions
+
+
+
+def iterateFolder(folderName, filter=None, withStat=False, isCancelled=None):
+    '''
+    Generator for the entries in a folder in the order the operating system returns them.
+    A folder that can not be read returns no entries.
+
+    :param str folderName: The folder to scan.
+    :param filter: Optional function that takes a :py:class:`ScanEntry` and returns True to include it.
+    :param bool withStat: True to read the size and modified time of each entry.
+    :param isCancelled: Optional function that returns True to stop the scan early.
+    '''
+    try:
+        with os.scandir(folderName) as dirEntries:
+            for dirEntry in dirEntries:
+                if isCancelled is not None and isCancelled():
+                    return
+                entry = entryFromDirEntry(dirEntry, withStat)
+                if filter is None or filter(entry):
+                    yield entry
+    except OSError:
+        return
+
+
+
+def scanFolder(folderName, filter=None, sortKey=sortNatural, reverse=False, withStat=False, isCancelled=None):
+    '''
+    Generator for the entries in a folder.
+    When sorting the whole folder is read before the first entry is returned.
+
+    :param str folderName: The folder to scan.
+    :param filter: Optional function that takes a :py:class:`ScanEntry` and returns True to include it.
+    :param sortKey: The sort key function or None to return the entries unsorted.
+    :param bool reverse: True to sort in reverse order.
+    :param bool withStat: True to read the size and modified time of each entry.
+    :param isCancelled: Optional function that returns True to stop the scan early.
+    '''
+    entries = iterateFolder(folderName, filter, withStat, isCancelled)
+    if sortKey is None:
+        yield from entries
+    else:
+        yield from sorted(entries, key=sortKey, reverse=reverse)
+
+
+
+def batches(entries, firstSize=FIRST_BATCH_SIZE, maxSize=MAX_BATCH_SIZE):
+    '''
+    Generator to split entries into lists.
+    The first list is small so the first rows can be displayed quickly, then the lists double in size.
+
+    :param entries: The entries to split, for example from :py:func:`scanFolder`.
+    :param int firstSize: The size of the first list.
+    :param int maxSize: The largest size of a list.
+    '''
+    batchSize = firstSize
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batchSize:
+            yield batch
+            batch = []
+            batchSize = min(batchSize * 2, maxSize)
+    if len(batch) > 0:
+        yield batch
+
+
+
+def bisectSorted(count, getKey, key):
+    '''
+    Returns the position of a key in a sorted list that can only be read one row at a time, for example a GTK model.
+    If the key is not in the list then this is the position to insert it.
+
+    :param int count: The number of rows in the list.
+    :param getKey: Function that takes a position and returns the sort key of the row at that position.
+    :param key: The sort key to find.
+    '''
+    low = 0
+    high = count
+    while low < high:
+        middle = (low + high) // 2
+        if getKey(middle) < key:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+
+def diffSorted(oldKeys, newEntries, key=sortNatural):
+    '''
+    Compare the current contents of a sorted list with a new sorted scan.
+    This is a single merge pass so it is linear in the size of the lists.
+    The changes are returned as splices that must be applied in order, each position allows for the previous splices.
+
+    :param list oldKeys: The sort keys of the rows currently in the list, in list order.
+    :param list newEntries: The new entries sorted by key.
+    :param key: The sort key function for the new entries.
+    :returns: A list of (position, numberToRemove, entriesToInsert) tuples.
+    '''
+    splices = []
+    position = 0
+    splice = None
+    oldIndex = 0
+    newIndex = 0
+    while oldIndex < len(oldKeys) or newIndex < len(newEntries):
+        if newIndex < len(newEntries):
+            newKey = key(newEntries[newIndex])
+        if newIndex >= len(newEntries) or (oldIndex < len(oldKeys) and oldKeys[oldIndex] < newKey):
+            # This row has gone.
+            if splice is None:
+                splice = [position, 0, []]
+            splice[1] += 1
+            oldIndex += 1
+        elif oldIndex >= len(oldKeys) or newKey < oldKeys[oldIndex]:
+            # This is a new row.
+            if splice is None:
+                splice = [position, 0, []]
+            splice[2].append(newEntries[newIndex])
+            newIndex += 1
+        else:
+            # This row is unchanged.
+            if splice is not None:
+                splices.append(tuple(splice))
+                position = splice[0] + len(splice[2])
+                splice = None
+            position += 1
+            oldIndex += 1
+            newIndex += 1
+    if splice is not None:
+        splices.append(tuple(splice))
+    return splices
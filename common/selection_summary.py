@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to summarise the selected files for the selection label.
+'''
+
+
+
+# The number of selected names shown in the summary.
+PREVIEW_LINES = 20
+
+
+
+def formatSize(size):
+    '''
+    Returns a size in bytes as a short human readable string.
+
+    :param int size: The size in bytes.
+    '''
+    if size < 1024:
+        return f'{size} bytes'
+    for unit in ('KB', 'MB', 'GB', 'TB'):
+        size /= 1024
+        if size < 1024 or unit == 'TB':
+            return f'{size:.1f} {unit}'
+
+
+
+class SelectionSummary():
+    '''
+    Class to build the summary of a selection in a single pass.
+    Only the first :py:attr:`previewLines` names are kept so any number of rows can be added in linear time.
+
+    :ivar int count: The number of selected rows.
+    :ivar int numFolders: The number of selected rows that are known to be folders.
+    :ivar int numFiles: The number of selected rows that are known to be files.
+    :ivar int totalSize: The total size of the selected rows that have a known size.
+    :ivar int numSizes: The number of selected rows that have a known size.
+    :ivar list names: The first names.
+    '''
+
+
+
+    def __init__(self, previewLines=PREVIEW_LINES):
+        '''
+        Class constructor for the :py:class:`SelectionSummary` class.
+
+        :param int previewLines: The number of names to show.
+        '''
+        self.previewLines = previewLines
+        self.count = 0
+        self.numFolders = 0
+        self.numFiles = 0
+        self.totalSize = 0
+        self.numSizes = 0
+        self.names = []
+
+
+
+    def add(self, name, isFolder=None, size=None):
+        '''
+        Add a selected row to the summary.
+
+        :param str name: The name of the file.
+        :param bool isFolder: True for a folder, False for a file or None if not known.
+        :param int size: The size of the file in bytes or None if not known.
+        '''
+        self.count += 1
+        if len(self.names) < self.previewLines:
+            self.names.append(name)
+        if isFolder is not None:
+            if isFolder:
+                self.numFolders += 1
+            else:
+                self.numFiles += 1
+        if size is not None:
+            self.totalSize += size
+            self.numSizes += 1
+
+
+
+    def getText(self):
+        '''
+        Returns the text for the selection label.
+        A single selected row is just the name.
+        '''
+        if self.count <= 1:
+            return '\n'.join(self.names)
+
+        heading = f'{self.count} selected'
+        details = []
+        if self.numFolders + self.numFiles > 0:
+            details.append(f'{self.numFolders} folders, {self.numFiles} files')
+        if self.numSizes > 0:
+            details.append(formatSize(self.totalSize))
+        if len(details) > 0:
+            heading = f'{heading} ({", ".join(details)})'
+        lines = [heading] + self.names
+        if self.count > len(self.names):
+            lines.append(f'… and {self.count - len(self.names)} more')
+        return '\n'.join(lines)
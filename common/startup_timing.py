@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to record where the time goes during the startup of the program.
+Import this module first so that the times are from the start of the program.
+Nothing is recorded unless :py:data:`enabled` is set to True, usually by the --startup-timing option.
+'''
+
+import time
+
+
+
+# True to record the startup times.
+enabled = False
+
+# The time this module was imported.
+startTime = time.perf_counter()
+
+# The (name, time) tuples of the recorded steps in order.
+marks = []
+
+# True when the report has been printed.
+isReported = False
+
+
+
+def mark(name):
+    '''
+    Record the time of a step in the startup.
+    The first mark with a name is kept, later marks with the same name are ignored.
+
+    :param str name: The name of the step that has just finished.
+    '''
+    if enabled and not isReported:
+        for markName, markTime in marks:
+            if markName == name:
+                return
+        marks.append((name, time.perf_counter()))
+
+
+
+def report():
+    '''
+    Print the time of each step since the previous step and since the start.
+    The report is only printed once.
+    '''
+    global isReported
+    if not enabled or isReported:
+        return
+    isReported = True
+    print('Startup timing:')
+    previousTime = startTime
+    for name, markTime in marks:
+        print(f'    {name:32} {1000 * (markTime - previousTime):9.1f}ms {1000 * (markTime - startTime):9.1f}ms')
+        previousTime = markTime
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to make image thumbnails in a pool of worker processes and keep them in the freedesktop thumbnail cache.
+A thumbnail is found by the MD5 of the URI of the image and is valid while its Thumb::MTime matches the image, so the cache is shared with file managers.
+Only the worker processes import GdkPixbuf to decode and scale the images.
+'''
+
+import os
+import stat
+import struct
+import hashlib
+import pathlib
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
+import concurrent.futures.process
+
+
+
+# The largest width and height of a thumbnail in the 'normal' folder of the cache.
+THUMBNAIL_SIZE = 128
+THUMBNAIL_FOLDER = 'normal'
+# The folder for the images that this program could not read, so that they are not tried again.
+FAIL_FOLDER = os.path.join('fail', 'gtk-treeview-test')
+# The default size in pixels of the thumbnails in the rows.  0 to not show thumbnails.
+DISPLAY_SIZE = 48
+# The default number of decoded thumbnails kept in memory.
+MAX_TEXTURES = 2000
+# The default number of worker processes.
+MAX_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+# Images larger than this number of bytes are not read.
+MAX_IMAGE_BYTES = 64 * 1024 * 1024
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+
+def getCacheFolder():
+    ''' Returns the folder of the freedesktop thumbnail cache. '''
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cacheHome, 'thumbnails')
+
+
+
+def isImage(contentType):
+    '''
+    Returns True if a file with the content type might have a thumbnail.
+
+    :param str contentType: The content type of the file or None if it is not known yet.
+    '''
+    return contentType is not None and contentType.startswith('image/')
+
+
+
+def getUri(path):
+    '''
+    Returns the URI of a file as used for the name of its thumbnail.
+
+    :param str path: The path of the file.
+    '''
+    return pathlib.Path(os.path.abspath(path)).as_uri()
+
+
+
+def getThumbnailPath(uri, cacheFolder, folder=THUMBNAIL_FOLDER):
+    '''
+    Returns the path of the thumbnail of a file in the cache.
+
+    :param str uri: The URI of the file.
+    :param str cacheFolder: The folder of the thumbnail cache.
+    :param str folder: The folder in the cache, :py:const:`THUMBNAIL_FOLDER` or :py:const:`FAIL_FOLDER`.
+    '''
+    return os.path.join(cacheFolder, folder, hashlib.md5(uri.encode('utf-8')).hexdigest() + '.png')
+
+
+
+def readPngText(fileName):
+    '''
+    Returns the text chunks of a PNG file.
+    Only the chunks before the image data are read, which is where the thumbnail keys are.
+
+    :param str fileName: The PNG file.
+    :returns: A dictionary of the text by key or None if the file is missing or not a PNG file.
+    '''
+    texts = {}
+    try:
+        with open(fileName, 'rb') as file:
+            if file.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+                return None
+            while True:
+                header = file.read(8)
+                if len(header) < 8:
+                    break
+                length, chunkType = struct.unpack('>I4s', header)
+                if chunkType in (b'IDAT', b'IEND'):
+                    break
+                if chunkType == b'tEXt':
+                    key, _, value = file.read(length).partition(b'\0')
+                    texts[key.decode('latin-1')] = value.decode('latin-1')
+                    file.seek(4, os.SEEK_CUR)
+                else:
+                    file.seek(length + 4, os.SEEK_CUR)
+    except OSError:
+        return None
+    return texts
+
+
+
+def isValid(thumbnailPath, mtime):
+    '''
+    Returns True if a thumbnail in the cache was made from the current version of its image.
+
+    :param str thumbnailPath: The path of the thumbnail.
+    :param int mtime: The modified time of the image in whole seconds.
+    '''
+    texts = readPngText(thumbnailPath)
+    return texts is not None and texts.get('Thumb::MTime') == str(mtime)
+
+
+
+def _saveThumbnail(pixbuf, thumbnailPath, uri, fileStat):
+    '''
+    Save a thumbnail with its keys.
+    The thumbnail is written to a temporary file and renamed, so that other programs never read a partial thumbnail.
+    '''
+    os.makedirs(os.path.dirname(thumbnailPath), mode=0o700, exist_ok=True)
+    temporaryPath = '{}.{}.tmp'.format(thumbnailPath, os.getpid())
+    keys = ['tEXt::Thumb::URI', 'tEXt::Thumb::MTime', 'tEXt::Thumb::Size', 'tEXt::Software']
+    values = [uri, str(int(fileStat.st_mtime)), str(fileStat.st_size), 'GTK Treeview Test']
+    pixbuf.savev(temporaryPath, 'png', keys, values)
+    os.chmod(temporaryPath, stat.S_IRUSR | stat.S_IWUSR)
+    os.replace(temporaryPath, thumbnailPath)
+
+
+
+def makeThumbnail(path, cacheFolder):
+    '''
+    Returns the path of the thumbnail of an image, making it if the cache does not have a valid one.
+    This runs in a worker process.
+
+    :param str path: The path of the image.
+    :param str cacheFolder: The folder of the thumbnail cache.
+    :returns: The path of the thumbnail or None if the image can not be read.
+    '''
+    try:
+        fileStat = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(fileStat.st_mode) or fileStat.st_size > MAX_IMAGE_BYTES:
+        return None
+    uri = getUri(path)
+    thumbnailPath = getThumbnailPath(uri, cacheFolder)
+    if isValid(thumbnailPath, int(fileStat.st_mtime)):
+        return thumbnailPath
+    failPath = getThumbnailPath(uri, cacheFolder, FAIL_FOLDER)
+    if isValid(failPath, int(fileStat.st_mtime)):
+        return None
+
+    import gi
+    gi.require_version('GdkPixbuf', '2.0')
+    from gi.repository import GdkPixbuf, GLib
+    try:
+        imageFormat, width, height = GdkPixbuf.Pixbuf.get_file_info(path)
+        if imageFormat is None:
+            raise GLib.Error('Unknown image format.')
+        if width <= THUMBNAIL_SIZE and height <= THUMBNAIL_SIZE:
+            # Small images are not scaled up.
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+        else:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        pixbuf = pixbuf.apply_embedded_orientation()
+    except GLib.Error:
+        # Remember the failure with an empty thumbnail, as the specification suggests.
+        try:
+            _saveThumbnail(GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 1, 1), failPath, uri, fileStat)
+        except (GLib.Error, OSError):
+            pass
+        return None
+    try:
+        _saveThumbnail(pixbuf, thumbnailPath, uri, fileStat)
+    except (GLib.Error, OSError):
+        return None
+    return thumbnailPath
+
+
+
+class ThumbnailLoader():
+    '''
+    Class to make thumbnails in a pool of worker processes for the rows that are shown.
+    Requests for the same image are merged and a request can be cancelled when its row is no longer shown.
+    The pool is only started by the first request.
+    One loader can be shared by several windows, each request names the callback of its window and a request is only stopped when every callback has cancelled it.
+    The callback is called on a worker thread of the pool with the path and modified time of the image and the path of its thumbnail or None.
+    The callback can decode the thumbnail there but must hand the result to the main thread.
+
+    :ivar str cacheFolder: The folder of the thumbnail cache.
+    '''
+
+
+
+    def __init__(self, callback=None, maxWorkers=MAX_WORKERS, cacheFolder=None):
+        '''
+        Class constructor for the :py:class:`ThumbnailLoader` class.
+
+        :param callback: Function that takes the path and modified time of an image and the path of its thumbnail or None.  This is the callback of the requests that do not name one.
+        :param int maxWorkers: The number of worker processes.
+        :param str cacheFolder: The folder of the thumbnail cache or None for the freedesktop folder.
+        '''
+        self.callback = callback
+        self.maxWorkers = maxWorkers
+        self.cacheFolder = cacheFolder if cacheFolder is not None else getCacheFolder()
+        self.executor = None
+        # The (future, modified times by callback) of the requests that have not finished by image path.
+        self.pending = {}
+        self.lock = threading.Lock()
+
+
+
+    def request(self, path, modified, callback=None):
+        '''
+        Ask for the thumbnail of an image.
+        If the image has already been asked for and has not finished then the callback is added to that request.
+
+        :param str path: The path of the image.
+        :param float modified: The modified time of the image, passed to the callback.
+        :param callback: The callback for this request or None for the callback of the loader.
+        '''
+        callback = callback if callback is not None else self.callback
+        with self.lock:
+            waiting = self.pending.get(path)
+            if waiting is not None:
+                waiting[1][callback] = modified
+                return
+            if self.executor is None:
+                self._startPool()
+            try:
+                future = self.executor.submit(makeThumbnail, path, self.cacheFolder)
+            except concurrent.futures.process.BrokenProcessPool:
+                # A worker died, for example in the decoder of a broken image.
+                self._startPool()
+                future = self.executor.submit(makeThumbnail, path, self.cacheFolder)
+            self.pending[path] = (future, {callback: modified})
+        future.add_done_callback(lambda future: self._requestDone(path, future))
+
+
+
+    def _startPool(self):
+        ''' Start the worker processes.  Spawn rather than fork, the main process has GTK and threads. '''
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.maxWorkers, mp_context=multiprocessing.get_context('spawn'))
+
+
+
+    def cancel(self, path, callback=None):
+        '''
+        Remove a callback from the request for an image.
+        The request is cancelled if no callback is left and it has not started.
+
+        :param str path: The path of the image.
+        :param callback: The callback of the request or None for the callback of the loader.
+        '''
+        callback = callback if callback is not None else self.callback
+        with self.lock:
+            self._cancel(path, callback)
+
+
+
+    def cancelExcept(self, paths, callback=None):
+        '''
+        Remove a callback from the requests except for some images.
+        The requests with no callback left are cancelled if they have not started.
+
+        :param set paths: The paths of the images to keep.
+        :param callback: The callback of the requests or None for the callback of the loader.
+        '''
+        callback = callback if callback is not None else self.callback
+        with self.lock:
+            for path in list(self.pending):
+                if path not in paths:
+                    self._cancel(path, callback)
+
+
+
+    def _cancel(self, path, callback):
+        ''' Remove a callback from the request for an image.  Call this with :py:attr:`lock` held. '''
+        waiting = self.pending.get(path)
+        if waiting is None:
+            return
+        future, callbacks = waiting
+        callbacks.pop(callback, None)
+        if len(callbacks) == 0 and future.cancel():
+            del self.pending[path]
+
+
+
+    def _requestDone(self, path, future):
+        ''' Done callback for a request.  This is called on a worker thread of the pool. '''
+        with self.lock:
+            waiting = self.pending.get(path)
+            if waiting is None or waiting[0] is not future:
+                return
+            del self.pending[path]
+            callbacks = list(waiting[1].items())
+        if future.cancelled():
+            return
+        try:
+            thumbnailPath = future.result()
+        except Exception:
+            thumbnailPath = None
+        for callback, modified in callbacks:
+            callback(path, modified, thumbnailPath)
+
+
+
+    def shutdown(self):
+        ''' Cancel the requests and stop the worker processes. '''
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+            self.pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+
+class TextureCache():
+    '''
+    Class to represent a least recently used cache of decoded thumbnails.
+    The texture is any object, for example a Gdk.Texture or a GdkPixbuf.Pixbuf.
+    False is cached for an image without a thumbnail, so that it is not asked for again.
+    The key includes the modified time of the image, so a changed image misses the cache.
+    The cache is not thread safe, use it from the main thread only.
+
+    :ivar int maxTextures: The largest number of textures.
+    '''
+
+
+
+    def __init__(self, maxTextures=MAX_TEXTURES):
+        '''
+        Class constructor for the :py:class:`TextureCache` class.
+
+        :param int maxTextures: The largest number of textures.
+        '''
+        self.maxTextures = maxTextures
+        # The textures by (path, modified), least recently used first.
+        self.textures = collections.OrderedDict()
+
+
+
+    def get(self, path, modified):
+        '''
+        Returns the texture of an image, False if the image has no thumbnail or None if the image is not in the cache.
+
+        :param str path: The path of the image.
+        :param float modified: The modified time of the image.
+        '''
+        key = (path, modified)
+        texture = self.textures.get(key)
+        if texture is not None:
+            self.textures.move_to_end(key)
+        return texture
+
+
+
+    def put(self, path, modified, texture):
+        '''
+        Add the texture of an image to the cache.
+
+        :param str path: The path of the image.
+        :param float modified: The modified time of the image.
+        :param object texture: The texture or False if the image has no thumbnail.
+        '''
+        self.textures[(path, modified)] = texture
+        self.textures.move_to_end((path, modified))
+        while len(self.textures) > self.maxTextures:
+            self.textures.popitem(last=False)
@@ -10,17 +10,75 @@ import sys
 try:
     import gi
     gi.require_version('Gtk', '3.0')
-    from gi.repository import Gtk, GObject, Gdk
+    from gi.repository import Gtk, GObject, Gdk, Gio, GLib
     from gi.repository import GdkPixbuf
 except:
     print("GTK3 Not Available. ({})".format(__file__))
     sys.exit(0)
 import os
-import subprocess
-import shutil
-import datetime
+import logging
+import threading
+import contextlib
 
 # Application libraries.
+import common.scanner as scanner
+import common.listing_cache as listing_cache
+import common.startup_timing as startup_timing
+import common.selection_summary as selection_summary
+import common.name_index as name_index
+import common.extension_index as extension_index
+import common.file_metadata as file_metadata
+import common.thumbnails as thumbnails
+import common.profiler as profiler
+import common.folder_index as folder_index
+import common.folder_sizes as folder_sizes
+import common.file_operations as file_operations
+import common.file_preview as file_preview
+
+
+
+# The time in milliseconds to collect folder monitor events before applying them.
+MONITOR_DELAY = 200
+# More than this number of folder monitor changes are applied with a refresh instead.
+MONITOR_MAX_CHANGES = 1000
+# The time in milliseconds after scrolling stops to cancel the thumbnails of the rows that are no longer shown.
+THUMBNAIL_SCROLL_DELAY = 100
+# Changes to at least this number of rows are made with the models detached from the treeview.
+BULK_CHANGE_ROWS = 10000
+# The largest number of selected rows that are kept while the models are detached.
+MAX_KEPT_SELECTION = 1000
+# The prefix of the application resources.
+RESOURCE_PATH = '/com/example/GtkTreeviewTest'
+# The columns of the liststore.
+COLUMN_NAME = 0
+COLUMN_VISIBLE = 1
+COLUMN_IS_FOLDER = 2
+COLUMN_SIZE = 3
+COLUMN_MODIFIED = 4
+COLUMN_CONTENT_TYPE = 5
+COLUMN_ORDER = 6
+# The columns that are set when a row is inserted.
+ROW_COLUMNS = [COLUMN_NAME, COLUMN_VISIBLE, COLUMN_IS_FOLDER, COLUMN_SIZE, COLUMN_MODIFIED, COLUMN_CONTENT_TYPE, COLUMN_ORDER]
+# The step between the orders of neighbouring rows, so that rows can be inserted without renumbering.
+ORDER_GAP = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+
+def loadResources():
+    '''
+    Register the compiled application resources if they have been built.
+    Build them with 'glib-compile-resources --sourcedir=gtk3 gtk3/gtk3.gresource.xml'.
+
+    :returns: True if the resources are registered, False to use the source files instead.
+    '''
+    try:
+        resource = Gio.Resource.load(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'gtk3.gresource'))
+    except GLib.Error:
+        return False
+    Gio.resources_register(resource)
+    return True
 
 
 
@@ -40,12 +98,17 @@ class MainWindow():
 
         :param object args: The program arguments.
         '''
+        self.args = args
+
         # Positive to ignore signals.
         self.no_events = 0
 
         # The GTK+ builder for the main window.
         self.builder = Gtk.Builder()
-        self.builder.add_from_file('{}/main_window.glade'.format(os.path.dirname(os.path.realpath(__file__))))
+        if loadResources():
+            self.builder.add_from_resource('{}/main_window.glade'.format(RESOURCE_PATH))
+        else:
+            self.builder.add_from_file('{}/main_window.glade'.format(os.path.dirname(os.path.realpath(__file__))))
         # The actual GTK+ window.
         self.window = self.builder.get_object('windowMain')
         if self.window:
@@ -56,52 +119,733 @@ class MainWindow():
             'on_menuFileOpen_activate'              : self._fileOpen,
             'on_menuFileExit_activate'              : self._fileQuit,
             'on_menuViewOpenFolder_activate'        : self._viewOpenFolder,
+            'on_menuViewFolderSizes_toggled'        : self._viewFolderSizes,
+            'on_menuEditCut_activate'               : self._editCut,
+            'on_menuEditCopy_activate'              : self._editCopy,
+            'on_menuEditPaste_activate'             : self._editPaste,
+            'on_menuEditDelete_activate'            : self._editDelete,
+            'on_buttonOperationCancel_clicked'      : self._operationCancel,
 
             'on_treeselectionFiles_changed'         : self._treeSelectionChanged,
+            'on_treeviewFiles_key_press_event'      : self._treeviewFilesKeyPress,
+            'on_searchentryFiles_search_changed'    : self._searchChanged,
+            'on_togglebuttonExtensions_toggled'     : self._extensionsChanged,
+            'on_entryExtensions_activate'           : self._extensionsChanged,
         }
         self.builder.connect_signals(dic)
 
         # Get the initial folder.  This is probably from args.
         self.folderName = os.path.dirname(os.path.realpath(__file__))
-        self.scanFolder()
+        self.scanCancellable = None
+        self.isScanning = False
+        # The folder monitor for the live mode.
+        self.isLive = getattr(self.args, 'live', False)
+        self.folderMonitor = None
+        # The names reported by the folder monitor that have not been applied yet.
+        self.monitorPending = set()
+        self.monitorSourceId = 0
+        # The recently scanned folders.
+        self.listingCache = listing_cache.ListingCache(getattr(self.args, 'cache_entries', listing_cache.MAX_ENTRIES))
+        # The persistent index of scanned folders or None if it is turned off.
+        self.folderIndex = folder_index.FolderIndex() if getattr(self.args, 'index', False) else None
+
+        # The filter.  Column 1 of the liststore is True for the rows to show.
+        treemodelfilterFiles = self.builder.get_object('treemodelfilterFiles')
+        treemodelfilterFiles.set_visible_column(1)
+        # The normalised filter text or an empty string to show every row.
+        self.query = ''
+        # The positions of the visible rows or None when every row is visible.
+        self.visibleIds = None
+        # The index over the names in the liststore or None if there is no up to date index.
+        self.nameIndex = None
+        self.isIndexing = False
+        # Increases each time rows are inserted or removed anywhere except at the end of the liststore.
+        self.layoutGeneration = 0
+        # The scanned entries that have not been appended to the liststore yet.
+        self.pendingEntries = []
+        # The selected extensions or None to show every extension.  Folders are always shown.
+        self.extensions = None
+        # The positions of the rows by extension.  This is kept up to date as the rows change.
+        self.extensionIndex = extension_index.ExtensionIndex()
+        extensions = getattr(self.args, 'ext', None)
+        if extensions is not None:
+            self.builder.get_object('entryExtensions').set_text(extensions)
+            self.builder.get_object('togglebuttonExtensions').set_active(True)
+
+        # The metadata columns show a placeholder until the metadata of the row arrives.
+        self.builder.get_object('treeviewcolumnSize').set_cell_data_func(self.builder.get_object('cellrendererSize'), self._sizeCellData)
+        self.builder.get_object('treeviewcolumnModified').set_cell_data_func(self.builder.get_object('cellrendererModified'), self._modifiedCellData)
+        self.builder.get_object('treeviewcolumnType').set_cell_data_func(self.builder.get_object('cellrendererType'), self._contentTypeCellData)
+        # Increases each time the metadata is read again, so that older reads stop.
+        self.metadataSerial = 0
+
+        # The thumbnails of the images in the rows that are drawn.  There is no loader if thumbnails are turned off.
+        self.thumbnailSize = getattr(self.args, 'thumbnail_size', thumbnails.DISPLAY_SIZE)
+        self.thumbnailLoader = thumbnails.ThumbnailLoader(self._thumbnailMade) if self.thumbnailSize > 0 else None
+        self.textureCache = thumbnails.TextureCache(getattr(self.args, 'thumbnail_cache', thumbnails.MAX_TEXTURES))
+        self.thumbnailSourceId = 0
+        cellrendererThumbnail = self.builder.get_object('cellrendererThumbnail')
+        if self.thumbnailLoader is not None:
+            cellrendererThumbnail.set_fixed_size(self.thumbnailSize, self.thumbnailSize)
+            self.builder.get_object('treeviewcolumnFilename').set_cell_data_func(cellrendererThumbnail, self._thumbnailCellData)
+            self.builder.get_object('treeviewFiles').get_vadjustment().connect('value-changed', self._treeviewFilesScrolled)
+            self.window.connect('destroy', lambda window: self.thumbnailLoader.shutdown())
+        else:
+            cellrendererThumbnail.set_visible(False)
+
+        # The total sizes of the files under the folder rows, only worked out when turned on.
+        self.isFolderSizes = False
+        self.folderSizes = folder_sizes.FolderSizes(self._folderSizeMade)
+        # The names of the folder rows waiting for their total size by path.
+        self.folderSizeRows = {}
+        self.window.connect('destroy', lambda window: self.folderSizes.shutdown())
+        self.builder.get_object('menuViewFolderSizes').set_active(getattr(self.args, 'folder_sizes', False))
+
+        # The file operations of the edit menu run on worker threads, one operation at a time.
+        self.fileOperations = file_operations.FileOperations()
+        self.fileOperation = None
+        # The (path, message) of the files that the current operation could not change.
+        self.fileOperationErrors = []
+        # The paths of the cut or copied files and MOVE or COPY.
+        self.clipboardPaths = []
+        self.clipboardKind = None
+        self.window.connect('destroy', lambda window: self.fileOperations.shutdown())
+
+        # The preview of the selected file is read on a worker thread after the selection has settled.
+        self.previewLoader = file_preview.PreviewLoader(self._previewRead, self._decodePreviewImage)
+        self.previewPath = None
+        self.previewSourceId = 0
+        self.window.connect('destroy', lambda window: self.previewLoader.shutdown())
+
+        # Scan the initial folder after the first frame has been presented.
+        self.window.connect('realize', self._onRealize)
 
         # An initial message.
         print('GTK+ Version {}.{}.{} (expecting GTK+3).'.format(Gtk.get_major_version(), Gtk.get_minor_version(), Gtk.get_micro_version()))
+        startup_timing.mark('Create window')
+
+
+
+    def _onRealize(self, widget):
+        ''' Signal handler for the window being realized.  The frame clock is available now. '''
+        self.firstFrameHandler = self.window.get_frame_clock().connect('after-paint', self._onFirstFrame)
+        if profiler.enabled:
+            self.window.get_frame_clock().connect('after-paint', lambda frameClock: profiler.frame())
+
 
 
+    def _onFirstFrame(self, frameClock):
+        ''' Signal handler for the first frame being painted.  Starts the initial scan. '''
+        frameClock.disconnect(self.firstFrameHandler)
+        startup_timing.mark('First frame')
+        GLib.idle_add(self._initialScan)
 
 
 
+    def _initialScan(self):
+        '''
+        Idle handler to start the initial scan.
+
+        :returns: False to remove the idle handler.
+        '''
+        self.scanFolder()
+        return False
+
+
+
+
+
+    @profiler.timed()
     def _treeSelectionChanged(self, treeSelection):
-        ''' Signal handler for the selection on tree changing. '''
-        selection = ''
+        '''
+        Signal handler for the selection on tree changing.
+        The selected rows are visited once with selected_foreach() so this is linear in the number of selected rows.
+        '''
+        summary = selection_summary.SelectionSummary()
 
-        liststoreFiles = self.builder.get_object('liststoreFiles')
         mode = treeSelection.get_mode()
         if mode == Gtk.SelectionMode.SINGLE or mode == Gtk.SelectionMode.BROWSE:
             model, treeIter = treeSelection.get_selected()
-            fileName = liststoreFiles.get_value(treeIter, 0)
-            selection = fileName
+            if treeIter is not None:
+                self._addSelectedRow(summary, model, treeIter)
         elif mode == Gtk.SelectionMode.MULTIPLE:
-            model, pathList = treeSelection.get_selected_rows()
-
-            for path in pathList:
-                treeIter = liststoreFiles.get_iter(path)
-                fileName = liststoreFiles.get_value(treeIter, 0)
-                if selection == '':
-                    selection = fileName
-                else:
-                    selection = '{}\n{}'.format(selection, fileName)
+            treeSelection.selected_foreach(lambda model, path, treeIter: self._addSelectedRow(summary, model, treeIter))
 
         # Display the filename.
         labelSelection = self.builder.get_object('labelSelection')
-        labelSelection.set_text(selection)
+        labelSelection.set_text(summary.getText())
+        self._updateEditMenu()
+        # Only a single selected row has a preview.
+        path = None
+        if summary.count == 1:
+            path = os.path.join(self.folderName, summary.names[0])
+        self._schedulePreview(path)
+
+
+
+    def _schedulePreview(self, path):
+        '''
+        Show the preview of a file once the selection has stayed on it for :py:const:`~common.file_preview.PREVIEW_DELAY` milliseconds.
+        Moving quickly through the rows only reads the file that the selection stops on.
+
+        :param str path: The path of the file or None to clear the preview.
+        '''
+        if path == self.previewPath:
+            return
+        self.previewPath = path
+        if self.previewSourceId != 0:
+            GLib.source_remove(self.previewSourceId)
+            self.previewSourceId = 0
+        if path is None:
+            self.previewLoader.cancel()
+            self.builder.get_object('imagePreview').hide()
+            self.builder.get_object('textviewPreview').get_buffer().set_text('')
+            return
+        self.previewSourceId = GLib.timeout_add(file_preview.PREVIEW_DELAY, self._previewTimeout, path)
+
+
+
+    def _previewTimeout(self, path):
+        '''
+        Timeout handler to read the preview of the selected file.
+
+        :returns: False to remove the timeout handler.
+        '''
+        self.previewSourceId = 0
+        self.previewLoader.request(path)
+        return False
+
+
+
+    def _decodePreviewImage(self, path, size):
+        '''
+        Returns a scaled down image for the preview or None if the image can not be read.
+        This is called on the worker thread of the preview loader.
+
+        :param str path: The path of the image.
+        :param int size: The largest width and height.
+        '''
+        try:
+            return GdkPixbuf.Pixbuf.new_from_file_at_size(path, size, size).apply_embedded_orientation()
+        except GLib.Error:
+            return None
+
+
+
+    def _previewRead(self, preview):
+        '''
+        Callback for the preview loader.  This is called on a worker thread.
+
+        :param Preview preview: The preview.
+        '''
+        GLib.idle_add(self._showPreview, preview)
+
+
+
+    def _showPreview(self, preview):
+        '''
+        Idle handler to show a preview if its file is still selected.
+
+        :returns: False to remove the idle handler.
+        '''
+        if preview.path != self.previewPath:
+            return False
+        imagePreview = self.builder.get_object('imagePreview')
+        if preview.kind == file_preview.KIND_IMAGE:
+            imagePreview.set_from_pixbuf(preview.image)
+            imagePreview.show()
+        else:
+            imagePreview.hide()
+        self.builder.get_object('textviewPreview').get_buffer().set_text(preview.text)
+        return False
+
+
+
+    def _updateEditMenu(self):
+        ''' Make the edit menu points sensitive when they can be used. '''
+        isSelected = self.builder.get_object('treeviewFiles').get_selection().count_selected_rows() > 0
+        isIdle = self.fileOperation is None
+        self.builder.get_object('menuEditCut').set_sensitive(isSelected)
+        self.builder.get_object('menuEditCopy').set_sensitive(isSelected)
+        self.builder.get_object('menuEditPaste').set_sensitive(isIdle and len(self.clipboardPaths) > 0)
+        self.builder.get_object('menuEditDelete').set_sensitive(isIdle and isSelected)
+
+
+
+    def _getSelectedPaths(self):
+        ''' Returns the paths of the selected files. '''
+        paths = []
+        self.builder.get_object('treeviewFiles').get_selection().selected_foreach(lambda model, path, treeIter: paths.append(os.path.join(self.folderName, model.get_value(treeIter, COLUMN_NAME))))
+        return paths
+
+
+
+    def _editCut(self, widget):
+        ''' Signal handler for the 'Edit' → 'Cut' menu point.  The files are moved when they are pasted. '''
+        self.clipboardPaths = self._getSelectedPaths()
+        self.clipboardKind = file_operations.MOVE
+        self._updateEditMenu()
+
+
+
+    def _editCopy(self, widget):
+        ''' Signal handler for the 'Edit' → 'Copy' menu point.  The files are copied when they are pasted. '''
+        self.clipboardPaths = self._getSelectedPaths()
+        self.clipboardKind = file_operations.COPY
+        self._updateEditMenu()
+
+
+
+    def _editPaste(self, widget):
+        ''' Signal handler for the 'Edit' → 'Paste' menu point.  The cut or copied files are moved or copied to the current folder. '''
+        if self.fileOperation is not None or len(self.clipboardPaths) == 0:
+            return
+        self._startFileOperation(self.clipboardKind, self.clipboardPaths, self.folderName)
+        if self.clipboardKind == file_operations.MOVE:
+            # The cut files are no longer where they were.
+            self.clipboardPaths = []
+            self._updateEditMenu()
+
+
+
+    def _editDelete(self, widget):
+        ''' Signal handler for the 'Edit' → 'Delete' menu point.  The selected files are deleted after asking. '''
+        paths = self._getSelectedPaths()
+        if self.fileOperation is not None or len(paths) == 0:
+            return
+        dialog = Gtk.MessageDialog(transient_for=self.window, modal=True, message_type=Gtk.MessageType.WARNING, buttons=Gtk.ButtonsType.OK_CANCEL, text='Delete {} files?'.format(len(paths)) if len(paths) > 1 else 'Delete "{}"?'.format(os.path.basename(paths[0])))
+        dialog.format_secondary_text('The files are deleted permanently, not moved to the trash.')
+        response = dialog.run()
+        dialog.destroy()
+        if response == Gtk.ResponseType.OK:
+            self._startFileOperation(file_operations.DELETE, paths, None)
+
+
+
+    def _startFileOperation(self, kind, paths, destinationFolder):
+        '''
+        Start deleting, copying or moving files on the worker threads.
+        The rows are updated a batch at a time as the files finish.
+
+        :param str kind: One of :py:const:`~common.file_operations.DELETE`, :py:const:`~common.file_operations.COPY` or :py:const:`~common.file_operations.MOVE`.
+        :param list paths: The paths of the files.
+        :param str destinationFolder: The folder to copy or move the files to, None to delete.
+        '''
+        logger.info('Start to %s %d files.', kind, len(paths))
+        self.fileOperation = self.fileOperations.start(kind, paths, destinationFolder, self._fileOperationBatch)
+        self.fileOperationErrors = []
+        progressbarOperation = self.builder.get_object('progressbarOperation')
+        progressbarOperation.set_fraction(0.0)
+        progressbarOperation.set_text('{} 0 of {}'.format(kind.capitalize(), len(paths)))
+        progressbarOperation.show()
+        self.builder.get_object('buttonOperationCancel').show()
+        self._updateEditMenu()
+
+
+
+    def _operationCancel(self, widget):
+        ''' Signal handler for the cancel button of the file operation. '''
+        if self.fileOperation is not None:
+            self.fileOperation.cancel()
+
+
+
+    def _fileOperationBatch(self, operation, batch, isFinal):
+        '''
+        Callback for a batch of results of a file operation.  This is called on a worker thread.
+
+        :param FileOperation operation: The operation.
+        :param OperationBatch batch: The results.
+        :param bool isFinal: True for the last batch.
+        '''
+        GLib.idle_add(self._fileOperationApply, operation, batch, isFinal)
+
+
+
+    @profiler.timed()
+    def _fileOperationApply(self, operation, batch, isFinal):
+        '''
+        Idle handler to show a batch of results of a file operation.
+        The rows of the files that were removed from or created in the current folder are removed or inserted, the folder is not scanned again.
+        The batch is applied even if the operation has been cancelled, the files in it have changed.
+
+        :returns: False to remove the idle handler.
+        '''
+        names = {os.path.basename(path) for path in batch.removed + batch.created if os.path.dirname(path) == self.folderName}
+        if len(names) > 0:
+            if self.isScanning:
+                # The changes are applied when the scan finishes, the same as the folder monitor changes.
+                self.monitorPending.update(names)
+            else:
+                self._applyNameChanges(names)
+        for path, message in batch.errors:
+            logger.warning('Can not %s "%s". %s', operation.kind, path, message)
+        self.fileOperationErrors.extend(batch.errors)
+
+        progressbarOperation = self.builder.get_object('progressbarOperation')
+        progressbarOperation.set_fraction(batch.numDone / len(operation.paths))
+        progressbarOperation.set_text('{} {} of {}'.format(operation.kind.capitalize(), batch.numDone, len(operation.paths)))
+        if isFinal:
+            self.fileOperation = None
+            progressbarOperation.hide()
+            self.builder.get_object('buttonOperationCancel').hide()
+            self._updateEditMenu()
+            if len(self.fileOperationErrors) > 0:
+                dialog = Gtk.MessageDialog(transient_for=self.window, modal=True, message_type=Gtk.MessageType.ERROR, buttons=Gtk.ButtonsType.CLOSE, text='{} files could not be changed.'.format(len(self.fileOperationErrors)))
+                dialog.format_secondary_text('\n'.join([message for path, message in self.fileOperationErrors[:selection_summary.PREVIEW_LINES]]))
+                dialog.connect('response', lambda dialog, response: dialog.destroy())
+                dialog.show()
+        return False
+
+
+
+    def _addSelectedRow(self, summary, model, treeIter):
+        '''
+        Add a selected row to a selection summary with its name, whether it is a folder and its size.
+
+        :param SelectionSummary summary: The summary.
+        :param Gtk.TreeModel model: The model that holds the row.
+        :param Gtk.TreeIter treeIter: The row.
+        '''
+        name, isFolder, size = model.get(treeIter, COLUMN_NAME, COLUMN_IS_FOLDER, COLUMN_SIZE)
+        summary.add(name, isFolder, None if size == file_metadata.UNKNOWN else size)
+
+
+
+    def _sizeCellData(self, column, cell, model, treeIter, data):
+        ''' Cell data function for the size column.  This only formats the value in the model. '''
+        size = model.get_value(treeIter, COLUMN_SIZE)
+        cell.set_property('text', file_metadata.PLACEHOLDER if size == file_metadata.UNKNOWN else selection_summary.formatSize(size))
+
+
+
+    def _modifiedCellData(self, column, cell, model, treeIter, data):
+        ''' Cell data function for the modified column.  This only formats the value in the model. '''
+        cell.set_property('text', file_metadata.formatModified(model.get_value(treeIter, COLUMN_MODIFIED)))
+
+
+
+    def _contentTypeCellData(self, column, cell, model, treeIter, data):
+        ''' Cell data function for the type column.  This only formats the value in the model. '''
+        contentType = model.get_value(treeIter, COLUMN_CONTENT_TYPE)
+        cell.set_property('text', file_metadata.PLACEHOLDER if contentType is None else contentType)
+
+
+
+    @profiler.timed()
+    def _thumbnailCellData(self, column, cell, model, treeIter, data):
+        '''
+        Cell data function for the thumbnail.
+        This is only called for the rows that are drawn, so only the visible images ask for thumbnails.
+        '''
+        name, modified, contentType = model.get(treeIter, COLUMN_NAME, COLUMN_MODIFIED, COLUMN_CONTENT_TYPE)
+        pixbuf = None
+        if thumbnails.isImage(contentType) and modified != file_metadata.UNKNOWN:
+            path = os.path.join(self.folderName, name)
+            pixbuf = self.textureCache.get(path, modified)
+            if pixbuf is None:
+                self.thumbnailLoader.request(path, modified)
+        cell.set_property('pixbuf', pixbuf if pixbuf else None)
+
+
+
+    def _thumbnailMade(self, path, modified, thumbnailPath):
+        '''
+        Callback for the thumbnail loader.
+        This is called on a worker thread, so the thumbnail is decoded here and handed to the main thread.
+
+        :param str path: The path of the image.
+        :param float modified: The modified time of the image when it was asked for.
+        :param str thumbnailPath: The path of the thumbnail or None if there is no thumbnail.
+        '''
+        pixbuf = False
+        if thumbnailPath is not None:
+            try:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(thumbnailPath, self.thumbnailSize, self.thumbnailSize)
+            except GLib.Error:
+                pass
+        GLib.idle_add(self._thumbnailLoaded, path, modified, pixbuf)
+
+
+
+    @profiler.timed()
+    def _thumbnailLoaded(self, path, modified, pixbuf):
+        '''
+        Idle handler to cache a decoded thumbnail and draw it.
+
+        :returns: False to remove the idle handler.
+        '''
+        self.textureCache.put(path, modified, pixbuf)
+        if pixbuf:
+            # The redraws of many thumbnails are merged into the next frame.
+            self.builder.get_object('treeviewFiles').queue_draw()
+        return False
+
+
+
+    def _treeviewFilesScrolled(self, adjustment):
+        ''' Signal handler for the files treeview scrolling.  The thumbnails of the rows that scrolled away are cancelled after a short delay. '''
+        if self.thumbnailSourceId == 0:
+            self.thumbnailSourceId = GLib.timeout_add(THUMBNAIL_SCROLL_DELAY, self._cancelHiddenThumbnails)
+
+
+
+    def _cancelHiddenThumbnails(self):
+        '''
+        Timeout handler to cancel the thumbnails that have not started for the rows that are not shown.
+
+        :returns: False to remove the timeout handler.
+        '''
+        self.thumbnailSourceId = 0
+        treeviewFiles = self.builder.get_object('treeviewFiles')
+        visibleRange = treeviewFiles.get_visible_range()
+        paths = set()
+        if visibleRange is not None:
+            model = treeviewFiles.get_model()
+            treeIter = model.get_iter(visibleRange[0])
+            for index in range(visibleRange[0].get_indices()[0], visibleRange[1].get_indices()[0] + 1):
+                if treeIter is None:
+                    break
+                paths.add(os.path.join(self.folderName, model.get_value(treeIter, COLUMN_NAME)))
+                treeIter = model.iter_next(treeIter)
+        self.thumbnailLoader.cancelExcept(paths)
+        return False
+
+
+
+    def _treeviewFilesKeyPress(self, widget, event):
+        '''
+        Signal handler for a key press on the files treeview.
+        The Delete key deletes the selected files.  Typing starts a search in the search entry.
+        '''
+        if event.keyval == Gdk.KEY_Delete:
+            self._editDelete(widget)
+            return True
+        searchentryFiles = self.builder.get_object('searchentryFiles')
+        if searchentryFiles.handle_event(event):
+            searchentryFiles.grab_focus_without_selecting()
+            return True
+        return False
+
+
+
+    def _searchChanged(self, searchEntry):
+        '''
+        Signal handler for the text in the search entry changing.
+        The matching rows come from the name index and only the rows that change visibility are updated.
+        '''
+        self.query = name_index.normalise(searchEntry.get_text())
+        self._filter()
+
+
+
+    def _extensionsChanged(self, widget):
+        '''
+        Signal handler for the extension filter being toggled or its extensions being changed.
+        The rows to show come from the extension index, nothing is read from the filesystem.
+        '''
+        self.extensions = None
+        if self.builder.get_object('togglebuttonExtensions').get_active():
+            self.extensions = extension_index.parseExtensions(self.builder.get_object('entryExtensions').get_text())
+        self._filter()
+        self._updateFilesTitle()
+
+
+
+    @profiler.timed()
+    def _filter(self):
+        ''' Work out the rows to show from the name index and the extension index. '''
+        if self.query == '' and self.extensions is None:
+            self._setVisibleIds(None)
+            return
+        ids = None
+        if self.extensions is not None:
+            ids = set(self.extensionIndex.getPositions(self.extensions))
+        if self.query != '':
+            if self.nameIndex is not None:
+                queryIds = self.nameIndex.search(self.query)
+                ids = set(queryIds) if ids is None else ids.intersection(queryIds)
+            else:
+                liststoreFiles = self.builder.get_object('liststoreFiles')
+                ids = set(name_index.searchLinear([row[0] for row in liststoreFiles], self.query, None if ids is None else sorted(ids)))
+                self._startNameIndex()
+        self._setVisibleIds(ids)
+
+
+
+    def _isVisible(self, entry):
+        '''
+        Returns True if a row for the specified entry matches the filter.
+
+        :param ScanEntry entry: The file.
+        '''
+        if self.extensions is not None and not entry.isFolder and entry.extension not in self.extensions:
+            return False
+        return self.query == '' or self.query in name_index.normalise(entry.name)
+
+
+
+    def _getRowValues(self, entry, order):
+        '''
+        Returns the values of the :py:const:`ROW_COLUMNS` for a new row.
+        The metadata is unknown until it arrives unless the entry was read with its stat.
+
+        :param ScanEntry entry: The file.
+        :param int order: The sort order of the row from :py:meth:`_getNewOrders`.
+        '''
+        if entry.size is None:
+            return [entry.name, self._isVisible(entry), entry.isFolder, file_metadata.UNKNOWN, file_metadata.UNKNOWN, None, order]
+        return [entry.name, self._isVisible(entry), entry.isFolder, entry.size, entry.modified, file_metadata.getContentType(entry.name, entry.isFolder), order]
+
+
+
+    def _getNewOrders(self, position, count):
+        '''
+        Returns the orders for rows about to be inserted into the liststore.
+        The liststore is kept in natural name order and the order column follows it, so the treemodelsort sorts by name on a number.
+        The new orders are spaced between the orders of the neighbours.
+        If there is no room left the rows after the position are renumbered, which is rare.
+
+        :param int position: The position of the first new row.
+        :param int count: The number of new rows.
+        :returns: The list of orders for the new rows.
+        '''
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        numRows = liststoreFiles.iter_n_children(None)
+        previous = -ORDER_GAP if position == 0 else liststoreFiles.get_value(liststoreFiles.iter_nth_child(None, position - 1), COLUMN_ORDER)
+        if position == numRows:
+            return [previous + ORDER_GAP * (index + 1) for index in range(count)]
+        following = liststoreFiles.get_value(liststoreFiles.iter_nth_child(None, position), COLUMN_ORDER)
+        step = (following - previous) // (count + 1)
+        if step >= 1:
+            return [previous + step * (index + 1) for index in range(count)]
+        # Renumber the rows after the position to leave a full gap for each new row.
+        treeIter = liststoreFiles.iter_nth_child(None, position)
+        order = previous + ORDER_GAP * (count + 1)
+        while treeIter is not None:
+            liststoreFiles.set_value(treeIter, COLUMN_ORDER, order)
+            order += ORDER_GAP
+            treeIter = liststoreFiles.iter_next(treeIter)
+        return [previous + ORDER_GAP * (index + 1) for index in range(count)]
+
+
+
+    def _getExtensions(self, entries):
+        '''
+        Returns the keys of the entries for the extension index.
+
+        :param list entries: The :py:class:`~common.scanner.ScanEntry` objects.
+        '''
+        return [extension_index.FOLDERS if entry.isFolder else entry.extension for entry in entries]
+
+
+
+    def _setVisibleIds(self, visibleIds):
+        '''
+        Show only the rows at the specified positions.
+        Only the rows that change are set, so refining the filter only touches the rows that are hidden.
+
+        :param set visibleIds: The positions of the rows to show or None to show every row.
+        '''
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        numRows = liststoreFiles.iter_n_children(None)
+        if self.visibleIds is None:
+            changes = [(position, False) for position in range(numRows) if position not in visibleIds]
+        elif visibleIds is None:
+            changes = [(position, True) for position in range(numRows) if position not in self.visibleIds]
+        else:
+            changes = [(position, False) for position in self.visibleIds - visibleIds]
+            changes += [(position, True) for position in visibleIds - self.visibleIds]
+        with self._bulkChange(len(changes)):
+            for position, isVisible in changes:
+                liststoreFiles.set_value(liststoreFiles.iter_nth_child(None, position), 1, isVisible)
+        self.visibleIds = visibleIds
+
+
+
+    def _liststoreCleared(self):
+        ''' Called after every row has been removed from the liststore.  The name index and the visible positions start again. '''
+        self.layoutGeneration += 1
+        self.nameIndex = None
+        self.visibleIds = None if self.query == '' and self.extensions is None else set()
+
+
+
+    def _liststoreSpliced(self, position, numberRemoved, entries):
+        '''
+        Called after rows have been removed and inserted at a position that is not the end of the liststore.
+        The name index and the visible positions are spliced the same way, so the liststore is not read again.
+        The new rows have already been given the correct visibility.
+
+        :param int position: The position of the change.
+        :param int numberRemoved: The number of rows that were removed.
+        :param list entries: The :py:class:`~common.scanner.ScanEntry` objects of the inserted rows.
+        '''
+        self.layoutGeneration += 1
+        if self.nameIndex is not None:
+            self.nameIndex.splice(position, numberRemoved, [entry.name for entry in entries])
+        if self.visibleIds is not None:
+            # The visible rows before the change keep their positions, the ones after it move by the change in the number of rows.
+            end = position + numberRemoved
+            delta = len(entries) - numberRemoved
+            visibleIds = {id for id in self.visibleIds if id < position}
+            visibleIds.update([id + delta for id in self.visibleIds if id >= end])
+            visibleIds.update([position + index for index, entry in enumerate(entries) if self._isVisible(entry)])
+            self.visibleIds = visibleIds
+
+
+
+    def _startNameIndex(self):
+        ''' Start building the name index for the filter on a worker thread. '''
+        if self.isIndexing:
+            return
+        self.isIndexing = True
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        names = [row[0] for row in liststoreFiles]
+        thread = threading.Thread(target=self._nameIndexThread, args=(names, self.layoutGeneration), daemon=True)
+        thread.start()
+
+
+
+    def _nameIndexThread(self, names, layoutGeneration):
+        '''
+        Worker thread for :py:meth:`_startNameIndex`.
+
+        :param list names: The names in the liststore.
+        :param int layoutGeneration: The layout generation when the names were read.
+        '''
+        index = name_index.NameIndex(names)
+        GLib.idle_add(self._nameIndexBuilt, index, layoutGeneration)
+
+
+
+    def _nameIndexBuilt(self, index, layoutGeneration):
+        '''
+        Idle handler for the name index being built.
+        Names appended to the liststore since the index was started are added to it.
+
+        :param NameIndex index: The index.
+        :param int layoutGeneration: The layout generation when the names were read.
+        :returns: False to remove the idle handler.
+        '''
+        self.isIndexing = False
+        if layoutGeneration != self.layoutGeneration:
+            # The liststore has changed since, build the index again if it is needed.
+            if self.query != '':
+                self._startNameIndex()
+            return False
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        numRows = liststoreFiles.iter_n_children(None)
+        if index.size < numRows:
+            index.addNames([liststoreFiles.get_value(liststoreFiles.iter_nth_child(None, position), 0) for position in range(index.size, numRows)])
+        self.nameIndex = index
+        return False
 
 
 
     def _fileRefresh(self, widget):
         ''' Signal handler for the 'File' → 'Refresh' menu point. '''
-        self.scanFolder()
+        self.refreshFolder()
 
 
 
@@ -137,36 +881,547 @@ class MainWindow():
 
     def _viewOpenFolder(self, widget):
         ''' Signal handler for the 'View' → 'Open Folder' menu point. '''
+        import subprocess
         subprocess.Popen(['xdg-open', self.folderName])
 
 
 
+    @profiler.timed()
     def scanFolder(self):
-        ''' Scan the images in the specified folder. '''
+        '''
+        Scan the images in the specified folder.
+        The folder is listed on a worker thread and the rows arrive in batches via :py:meth:`_scanFolderBatch`.
+        Any scan that is still running is cancelled first.
+        '''
+        if self.scanCancellable is not None:
+            self.scanCancellable.cancel()
+        self.scanCancellable = Gio.Cancellable()
+        self.isScanning = True
+
         liststoreFiles = self.builder.get_object('liststoreFiles')
-        liststoreFiles.clear()
+        with self._bulkChange(liststoreFiles.iter_n_children(None)):
+            liststoreFiles.clear()
+        self.pendingEntries = []
+        if self.thumbnailLoader is not None:
+            self.thumbnailLoader.cancelExcept(set())
+        self.folderSizes.cancelExcept(set())
+        self.folderSizeRows.clear()
+        self.extensionIndex = extension_index.ExtensionIndex()
+        self._liststoreCleared()
+        self._updateFilesTitle()
+        self._startFolderMonitor()
+
+        # Use the cached listing if the folder has not changed.
+        entries = self.listingCache.get(self.folderName)
+        if entries is not None:
+            GLib.idle_add(self._scanFolderCached, entries, scanner.batches(entries), self.scanCancellable)
+            return
+
+        thread = threading.Thread(target=self._scanFolderThread, args=(self.folderName, self.scanCancellable), daemon=True)
+        thread.start()
+
+
+
+    @profiler.timed()
+    def _scanFolderThread(self, folderName, cancellable):
+        '''
+        Worker thread for :py:meth:`scanFolder`.
+        This must not touch any GTK objects, the entries are passed back to the main thread with GLib.idle_add().
+
+        :param str folderName: The folder to scan.
+        :param Gio.Cancellable cancellable: Cancelled when this scan is no longer wanted.
+        '''
+        stamp = listing_cache.folderStamp(folderName)
+        indexed = self.folderIndex.get(folderName) if self.folderIndex is not None else None
+        if indexed is not None:
+            # Show the indexed listing at once, then scan the folder only if it has changed.
+            indexedStamp, indexedEntries = indexed
+            for batch in scanner.batches(indexedEntries):
+                if cancellable.is_cancelled():
+                    return
+                GLib.idle_add(self._scanFolderBatch, batch, cancellable)
+            if indexedStamp == stamp:
+                GLib.idle_add(self._scanFolderFinished, folderName, stamp, indexedEntries, cancellable, True)
+                return
+            entries = list(scanner.scanFolder(folderName, isCancelled=cancellable.is_cancelled))
+            oldKeys = [scanner.naturalKey(entry.name) for entry in indexedEntries]
+            splices = scanner.diffSorted(oldKeys, entries)
+            if not cancellable.is_cancelled():
+                GLib.idle_add(self._refreshFolderApply, folderName, stamp, entries, splices, cancellable)
+            return
+
+        allEntries = []
+        entries = scanner.scanFolder(folderName, isCancelled=cancellable.is_cancelled)
+        for batch in scanner.batches(entries):
+            if cancellable.is_cancelled():
+                return
+            GLib.idle_add(self._scanFolderBatch, batch, cancellable)
+            allEntries.extend(batch)
+        GLib.idle_add(self._scanFolderFinished, folderName, stamp, allEntries, cancellable)
+
+
+
+    def _scanFolderCached(self, entries, batches, cancellable):
+        '''
+        Idle handler to append a cached listing to the liststore one batch at a time.
+
+        :param list entries: The cached :py:class:`~common.scanner.ScanEntry` objects.
+        :param batches: The generator of the batches of the entries.
+        :param Gio.Cancellable cancellable: The cancellable of the scan.
+        :returns: True while there are more batches to append.
+        '''
+        batch = next(batches, None)
+        if batch is None:
+            self._scanFolderFinished(self.folderName, None, entries, cancellable)
+            return False
+        self._scanFolderBatch(batch, cancellable)
+        return not cancellable.is_cancelled()
+
+
+
+    @profiler.timed()
+    def _scanFolderBatch(self, batch, cancellable):
+        '''
+        Idle handler for a batch of scanned entries.
+        The entries are held back until there are as many as there are rows, so the liststore at least doubles each time it grows.
+        The first batch is appended at once.
+
+        :param list batch: The :py:class:`~common.scanner.ScanEntry` objects to append.
+        :param Gio.Cancellable cancellable: The cancellable of the scan that produced the batch.
+        :returns: False to remove the idle handler.
+        '''
+        if cancellable.is_cancelled():
+            # The batch is from an old scan.
+            return False
+        self.pendingEntries.extend(batch)
+        if len(self.pendingEntries) >= self.builder.get_object('liststoreFiles').iter_n_children(None):
+            self._appendPendingEntries()
+        return False
+
+
+
+    def _appendPendingEntries(self):
+        '''
+        Append the held back scanned entries to the liststore.
+        A large append is made with the models detached, and as the liststore doubles each time the treeview builds its rows a bounded number of times.
+        '''
+        entries = self.pendingEntries
+        if len(entries) == 0:
+            return
+        self.pendingEntries = []
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        position = liststoreFiles.iter_n_children(None)
+        orders = self._getNewOrders(position, len(entries))
+        with self._bulkChange(len(entries)):
+            for index, entry in enumerate(entries):
+                values = self._getRowValues(entry, orders[index])
+                liststoreFiles.insert_with_valuesv(-1, ROW_COLUMNS, values)
+                if values[COLUMN_VISIBLE] and self.visibleIds is not None:
+                    self.visibleIds.add(position + index)
+        self.extensionIndex.addEntries(entries)
+        if self.nameIndex is not None and self.nameIndex.size == position:
+            self.nameIndex.addNames([entry.name for entry in entries])
+        self._updateFilesTitle()
+        startup_timing.mark('First rows')
+
+
+
+    @contextlib.contextmanager
+    def _bulkChange(self, numChanges):
+        '''
+        Context manager to detach the models from the treeview while many rows change.
+        The treeview does not follow each change, it builds its rows once when the models are attached again.
+        The scroll position is kept and so is the selection unless more than :py:const:`MAX_KEPT_SELECTION` rows are selected.
+
+        :param int numChanges: The number of rows that will change.  Fewer than :py:const:`BULK_CHANGE_ROWS` are changed with the models attached.
+        '''
+        treeviewFiles = self.builder.get_object('treeviewFiles')
+        model = treeviewFiles.get_model()
+        if numChanges < BULK_CHANGE_ROWS or model is None:
+            yield
+            return
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        treemodelfilterFiles = self.builder.get_object('treemodelfilterFiles')
+        # The selected rows are followed through the changes with references to the liststore rows.
+        selectedRows = []
+        treeSelection = treeviewFiles.get_selection()
+        if treeSelection.count_selected_rows() <= MAX_KEPT_SELECTION:
+            for path in treeSelection.get_selected_rows()[1]:
+                childPath = treemodelfilterFiles.convert_path_to_child_path(model.convert_path_to_child_path(path))
+                selectedRows.append(Gtk.TreeRowReference.new(liststoreFiles, childPath))
+        scrollPosition = treeviewFiles.get_vadjustment().get_value()
+        treeviewFiles.set_model(None)
         try:
-            everyThing = os.listdir(self.folderName)
-        except:
-            everyThing = []
+            yield
+        finally:
+            treeviewFiles.set_model(model)
+            for rowReference in selectedRows:
+                childPath = rowReference.get_path()
+                filterPath = treemodelfilterFiles.convert_child_path_to_path(childPath) if childPath is not None else None
+                if filterPath is not None:
+                    treeSelection.select_path(model.convert_child_path_to_path(filterPath))
+            treeviewFiles.scroll_to_point(-1, int(scrollPosition))
+
 
-        everyThing.sort()
 
-        count = 0
-        for theFile in everyThing:
-            fileName , extension = os.path.splitext(theFile)
-            extension = extension.lower()
-            if True:
-                count += 1
-                iterFiles = liststoreFiles.append()
-                liststoreFiles.set(iterFiles, 0, theFile)
+    @profiler.timed()
+    def _scanFolderFinished(self, folderName, stamp, entries, cancellable, isIndexed=False):
+        '''
+        Idle handler for a scan being completely loaded.
 
+        :param str folderName: The folder that was scanned.
+        :param tuple stamp: The stamp of the folder from before the scan or None to not update the listing cache.
+        :param list entries: The sorted :py:class:`~common.scanner.ScanEntry` objects from the scan.
+        :param Gio.Cancellable cancellable: The cancellable of the scan.
+        :param bool isIndexed: True if the entries are from the folder index and the folder has not changed, so the index is not written again.
+        :returns: False to remove the idle handler.
+        '''
+        if not cancellable.is_cancelled():
+            self._appendPendingEntries()
+            if stamp is not None:
+                self.listingCache.put(folderName, stamp, entries, len(entries))
+            if self.folderIndex is not None and stamp is not None and not isIndexed:
+                self._startMetadata(folderName, [entry.name for entry in entries], None, stamp, bytes([entry.isFolder for entry in entries]))
+            else:
+                self._startMetadata(folderName, [entry.name for entry in entries], None)
+            self.isScanning = False
+            startup_timing.mark('Scan finished')
+            startup_timing.report()
+            if len(self.monitorPending) > 0:
+                self._folderMonitorFlush()
+            if self.nameIndex is None:
+                self._startNameIndex()
+        return False
+
+
+
+    def _updateFilesTitle(self):
+        ''' Show the number of files of each extension in the title of the files column. '''
         treeviewcolumnFilename = self.builder.get_object('treeviewcolumnFilename')
-        treeviewcolumnFilename.set_title('Files ({})'.format(count))
+        treeviewcolumnFilename.set_title(self.extensionIndex.getTitle(self.extensions))
+
+
+
+    def refreshFolder(self):
+        '''
+        Scan the folder again and apply only the differences to the liststore.
+        This keeps the selection and the scroll position.
+        '''
+        if self.scanCancellable is not None:
+            self.scanCancellable.cancel()
+        self.scanCancellable = Gio.Cancellable()
+        self.isScanning = True
+        # A file that has changed size does not change the stamp of its folder, so the folder sizes are worked out again from scratch.
+        self.folderSizes.clear()
+
+        # The rows held back by a scan that was still running are part of the listing that the new scan is compared with.
+        self._appendPendingEntries()
+        names = [row[COLUMN_NAME] for row in self.builder.get_object('liststoreFiles')]
+        thread = threading.Thread(target=self._refreshFolderThread, args=(self.folderName, names, self.scanCancellable), daemon=True)
+        thread.start()
+
+
+
+    @profiler.timed()
+    def _refreshFolderThread(self, folderName, names, cancellable):
+        '''
+        Worker thread for :py:meth:`refreshFolder`.
+        The differences are found here so that the main thread only applies them.
+
+        :param str folderName: The folder to scan.
+        :param list names: The names in the liststore when the refresh started.
+        :param Gio.Cancellable cancellable: Cancelled when this scan is no longer wanted.
+        '''
+        stamp = listing_cache.folderStamp(folderName)
+        entries = list(scanner.scanFolder(folderName, isCancelled=cancellable.is_cancelled))
+        if cancellable.is_cancelled():
+            return
+        oldKeys = [scanner.naturalKey(name) for name in names]
+        splices = scanner.diffSorted(oldKeys, entries)
+        GLib.idle_add(self._refreshFolderApply, folderName, stamp, entries, splices, cancellable)
+
+
+
+    @profiler.timed()
+    def _refreshFolderApply(self, folderName, stamp, entries, splices, cancellable):
+        '''
+        Idle handler to apply the differences between the liststore and a new scan.
+
+        :param str folderName: The folder that was scanned.
+        :param tuple stamp: The stamp of the folder from before the scan.
+        :param list entries: The sorted :py:class:`~common.scanner.ScanEntry` objects from the new scan.
+        :param list splices: The differences from :py:func:`~common.scanner.diffSorted`.
+        :param Gio.Cancellable cancellable: The cancellable of the scan.
+        :returns: False to remove the idle handler.
+        '''
+        if cancellable.is_cancelled():
+            return False
+        # The rows of an indexed listing might still be held back, its splices were worked out with them.
+        # A refresh appended the held back rows before it read the names, so there are none here.
+        self._appendPendingEntries()
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        with self._bulkChange(sum([numberToRemove + len(entriesToInsert) for position, numberToRemove, entriesToInsert in splices])):
+            for position, numberToRemove, entriesToInsert in splices:
+                for index in range(numberToRemove):
+                    liststoreFiles.remove(liststoreFiles.iter_nth_child(None, position))
+                orders = self._getNewOrders(position, len(entriesToInsert))
+                for index, entry in enumerate(entriesToInsert):
+                    liststoreFiles.insert_with_valuesv(position + index, ROW_COLUMNS, self._getRowValues(entry, orders[index]))
+                self.extensionIndex.splice(position, numberToRemove, self._getExtensions(entriesToInsert))
+                self._liststoreSpliced(position, numberToRemove, entriesToInsert)
+        self._updateFilesTitle()
+        self._scanFolderFinished(folderName, stamp, entries, cancellable)
+        return False
+
+
+
+    def _startFolderMonitor(self):
+        ''' Start monitoring the current folder for changes if the live mode is enabled. '''
+        if self.folderMonitor is not None:
+            self.folderMonitor.cancel()
+            self.folderMonitor = None
+        self.monitorPending.clear()
+        if not self.isLive:
+            return
+        try:
+            self.folderMonitor = Gio.File.new_for_path(self.folderName).monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        except GLib.Error as error:
+            logger.warning('Can not monitor "%s". %s', self.folderName, error.message)
+            return
+        self.folderMonitor.connect('changed', self._folderMonitorChanged)
+
+
+
+    def _folderMonitorChanged(self, monitor, file, otherFile, eventType):
+        '''
+        Signal handler for the folder monitor reporting a change.
+        The changes are collected for :py:const:`MONITOR_DELAY` milliseconds and then applied together.
+        '''
+        if monitor is not self.folderMonitor:
+            return
+        if eventType in (Gio.FileMonitorEvent.CREATED, Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_IN, Gio.FileMonitorEvent.MOVED_OUT):
+            self.monitorPending.add(file.get_basename())
+        elif eventType == Gio.FileMonitorEvent.RENAMED:
+            self.monitorPending.add(file.get_basename())
+            self.monitorPending.add(otherFile.get_basename())
+        else:
+            return
+        if self.monitorSourceId == 0:
+            self.monitorSourceId = GLib.timeout_add(MONITOR_DELAY, self._folderMonitorFlush)
+
+
+
+    @profiler.timed()
+    def _folderMonitorFlush(self):
+        '''
+        Timeout handler to apply the collected folder monitor changes.
+        Each changed name is checked on disk and inserted or removed at its sorted position.
+
+        :returns: False to remove the timeout handler.
+        '''
+        self.monitorSourceId = 0
+        if self.isScanning:
+            # The changes are applied when the scan finishes.
+            return False
+        pending = self.monitorPending
+        self.monitorPending = set()
+        if len(pending) > MONITOR_MAX_CHANGES:
+            self.refreshFolder()
+            return False
+        self._applyNameChanges(pending)
+        return False
+
+
+
+    def _applyNameChanges(self, names):
+        '''
+        Bring the rows of some names up to date with the folder.
+        Each name is checked on disk and inserted or removed at its sorted position, so the folder is not scanned again.
+
+        :param set names: The names in the current folder that might have been created or removed.
+        '''
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        getName = lambda index: liststoreFiles.get_value(liststoreFiles.iter_nth_child(None, index), COLUMN_NAME)
+        getKey = lambda index: scanner.naturalKey(getName(index))
+        with self._bulkChange(len(names)):
+            for name in sorted(names):
+                count = liststoreFiles.iter_n_children(None)
+                position = scanner.bisectSorted(count, getKey, scanner.naturalKey(name))
+                isListed = position < count and getName(position) == name
+                path = os.path.join(self.folderName, name)
+                # Only the totals above the changed path are worked out again.
+                self.folderSizes.invalidate(path)
+                entry = scanner.entryFromPath(path, withStat=True)
+                if entry is None and isListed:
+                    liststoreFiles.remove(liststoreFiles.iter_nth_child(None, position))
+                    self.extensionIndex.splice(position, 1, [])
+                    self._liststoreSpliced(position, 1, [])
+                elif entry is not None and not isListed:
+                    liststoreFiles.insert_with_valuesv(position, ROW_COLUMNS, self._getRowValues(entry, self._getNewOrders(position, 1)[0]))
+                    self.extensionIndex.splice(position, 0, self._getExtensions([entry]))
+                    self._liststoreSpliced(position, 0, [entry])
+                    if self.isFolderSizes and entry.isFolder:
+                        self.folderSizeRows[path] = name
+                        self.folderSizes.request(path)
+        self._updateFilesTitle()
+
+
+
+    def _startMetadata(self, folderName, names, positions, stamp=None, folders=None):
+        '''
+        Read the size, modified time and content type of the rows in the liststore on a worker thread.
+        Any earlier read is stopped.
+
+        :param str folderName: The folder that holds the files.
+        :param list names: The names of the rows in the liststore.
+        :param list positions: The positions of the rows to read or None to read every row.
+        :param tuple stamp: The stamp of a new scan to write the listing to the folder index or None.
+        :param bytes folders: 1 for each folder and 0 for each file, when there is a stamp.
+        '''
+        self.metadataSerial += 1
+        serial = self.metadataSerial
+        cancellable = self.scanCancellable
+        isCancelled = lambda: cancellable.is_cancelled() or self.metadataSerial != serial
+        thread = threading.Thread(target=self._metadataThread, args=(folderName, names, positions, self.layoutGeneration, isCancelled, stamp, folders), daemon=True)
+        thread.start()
+
+
+
+    def _restartMetadata(self):
+        ''' Read the metadata of the rows in the liststore that do not have it yet. '''
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        names = []
+        positions = []
+        for position, row in enumerate(liststoreFiles):
+            names.append(row[COLUMN_NAME])
+            if row[COLUMN_CONTENT_TYPE] is None:
+                positions.append(position)
+        if len(positions) > 0:
+            self._startMetadata(self.folderName, names, positions)
+
+
+
+    def _metadataThread(self, folderName, names, positions, layoutGeneration, isCancelled, stamp, folders):
+        '''
+        Worker thread for :py:meth:`_startMetadata`.
+        This must not touch any GTK objects, the batches are passed back to the main thread with GLib.idle_add().
+        The folder index is written here too, first the listing and then the metadata when every row has been read.
+
+        :param str folderName: The folder that holds the files.
+        :param list names: The names of the rows in the liststore.
+        :param list positions: The positions of the rows to read or None to read every row.
+        :param int layoutGeneration: The layout generation when the names were read.
+        :param isCancelled: Function that returns True when this read is no longer wanted.
+        :param tuple stamp: The stamp of a new scan to write the listing to the folder index or None.
+        :param bytes folders: 1 for each folder and 0 for each file, when there is a stamp.
+        '''
+        if self.folderIndex is not None and stamp is not None:
+            self.folderIndex.put(folderName, stamp, names, folders)
+        batches = []
+        for batch in file_metadata.readMetadata(folderName, names, positions, isCancelled):
+            GLib.idle_add(self._metadataBatch, batch, layoutGeneration, isCancelled)
+            batches.append(batch)
+        if self.folderIndex is not None and positions is None and not isCancelled():
+            self.folderIndex.putMetadata(folderName, names, batches)
+        GLib.idle_add(self._metadataFinished, isCancelled)
+
+
+
+    @profiler.timed()
+    def _metadataBatch(self, batch, layoutGeneration, isCancelled):
+        '''
+        Idle handler to store a batch of metadata in the liststore.
+        If rows have been inserted or removed since the names were read then the rows that are still missing their metadata are read again.
+
+        :returns: False to remove the idle handler.
+        '''
+        if isCancelled():
+            return False
+        if layoutGeneration != self.layoutGeneration:
+            self._restartMetadata()
+            return False
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        for index, position in enumerate(batch.positions):
+            treeIter = liststoreFiles.iter_nth_child(None, position)
+            liststoreFiles.set(treeIter, [COLUMN_SIZE, COLUMN_MODIFIED, COLUMN_CONTENT_TYPE], [batch.sizes[index], batch.modified[index], batch.contentTypes[index]])
+        return False
+
+
+
+    def _metadataFinished(self, isCancelled):
+        '''
+        Idle handler for the metadata of the liststore being read.
+        The total sizes of the folders are asked for now, so that they are not replaced by the sizes of the folders themselves.
+
+        :returns: False to remove the idle handler.
+        '''
+        if not isCancelled() and self.isFolderSizes:
+            self._requestFolderSizes()
+        return False
+
+
+
+    def _viewFolderSizes(self, widget):
+        '''
+        Signal handler for the 'View' → 'Folder Sizes' menu point.
+        Turning it off stops the walks, the totals already shown stay until the folder is scanned again.
+        '''
+        self.isFolderSizes = widget.get_active()
+        if self.isFolderSizes:
+            self._requestFolderSizes()
+        else:
+            self.folderSizes.cancelExcept(set())
+            self.folderSizeRows.clear()
+
+
+
+    def _requestFolderSizes(self):
+        ''' Ask for the total sizes of the folder rows in the liststore. '''
+        for row in self.builder.get_object('liststoreFiles'):
+            if row[COLUMN_IS_FOLDER]:
+                path = os.path.join(self.folderName, row[COLUMN_NAME])
+                self.folderSizeRows[path] = row[COLUMN_NAME]
+                self.folderSizes.request(path)
+
+
+
+    def _folderSizeMade(self, path, total, isFinal):
+        '''
+        Callback for a total size of a folder.  This is called on a worker thread.
+
+        :param str path: The path of the folder.
+        :param int total: The total size of the files under the folder so far.
+        :param bool isFinal: True if the total is final.
+        '''
+        GLib.idle_add(self._folderSizeChanged, path, total, isFinal)
+
+
+
+    @profiler.timed()
+    def _folderSizeChanged(self, path, total, isFinal):
+        '''
+        Idle handler to show a total size of a folder in its row.
+        The row is found by its name, so it does not matter if rows have been inserted or removed since.
+
+        :returns: False to remove the idle handler.
+        '''
+        name = self.folderSizeRows.get(path)
+        if name is None:
+            return False
+        if isFinal:
+            del self.folderSizeRows[path]
+        liststoreFiles = self.builder.get_object('liststoreFiles')
+        getName = lambda index: liststoreFiles.get_value(liststoreFiles.iter_nth_child(None, index), COLUMN_NAME)
+        count = liststoreFiles.iter_n_children(None)
+        position = scanner.bisectSorted(count, lambda index: scanner.naturalKey(getName(index)), scanner.naturalKey(name))
+        if position < count and getName(position) == name:
+            liststoreFiles.set_value(liststoreFiles.iter_nth_child(None, position), COLUMN_SIZE, total)
+        return False
 
 
 
     def runMainLoop(self):
         ''' Run the Gtk main loop. '''
         self.window.show_all()
+        startup_timing.mark('Show window')
         Gtk.main()
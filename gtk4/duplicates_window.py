@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Class to show the duplicate files under a folder in a GTK4 window.
+Each group of files with the same contents is a row that expands to show the files.
+'''
+
+import os
+import threading
+
+from gi.repository import Gtk, Gio, GLib, GObject
+
+# Application libraries.
+import common.duplicates as duplicates
+import common.selection_summary as selection_summary
+import common.profiler as profiler
+
+
+
+class DuplicateRow(GObject.GObject):
+    '''
+    Class to represent a row in the duplicates treelist, either a group or one of its files.
+
+    :ivar str text: The text of the row.
+    :ivar str sizeText: The text of the size column.
+    :ivar DuplicateGroup group: The group of a group row or None for a file row.
+    :ivar str path: The path of a file row or None for a group row.
+    '''
+
+
+
+    def __init__(self, text, sizeText, group=None, path=None):
+        super(DuplicateRow, self).__init__()
+        self.text = text
+        self.sizeText = sizeText
+        self.group = group
+        self.path = path
+
+
+
+class DuplicatesWindow(Gtk.Window):
+    '''
+    Class to represent the window that finds and shows the duplicate files under a folder.
+    The search runs on a worker thread with the hashing in the worker processes of the finder.
+    Closing the window stops the search.
+    '''
+
+
+
+    def __init__(self, parent, finder, folderName):
+        '''
+        Class constructor for the :py:class:`DuplicatesWindow` class.
+        The search starts at once.
+
+        :param Gtk.Window parent: The main window.
+        :param DuplicateFinder finder: The finder, shared between the searches so that its worker processes are reused.
+        :param str folderName: The folder to search under.
+        '''
+        super().__init__(title='Duplicates in {}'.format(folderName), transient_for=parent)
+        self.set_default_size(800, 600)
+        self.finder = finder
+        self.folderName = folderName
+        self.isCancelled = False
+
+        # The groups, each expands to its files.
+        self.liststoreGroups = Gio.ListStore.new(DuplicateRow)
+        self.treelistGroups = Gtk.TreeListModel.new(self.liststoreGroups, False, False, self._addGroupFiles)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.set_child(box)
+        self.labelProgress = Gtk.Label(label=duplicates.STAGE_SCAN)
+        self.labelProgress.set_xalign(0.0)
+        box.append(self.labelProgress)
+        self.progressBar = Gtk.ProgressBar()
+        box.append(self.progressBar)
+
+        self.columnviewGroups = Gtk.ColumnView()
+        self.columnviewGroups.set_vexpand(True)
+        self.columnviewGroups.set_model(Gtk.MultiSelection.new(self.treelistGroups))
+        factory = Gtk.SignalListItemFactory()
+        factory.connect('setup', self.setupExpanderLabel)
+        factory.connect('bind', self.bindDuplicateRow)
+        column = Gtk.ColumnViewColumn.new('Files', factory)
+        column.set_expand(True)
+        self.columnviewGroups.append_column(column)
+        factory = Gtk.SignalListItemFactory()
+        factory.connect('setup', self.setupSizeLabel)
+        factory.connect('bind', self.bindSizeLabel)
+        self.columnviewGroups.append_column(Gtk.ColumnViewColumn.new('Size', factory))
+        scrolledWindow = Gtk.ScrolledWindow()
+        scrolledWindow.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.ALWAYS)
+        scrolledWindow.set_child(self.columnviewGroups)
+        box.append(scrolledWindow)
+
+        self.connect('close-request', self._onCloseRequest)
+        thread = threading.Thread(target=self._findThread, args=(folderName, ), daemon=True)
+        thread.start()
+
+
+
+    def _addGroupFiles(self, item):
+        '''
+        Create function for the treelist model.
+
+        :param DuplicateRow item: The row to return the children of.
+        :returns: The files of a group row or None for a file row.
+        '''
+        if item.group is None:
+            return None
+        store = Gio.ListStore.new(DuplicateRow)
+        store.splice(0, 0, [DuplicateRow(os.path.relpath(path, self.folderName), selection_summary.formatSize(item.group.size), path=path) for path in item.group.paths])
+        return store
+
+
+
+    def setupExpanderLabel(self, widget, item):
+        label = Gtk.Label()
+        label.set_xalign(0.0)
+        expander = Gtk.TreeExpander.new()
+        expander.set_child(label)
+        item.set_child(expander)
+
+
+
+    def bindDuplicateRow(self, widget, item):
+        expander = item.get_child()
+        row = item.get_item()
+        expander.set_list_row(row)
+        expander.get_child().set_label(row.get_item().text)
+
+
+
+    def setupSizeLabel(self, widget, item):
+        label = Gtk.Label()
+        label.set_xalign(1.0)
+        item.set_child(label)
+
+
+
+    def bindSizeLabel(self, widget, item):
+        item.get_child().set_label(item.get_item().get_item().sizeText)
+
+
+
+    def _onCloseRequest(self, window):
+        ''' Signal handler for the window being closed.  Stops the search. '''
+        self.isCancelled = True
+        return False
+
+
+
+    def _findThread(self, folderName):
+        '''
+        Worker thread to find the duplicates.
+
+        :param str folderName: The folder to search under.
+        '''
+        groups = self.finder.find(folderName, lambda: self.isCancelled, lambda stage, numDone, numFiles: GLib.idle_add(self._findProgress, stage, numDone, numFiles))
+        if groups is not None:
+            GLib.idle_add(self._findFinished, groups)
+
+
+
+    def _findProgress(self, stage, numDone, numFiles):
+        '''
+        Idle handler to show the progress of the search.
+
+        :returns: False to remove the idle handler.
+        '''
+        if numFiles == 0:
+            self.labelProgress.set_label(stage)
+            self.progressBar.pulse()
+        else:
+            self.labelProgress.set_label('{} {} of {} files'.format(stage, numDone, numFiles))
+            self.progressBar.set_fraction(numDone / numFiles)
+        return False
+
+
+
+    @profiler.timed()
+    def _findFinished(self, groups):
+        '''
+        Idle handler for the search finishing.  The groups are added in one splice.
+
+        :param list groups: The :py:class:`~common.duplicates.DuplicateGroup` objects.
+        :returns: False to remove the idle handler.
+        '''
+        rows = [DuplicateRow('{} copies of {}'.format(len(group.paths), os.path.basename(group.paths[0])), '{} wasted'.format(selection_summary.formatSize(group.getWastedBytes())), group=group) for group in groups]
+        self.liststoreGroups.splice(0, 0, rows)
+        wasted = sum([group.getWastedBytes() for group in groups])
+        self.labelProgress.set_label('{} groups of duplicates, {} wasted'.format(len(groups), selection_summary.formatSize(wasted)))
+        self.progressBar.set_visible(False)
+        return False
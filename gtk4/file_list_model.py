@@ -0,0 +1,818 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module for the model of the files in a folder for the GTK4 window.
+The names are kept in a single packed buffer and the row objects are only created when GTK asks for an item.
+'''
+
+import os
+import sys
+import array
+import bisect
+import weakref
+import collections
+
+from gi.repository import Gio, GObject, GLib
+
+# Application libraries.
+import common.name_index as name_index
+import common.extension_index as extension_index
+import common.file_metadata as file_metadata
+import common.incremental_sort as incremental_sort
+import common.profiler as profiler
+
+
+
+# The states of the children of a folder row.
+CHILDREN_NOT_LOADED = 0
+CHILDREN_LOADING = 1
+CHILDREN_LOADED = 2
+
+# The encoding of the names in the buffer.  This matches os.fsencode() and os.fsdecode().
+ENCODING = sys.getfilesystemencoding()
+ENCODING_ERRORS = sys.getfilesystemencodeerrors()
+
+# The number of recently created rows that are kept alive so that scrolling back and forth reuses them.
+RECENT_ROWS = 256
+
+# The orders of the rows in a FileListSortModel.
+SORT_NAME = 0
+SORT_SIZE = 1
+SORT_MODIFIED = 2
+
+
+
+class MyFileRow(GObject.GObject):
+    '''
+    Class to represent a row in the files treelist.
+
+    :ivar str fileName: The name of the file.
+    :ivar str path: The full path of the file.
+    :ivar bool isFolder: True if the file is a folder and so can be expanded.
+    :ivar FileListModel childStore: The children of a folder row.  None until the row is first shown.
+    :ivar int childState: One of CHILDREN_NOT_LOADED, CHILDREN_LOADING or CHILDREN_LOADED.
+    :ivar Gio.Cancellable cancellable: The cancellable for loading the children.
+    :ivar int size: The size of the file in bytes or UNKNOWN until its metadata arrives.
+    :ivar float modified: The modified time of the file or UNKNOWN until its metadata arrives.
+    :ivar str contentType: The content type of the file or None until its metadata arrives.
+    '''
+    __gsignals__ = {
+        # The size, modified time and content type have arrived.
+        'metadata-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
+    }
+
+    def __init__(self, txt: str, path=None, isFolder=False):
+        super(MyFileRow, self).__init__()
+        self.fileName = txt
+        self.path = path
+        self.isFolder = isFolder
+        self.childStore = None
+        self.childState = CHILDREN_NOT_LOADED
+        self.cancellable = None
+        self.size = file_metadata.UNKNOWN
+        self.modified = file_metadata.UNKNOWN
+        self.contentType = None
+        # print(f'{self.fileName=}')
+
+
+
+class FileListModel(GObject.GObject, Gio.ListModel):
+    '''
+    Class to represent the files in a folder as a Gio.ListModel of :py:class:`MyFileRow` objects.
+    The names are stored encoded in one bytearray with an array of offsets, so a file costs a few bytes rather than a GObject.
+    A :py:class:`MyFileRow` is only created when GTK asks for the item.
+    The same row object is returned for a position while GTK or anything else holds a reference to it.
+    The size, modified time and content type are kept in arrays beside the names and arrive later with :py:meth:`setMetadata`.
+
+    :ivar str folderName: The folder that holds the files.
+    :ivar int layoutGeneration: Increases each time rows are inserted or removed anywhere except at the end.
+    '''
+
+
+
+    def __init__(self, folderName=None):
+        '''
+        Class constructor for the :py:class:`FileListModel` class.
+
+        :param str folderName: The folder that holds the files.
+        '''
+        super(FileListModel, self).__init__()
+        self.folderName = folderName
+        # The encoded names one after another.
+        self.names = bytearray()
+        # The start of each name in names, plus the end of the last name.
+        self.offsets = array.array('Q', [0])
+        # 1 for folders, 0 for files.
+        self.folders = bytearray()
+        # The metadata by position.
+        self.sizes = array.array('q')
+        self.modified = array.array('d')
+        self.contentTypes = []
+        self.layoutGeneration = 0
+        # Increases each time the metadata is read again, so that older reads stop.
+        self.metadataSerial = 0
+        # The row objects that are in use by position.
+        self.rows = weakref.WeakValueDictionary()
+        # Strong references to the recently created rows.
+        self.recentRows = collections.deque(maxlen=RECENT_ROWS)
+
+
+
+    def do_get_item_type(self):
+        return MyFileRow.__gtype__
+
+
+
+    def do_get_n_items(self):
+        return len(self.folders)
+
+
+
+    def do_get_item(self, position):
+        if position >= len(self.folders):
+            return None
+        row = self.rows.get(position)
+        if row is None:
+            fileName = self.getName(position)
+            row = MyFileRow(fileName, os.path.join(self.folderName, fileName), self.folders[position] != 0)
+            row.size = self.sizes[position]
+            row.modified = self.modified[position]
+            row.contentType = self.contentTypes[position]
+            self.rows[position] = row
+            self.recentRows.append(row)
+        return row
+
+
+
+    def getName(self, position):
+        '''
+        Returns the name of the file at the specified position without creating a row object.
+
+        :param int position: The position in the model.
+        '''
+        return self.names[self.offsets[position]:self.offsets[position + 1]].decode(ENCODING, ENCODING_ERRORS)
+
+
+
+    def getNames(self):
+        '''
+        Returns all the names in the model as a list.
+        '''
+        offsets = self.offsets
+        names = self.names
+        return [names[offsets[index]:offsets[index + 1]].decode(ENCODING, ENCODING_ERRORS) for index in range(len(self.folders))]
+
+
+
+    def isFolder(self, position):
+        '''
+        Returns True if the file at the specified position is a folder.
+
+        :param int position: The position in the model.
+        '''
+        return self.folders[position] != 0
+
+
+
+    def getSize(self, position):
+        '''
+        Returns the size of the file at the specified position or :py:const:`~common.file_metadata.UNKNOWN` if it has not been read yet.
+
+        :param int position: The position in the model.
+        '''
+        return self.sizes[position]
+
+
+
+    @profiler.timed()
+    def splice(self, position, numberToRemove, entries):
+        '''
+        Remove rows and insert new rows at the specified position.
+        A single items-changed signal is emitted.
+        Appending at the end only touches the end of the buffers.
+
+        :param int position: The position of the first row to remove.
+        :param int numberToRemove: The number of rows to remove.
+        :param list entries: The :py:class:`~common.scanner.ScanEntry` objects, or anything with name and isFolder attributes, to insert.
+        '''
+        encoded = [os.fsencode(entry.name) for entry in entries]
+        start = self.offsets[position]
+        end = self.offsets[position + numberToRemove]
+        data = b''.join(encoded)
+        self.names[start:end] = data
+
+        newOffsets = array.array('Q')
+        offset = start
+        for name in encoded:
+            newOffsets.append(offset)
+            offset += len(name)
+        tail = self.offsets[position + numberToRemove:]
+        delta = len(data) - (end - start)
+        if delta != 0:
+            tail = array.array('Q', [value + delta for value in tail])
+        self.offsets[position:] = newOffsets + tail
+        self.folders[position:position + numberToRemove] = bytes(1 if entry.isFolder else 0 for entry in entries)
+        self.sizes[position:position + numberToRemove] = array.array('q', [file_metadata.UNKNOWN if getattr(entry, 'size', None) is None else entry.size for entry in entries])
+        self.modified[position:position + numberToRemove] = array.array('d', [file_metadata.UNKNOWN if getattr(entry, 'modified', None) is None else entry.modified for entry in entries])
+        self.contentTypes[position:position + numberToRemove] = [None if getattr(entry, 'size', None) is None else file_metadata.getContentType(entry.name, entry.isFolder) for entry in entries]
+        if numberToRemove > 0 or position + len(entries) < len(self.folders):
+            self.layoutGeneration += 1
+
+        self._moveRows(position, numberToRemove, len(entries))
+        if numberToRemove > 0 or len(entries) > 0:
+            self.items_changed(position, numberToRemove, len(entries))
+
+
+
+    def removeAll(self):
+        ''' Remove all the rows. '''
+        numberToRemove = len(self.folders)
+        self.names = bytearray()
+        self.offsets = array.array('Q', [0])
+        self.folders = bytearray()
+        self._clearMetadata()
+        self.rows = weakref.WeakValueDictionary()
+        self.recentRows.clear()
+        if numberToRemove > 0:
+            self.items_changed(0, numberToRemove, 0)
+
+
+
+    def getSnapshot(self):
+        '''
+        Returns a copy of the contents of the model for the listing cache.
+        This is three buffer copies, no row objects are created.
+        '''
+        return (bytes(self.names), array.array('Q', self.offsets), bytes(self.folders))
+
+
+
+    def restoreSnapshot(self, snapshot):
+        '''
+        Replace the contents of the model with a snapshot from :py:meth:`getSnapshot`.
+
+        :param tuple snapshot: The snapshot.
+        '''
+        numberToRemove = len(self.folders)
+        names, offsets, folders = snapshot
+        self.names = bytearray(names)
+        self.offsets = array.array('Q', offsets)
+        self.folders = bytearray(folders)
+        self._clearMetadata()
+        self.rows = weakref.WeakValueDictionary()
+        self.recentRows.clear()
+        if numberToRemove > 0 or len(self.folders) > 0:
+            self.items_changed(0, numberToRemove, len(self.folders))
+
+
+
+    @profiler.timed()
+    def setMetadata(self, batch):
+        '''
+        Store a batch of metadata from :py:func:`~common.file_metadata.readMetadata`.
+        The row objects in use are updated and emit 'metadata-changed' so that their cells are updated.
+        The batch must be from the current :py:attr:`layoutGeneration`.
+
+        :param MetadataBatch batch: The metadata.
+        '''
+        for index, position in enumerate(batch.positions):
+            self.sizes[position] = batch.sizes[index]
+            self.modified[position] = batch.modified[index]
+            self.contentTypes[position] = batch.contentTypes[index]
+        if len(self.rows) == 0 or len(batch) == 0:
+            return
+        first = batch.positions[0]
+        last = batch.positions[-1]
+        for position, row in list(self.rows.items()):
+            if first <= position <= last:
+                row.size = self.sizes[position]
+                row.modified = self.modified[position]
+                row.contentType = self.contentTypes[position]
+                row.emit('metadata-changed')
+
+
+
+    def setSize(self, position, size):
+        '''
+        Set the size of one row, for example the total size of the files under a folder.
+
+        :param int position: The position of the row.
+        :param int size: The size in bytes.
+        '''
+        self.sizes[position] = size
+        row = self.rows.get(position)
+        if row is not None:
+            row.size = size
+            row.emit('metadata-changed')
+
+
+
+    def getUnknownPositions(self):
+        ''' Returns the positions of the rows that do not have their metadata yet. '''
+        return [position for position, contentType in enumerate(self.contentTypes) if contentType is None]
+
+
+
+    def _clearMetadata(self):
+        ''' Set the metadata of every row to unknown after the rows have been replaced. '''
+        numRows = len(self.folders)
+        self.sizes = array.array('q', [file_metadata.UNKNOWN]) * numRows
+        self.modified = array.array('d', [file_metadata.UNKNOWN]) * numRows
+        self.contentTypes = [None] * numRows
+        self.layoutGeneration += 1
+
+
+
+    def _moveRows(self, position, numberRemoved, numberAdded):
+        '''
+        Update the positions of the row objects in use after a splice.
+        Only the rows that are in use are touched, not every position.
+        '''
+        if numberRemoved == numberAdded == 0 or len(self.rows) == 0:
+            return
+        rows = weakref.WeakValueDictionary()
+        for index, row in list(self.rows.items()):
+            if index < position:
+                rows[index] = row
+            elif index >= position + numberRemoved:
+                rows[index - numberRemoved + numberAdded] = row
+        self.rows = rows
+
+
+
+def getSnapshotNames(snapshot):
+    '''
+    Returns the names in a snapshot from :py:meth:`FileListModel.getSnapshot`.
+    A worker thread can use this, unlike the model itself.
+
+    :param tuple snapshot: The snapshot.
+    '''
+    names, offsets, folders = snapshot
+    return [names[offsets[index]:offsets[index + 1]].decode(ENCODING, ENCODING_ERRORS) for index in range(len(folders))]
+
+
+
+class FileListFilterModel(GObject.GObject, Gio.ListModel):
+    '''
+    Class to show the rows of a :py:class:`FileListModel` whose names contain a query and whose extensions are selected.
+    The matching positions come from a :py:class:`~common.name_index.NameIndex` and an :py:class:`~common.extension_index.ExtensionIndex`, so changing the filter does not visit every row.
+    Without a filter every row of the source model is shown and its changes are passed straight through.
+
+    :ivar FileListModel source: The model to filter.
+    :ivar str query: The current query or an empty string.
+    :ivar set extensions: The selected extensions or None to show every extension.  Folders are always shown.
+    :ivar NameIndex index: The index over the names in the source model or None if there is no up to date index.
+    :ivar ExtensionIndex extensionIndex: The index over the extensions in the source model.  This is always up to date.
+    :ivar int layoutGeneration: Increases each time rows are inserted or removed anywhere except at the end of the source model.
+    '''
+
+
+
+    def __init__(self, source):
+        '''
+        Class constructor for the :py:class:`FileListFilterModel` class.
+
+        :param FileListModel source: The model to filter.
+        '''
+        super(FileListFilterModel, self).__init__()
+        self.source = source
+        self.query = ''
+        self.extensions = None
+        self.index = None
+        self.extensionIndex = extension_index.ExtensionIndex()
+        self.layoutGeneration = 0
+        # The positions in the source model of the matching rows or None to show every row.
+        self.positions = None
+        self.source.connect('items-changed', self._sourceItemsChanged)
+
+
+
+    def do_get_item_type(self):
+        return MyFileRow.__gtype__
+
+
+
+    def do_get_n_items(self):
+        if self.positions is None:
+            return self.source.get_n_items()
+        return len(self.positions)
+
+
+
+    def do_get_item(self, position):
+        if self.positions is None:
+            return self.source.do_get_item(position)
+        if position >= len(self.positions):
+            return None
+        return self.source.do_get_item(self.positions[position])
+
+
+
+    def getSourcePosition(self, position):
+        '''
+        Returns the position in the source model of a row in this model.
+
+        :param int position: The position in this model.
+        '''
+        if self.positions is None:
+            return position
+        return self.positions[position]
+
+
+
+    def getSourcePositions(self, start, stop):
+        '''
+        Returns the positions in the source model of a range of rows in this model.
+
+        :param int start: The position of the first row in this model.
+        :param int stop: The position after the last row.
+        '''
+        if self.positions is None:
+            return range(start, stop)
+        return self.positions[start:stop]
+
+
+
+    def getName(self, position):
+        '''
+        Returns the name of the file at the specified position without creating a row object.
+
+        :param int position: The position in this model.
+        '''
+        return self.source.getName(self.getSourcePosition(position))
+
+
+
+    def isFolder(self, position):
+        '''
+        Returns True if the file at the specified position is a folder.
+
+        :param int position: The position in this model.
+        '''
+        return self.source.isFolder(self.getSourcePosition(position))
+
+
+
+    def getSize(self, position):
+        '''
+        Returns the size of the file at the specified position or :py:const:`~common.file_metadata.UNKNOWN` if it has not been read yet.
+
+        :param int position: The position in this model.
+        '''
+        return self.source.getSize(self.getSourcePosition(position))
+
+
+
+    def setIndex(self, index, layoutGeneration):
+        '''
+        Use a new index over the names in the source model.
+        Names appended to the source model since the index was started are added to it.
+
+        :param NameIndex index: The index.
+        :param int layoutGeneration: The value of :py:attr:`layoutGeneration` when the names for the index were read.
+        :returns: True if the index is used, False if the source model has changed too much since.
+        '''
+        if layoutGeneration != self.layoutGeneration:
+            return False
+        numItems = self.source.get_n_items()
+        if index.size < numItems:
+            index.addNames([self.source.getName(position) for position in range(index.size, numItems)])
+        self.index = index
+        return True
+
+
+
+    def setQuery(self, query):
+        '''
+        Show only the rows whose names contain the query.
+        With an index this only checks the names that share the rarest trigram with the query, or the previous results if the query was refined.
+
+        :param str query: The text to find or an empty string to show every row.
+        '''
+        self.query = query
+        self._filter()
+
+
+
+    def setExtensions(self, extensions):
+        '''
+        Show only the folders and the files with the specified extensions.
+        The positions come from the extension index, nothing is read from the filesystem.
+
+        :param set extensions: The lower case extensions including the '.' or None to show every extension.
+        '''
+        self.extensions = extensions
+        self._filter()
+
+
+
+    def getTitle(self):
+        ''' Returns the text for the title of the files column with the number of files of each extension. '''
+        return self.extensionIndex.getTitle(self.extensions)
+
+
+
+    @profiler.timed()
+    def _filter(self):
+        ''' Work out the positions of the rows to show from the indexes and replace all the rows. '''
+        numRemoved = self.do_get_n_items()
+        if self.query == '' and self.extensions is None:
+            self.positions = None
+        else:
+            ids = None
+            if self.extensions is not None:
+                ids = self.extensionIndex.getPositions(self.extensions)
+            if self.query == '':
+                self.positions = array.array('I', ids)
+            elif self.index is not None:
+                positions = self.index.search(self.query)
+                if ids is not None:
+                    ids = set(ids)
+                    positions = [position for position in positions if position in ids]
+                self.positions = array.array('I', positions)
+            else:
+                self.positions = array.array('I', name_index.searchLinear(self.source.getNames(), self.query, ids))
+        self.items_changed(0, numRemoved, self.do_get_n_items())
+
+
+
+    def _isMatch(self, position):
+        '''
+        Returns True if the row at the specified position in the source model matches the filter.
+
+        :param int position: The position in the source model.
+        '''
+        if self.extensions is not None and not self.source.isFolder(position):
+            if extension_index.getExtension(self.source.getName(position)) not in self.extensions:
+                return False
+        return self.query == '' or name_index.normalise(self.query) in name_index.normalise(self.source.getName(position))
+
+
+
+    def _sourceItemsChanged(self, source, position, numRemoved, numAdded):
+        '''
+        Signal handler for the rows in the source model changing.
+        The change is mapped onto the matching rows, only the new rows are checked against the filter and the indexes are spliced rather than rebuilt.
+        '''
+        isAppend = numRemoved == 0 and position + numAdded == source.get_n_items()
+        newRange = range(position, position + numAdded)
+        self.extensionIndex.splice(position, numRemoved, [extension_index.FOLDERS if source.isFolder(index) else extension_index.getExtension(source.getName(index)) for index in newRange])
+        if not isAppend:
+            self.layoutGeneration += 1
+        if self.index is not None:
+            self.index.splice(position, numRemoved, [source.getName(index) for index in newRange])
+
+        if self.positions is None:
+            self.items_changed(position, numRemoved, numAdded)
+            return
+        # The matching rows before the change keep their positions, the ones after it move by the change in the number of rows.
+        start = bisect.bisect_left(self.positions, position)
+        end = bisect.bisect_left(self.positions, position + numRemoved)
+        matches = array.array('I', [index for index in newRange if self._isMatch(index)])
+        delta = numAdded - numRemoved
+        tail = self.positions[end:]
+        if delta != 0 and len(tail) > 0:
+            tail = array.array('I', [value + delta for value in tail])
+        self.positions[start:] = matches + tail
+        if end > start or len(matches) > 0:
+            self.items_changed(start, end - start, len(matches))
+
+
+
+class FileListSortModel(GObject.GObject, Gio.ListModel):
+    '''
+    Class to show the rows of a :py:class:`FileListFilterModel` sorted by name, size or modified time.
+    The rows are already in natural name order, so sorting by name passes straight through and the position is the key for sorting by name in reverse.
+    The sizes and modified times are the arrays in the :py:class:`FileListModel`, so no key is worked out again.
+    The other orders are sorted in idle time a slice at a time with :py:class:`~common.incremental_sort.IncrementalSort`, showing the previous order until the sort is finished.
+    Rows added to the source model are merged into the current order by their keys, so a scan or a burst of changes does not start the sort again.
+
+    :ivar FileListFilterModel source: The model to sort.
+    :ivar int sortKey: One of SORT_NAME, SORT_SIZE or SORT_MODIFIED.
+    :ivar bool reverse: True for a descending order.
+    '''
+
+
+
+    def __init__(self, source):
+        '''
+        Class constructor for the :py:class:`FileListSortModel` class.
+
+        :param FileListFilterModel source: The model to sort.
+        '''
+        super(FileListSortModel, self).__init__()
+        self.source = source
+        self.sortKey = SORT_NAME
+        self.reverse = False
+        # The positions in the source model in sorted order or None to show the source order.
+        self.positions = None
+        # The sort in progress and its idle handler.
+        self.sorter = None
+        self.sortSourceId = 0
+        # The (position, numRemoved, numAdded) changes of the source model since the sort in progress started.
+        self.sortChanges = []
+        # The positions in the store and the keys of the rows when the sort in progress started.
+        self.sortSourcePositions = None
+        self.sortValues = None
+        self.source.connect('items-changed', self._sourceItemsChanged)
+
+
+
+    def do_get_item_type(self):
+        return MyFileRow.__gtype__
+
+
+
+    def do_get_n_items(self):
+        if self.positions is None:
+            return self.source.get_n_items()
+        return len(self.positions)
+
+
+
+    def do_get_item(self, position):
+        if self.positions is None:
+            return self.source.do_get_item(position)
+        if position >= len(self.positions):
+            return None
+        return self.source.do_get_item(self.positions[position])
+
+
+
+    def getSourcePosition(self, position):
+        '''
+        Returns the position in the source model of a row in this model.
+
+        :param int position: The position in this model.
+        '''
+        if self.positions is None:
+            return position
+        return self.positions[position]
+
+
+
+    def getName(self, position):
+        '''
+        Returns the name of the file at the specified position without creating a row object.
+
+        :param int position: The position in this model.
+        '''
+        return self.source.getName(self.getSourcePosition(position))
+
+
+
+    def isFolder(self, position):
+        '''
+        Returns True if the file at the specified position is a folder.
+
+        :param int position: The position in this model.
+        '''
+        return self.source.isFolder(self.getSourcePosition(position))
+
+
+
+    def getSize(self, position):
+        '''
+        Returns the size of the file at the specified position or :py:const:`~common.file_metadata.UNKNOWN` if it has not been read yet.
+
+        :param int position: The position in this model.
+        '''
+        return self.source.getSize(self.getSourcePosition(position))
+
+
+
+    def setSort(self, sortKey, reverse):
+        '''
+        Change the order of the rows.
+
+        :param int sortKey: One of SORT_NAME, SORT_SIZE or SORT_MODIFIED.
+        :param bool reverse: True for a descending order.
+        '''
+        self.sortKey = sortKey
+        self.reverse = reverse
+        self._sort()
+
+
+
+    def resort(self):
+        ''' Sort again after the metadata has changed.  Nothing is done for the name orders. '''
+        if self.sortKey != SORT_NAME:
+            self._sort()
+
+
+
+    def _sort(self):
+        ''' Start sorting the rows, replacing any sort that is in progress. '''
+        self.sorter = None
+        self.sortChanges = []
+        if self.sortKey == SORT_NAME and not self.reverse:
+            if self.positions is not None:
+                self._setPositions(None)
+            return
+        # The keys are read from a copy, so that the rows changing during the sort do not mix up its keys.
+        numItems = self.source.get_n_items()
+        self.sortSourcePositions = self.source.getSourcePositions(0, numItems)
+        if self.sortKey != SORT_NAME:
+            store = self.source.source
+            self.sortValues = (store.sizes if self.sortKey == SORT_SIZE else store.modified)[:]
+        self.sorter = incremental_sort.IncrementalSort(numItems, self._readKeys, self.reverse)
+        if self.sortSourceId == 0:
+            self.sortSourceId = GLib.idle_add(self._sortStep)
+
+
+
+    def _readKeys(self, start, stop):
+        '''
+        Returns the sort keys of a range of rows in the source model for :py:class:`~common.incremental_sort.IncrementalSort`.
+        The keys are those of the rows when the sort started.
+
+        :param int start: The position of the first row in the source model.
+        :param int stop: The position after the last row.
+        '''
+        if self.sortKey == SORT_NAME:
+            return list(range(start, stop))
+        values = self.sortValues
+        return [values[position] for position in self.sortSourcePositions[start:stop]]
+
+
+
+    def _getKey(self, position):
+        '''
+        Returns the key of a row in the source model for merging it into the sorted order.
+        This is the key that :py:class:`~common.incremental_sort.IncrementalSort` sorts by, with the position to keep the sort stable.
+
+        :param int position: The position in the source model.
+        '''
+        if self.sortKey == SORT_NAME:
+            key = position
+        else:
+            store = self.source.source
+            key = (store.sizes if self.sortKey == SORT_SIZE else store.modified)[self.source.getSourcePosition(position)]
+        return (-key if self.reverse else key, position)
+
+
+
+    @profiler.timed()
+    def _sortStep(self):
+        '''
+        Idle handler to do the next slice of the sort.
+
+        :returns: True while there is more to sort.
+        '''
+        if self.sorter is None:
+            self.sortSourceId = 0
+            return False
+        if not self.sorter.step():
+            return True
+        self.sortSourceId = 0
+        positions = array.array('I', self.sorter.result)
+        self.sorter = None
+        self.sortSourcePositions = None
+        self.sortValues = None
+        # The sort is of the rows when it started, so the changes since are applied to its result.
+        added = []
+        for position, numRemoved, numAdded in self.sortChanges:
+            positions = incremental_sort.remapPositions(positions, position, numRemoved, numAdded)
+            added = list(incremental_sort.remapPositions(added, position, numRemoved, numAdded))
+            added.extend(range(position, position + numAdded))
+        self.sortChanges = []
+        self.positions = incremental_sort.mergePositions(positions, added, self._getKey)[0]
+        self.items_changed(0, self.do_get_n_items(), len(self.positions))
+        return False
+
+
+
+    def _setPositions(self, positions):
+        '''
+        Show the rows in a new order.
+
+        :param positions: The positions in the source model in sorted order or None to show the source order.
+        '''
+        numRemoved = self.do_get_n_items()
+        self.positions = positions
+        self.items_changed(0, numRemoved, self.do_get_n_items())
+
+
+
+    def _sourceItemsChanged(self, source, position, numRemoved, numAdded):
+        '''
+        Signal handler for the rows in the source model changing.
+        In a sorted order the removed rows are dropped and the new rows are merged in by their keys, each with one items-changed for the rows between the first and the last change.
+        '''
+        if self.sorter is not None:
+            self.sortChanges.append((position, numRemoved, numAdded))
+        if self.positions is None:
+            self.items_changed(position, numRemoved, numAdded)
+            return
+        if numRemoved > 0:
+            end = position + numRemoved
+            removed = [index for index, sourcePosition in enumerate(self.positions) if position <= sourcePosition < end]
+            self.positions = incremental_sort.remapPositions(self.positions, position, numRemoved, numAdded)
+            if len(removed) > 0:
+                self.items_changed(removed[0], removed[-1] + 1 - removed[0], removed[-1] + 1 - removed[0] - len(removed))
+        elif position + numAdded < source.get_n_items():
+            self.positions = incremental_sort.remapPositions(self.positions, position, numRemoved, numAdded)
+        if numAdded > 0:
+            self.positions, first, last = incremental_sort.mergePositions(self.positions, range(position, position + numAdded), self._getKey)
+            self.items_changed(first, last - first, last - first + numAdded)
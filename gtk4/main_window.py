@@ -12,27 +12,46 @@ import sys
 try:
     import gi
     gi.require_version('Gtk', '4.0')
-    gi.require_version('Adw', '1')
-    from gi.repository import Gtk, Gdk, Adw, Gio, GLib, GObject
-    # from gi.repository import GdkPixbuf
+    gi.require_version('GdkPixbuf', '2.0')
+    from gi.repository import Gtk, Gdk, Gio, GLib, GObject
+    from gi.repository import GdkPixbuf
 except:
     print(f"GTK4 Not Available. ({__file__})")
     sys.exit(0)
 import os
-import subprocess
-import shutil
-import datetime
+import logging
+import collections
 
 # Application libraries.
-
-
-
-class MyFileRow(GObject.GObject):
-    def __init__(self, txt: str, children=None):
-        super(MyFileRow, self).__init__()
-        self.fileName = txt
-        self.children = children
-        # print(f'{self.fileName=}')
+import common.scanner as scanner
+import common.listing_cache as listing_cache
+import common.startup_timing as startup_timing
+import common.selection_summary as selection_summary
+import common.name_index as name_index
+import common.extension_index as extension_index
+import common.file_metadata as file_metadata
+import common.thumbnails as thumbnails
+import common.profiler as profiler
+import common.file_preview as file_preview
+import common.scan_service as scan_service
+import gtk4.tree_expansion as tree_expansion
+from gtk4.duplicates_window import DuplicatesWindow
+from gtk4.file_list_model import MyFileRow, FileListModel, FileListFilterModel, FileListSortModel, getSnapshotNames, CHILDREN_NOT_LOADED, CHILDREN_LOADING, CHILDREN_LOADED, SORT_NAME, SORT_SIZE, SORT_MODIFIED
+
+
+
+# The default number of collapsed folders that keep their children in memory.
+MAX_COLLAPSED_FOLDERS = 64
+# The time in milliseconds to collect folder monitor events before applying them.
+MONITOR_DELAY = 200
+# More than this number of folder monitor changes are applied with a refresh instead.
+MONITOR_MAX_CHANGES = 1000
+# The time in milliseconds to collect the total sizes of folders before sorting by size again.
+FOLDER_SIZE_SORT_DELAY = 500
+# The prefix of the application resources.
+RESOURCE_PATH = '/com/example/GtkApplication'
+
+logger = logging.getLogger(__name__)
 
 
 
@@ -46,20 +65,49 @@ class MainWindow(Gtk.ApplicationWindow):
 
 
 
-    def __init__(self, myArgs, *args, **kwargs):
+    def __init__(self, myArgs, *args, scanService=None, folderName=None, **kwargs):
         '''
         Class constructor for the :py:class:`MainWindow` class.
 
         :param object args: The program arguments.
+        :param ScanService scanService: The scan service shared by the windows of the application or None for a service of its own.
+        :param str folderName: The folder to show or None for the folder of the program.
         '''
         self.args = myArgs
+        # The window stops the scan service on close only if it made the service.
+        self.isOwnScanService = scanService is None
+        if scanService is None:
+            scanService = scan_service.ScanService(maxEntries=getattr(self.args, 'cache_entries', listing_cache.MAX_ENTRIES), isIndexed=getattr(self.args, 'index', False))
+        self.scanService = scanService
         super().__init__(*args, **kwargs)
         self.set_title('Treeview GTK4')
         self.set_default_size(600, 250)
 
         # Add a liststore.
-        self.liststoreFiles = Gio.ListStore.new(MyFileRow)
-        self.treelistFiles = Gtk.TreeListModel.new(self.liststoreFiles, False, False, self.addTreeNode)
+        self.liststoreFiles = FileListModel()
+        self.filterFiles = FileListFilterModel(self.liststoreFiles)
+        self.filterFiles.connect('items-changed', self._filterFilesChanged)
+        self.sortFiles = FileListSortModel(self.filterFiles)
+        self.treelistFiles = Gtk.TreeListModel.new(self.sortFiles, False, False, self.addTreeNode)
+        # True while the name index for the filter is being built.
+        self.isIndexing = False
+        # The thumbnails of the images in the rows that are bound.  The loader is shared by the windows and there is none if thumbnails are turned off.
+        self.thumbnailSize = getattr(self.args, 'thumbnail_size', thumbnails.DISPLAY_SIZE)
+        self.thumbnailLoader = self.scanService.thumbnailLoader if self.thumbnailSize > 0 else None
+        self.textureCache = thumbnails.TextureCache(getattr(self.args, 'thumbnail_cache', thumbnails.MAX_TEXTURES))
+        # The (image, modified) of the bound rows waiting for a thumbnail by path.
+        self.thumbnailImages = {}
+        # The total sizes of the files under the folder rows, only worked out when turned on.  The folder sizes and their cache are shared by the windows.
+        self.isFolderSizes = getattr(self.args, 'folder_sizes', False)
+        self.folderSizes = self.scanService.folderSizes
+        # The (store, name) of the folder rows waiting for their total size by path.
+        self.folderSizeRows = {}
+        self.folderSizeSortId = 0
+        # The preview of the selected file is read on a worker thread after the selection has settled.
+        self.previewLoader = file_preview.PreviewLoader(self._previewRead, self._decodePreviewImage)
+        self.previewPath = None
+        self.previewSourceId = 0
+        self.connect('destroy', self._onDestroy)
 
         # Add a vertical box.
         self.boxMain = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
@@ -73,6 +121,13 @@ class MainWindow(Gtk.ApplicationWindow):
         self.boxMain.set_valign(Gtk.Align.FILL)
         self.set_child(self.boxMain)
 
+        # Add a search entry to filter the files.  Typing anywhere in the window starts a search.
+        self.searchEntry = Gtk.SearchEntry()
+        self.searchEntry.set_placeholder_text('Filter')
+        self.searchEntry.set_key_capture_widget(self)
+        self.searchEntry.connect('search-changed', self._searchChanged)
+        self.boxMain.append(self.searchEntry)
+
         # Add a horizontal box.
         self.boxDetails = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
         # self.boxDetails.set_css_classes(['border'])
@@ -81,15 +136,25 @@ class MainWindow(Gtk.ApplicationWindow):
         # Add a ColumnView this replaces TreeView controls.
         self.columnviewFiles = Gtk.ColumnView()
         self.columnviewFiles.set_vexpand(True)
-        selection = Gtk.SingleSelection()
-        selection.set_model(self.treelistFiles)
-        selection.connect('selection-changed', self.columnviewSelectionChanged)
-        self.columnviewFiles.set_model(selection)
+        self.selectionFiles = Gtk.MultiSelection.new(self.treelistFiles)
+        self.selectionFiles.connect('selection-changed', self.columnviewSelectionChanged)
+        self.columnviewFiles.set_model(self.selectionFiles)
         factory = Gtk.SignalListItemFactory()
         factory.connect('setup', self.setupExpanderLabel)
         factory.connect('bind', self.bindMyFileRow)
-        column = Gtk.ColumnViewColumn.new("Files", factory)
-        self.columnviewFiles.append_column(column)
+        factory.connect('unbind', self.unbindMyFileRow)
+        self.columnFiles = Gtk.ColumnViewColumn.new("Files", factory)
+        self.columnFiles.set_expand(True)
+        self.columnviewFiles.append_column(self.columnFiles)
+        # The metadata columns show a placeholder until the metadata of the row arrives.
+        columnSize = self._addMetadataColumn('Size', 1.0, lambda obj: file_metadata.PLACEHOLDER if obj.size == file_metadata.UNKNOWN else selection_summary.formatSize(obj.size))
+        columnModified = self._addMetadataColumn('Modified', 0.0, lambda obj: file_metadata.formatModified(obj.modified))
+        self._addMetadataColumn('Type', 0.0, lambda obj: file_metadata.PLACEHOLDER if obj.contentType is None else obj.contentType)
+        # Clicking a column header sorts the rows.  The column sorters are never called, the sort model uses the precomputed keys.
+        self.sortColumns = {self.columnFiles: SORT_NAME, columnSize: SORT_SIZE, columnModified: SORT_MODIFIED}
+        for sortColumn in self.sortColumns:
+            sortColumn.set_sorter(Gtk.CustomSorter.new(None))
+        self.columnviewFiles.get_sorter().connect('changed', self._sortChanged)
         scrolledWindow = Gtk.ScrolledWindow()
         scrolledWindow.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.ALWAYS)
         scrolledWindow.set_child(self.columnviewFiles)
@@ -125,6 +190,24 @@ class MainWindow(Gtk.ApplicationWindow):
         self.labelSelection.set_hexpand(True)
         self.boxDetails.append(self.labelSelection)
 
+        # Add the preview of the selected file, an image or text.
+        self.previewPicture = Gtk.Picture()
+        self.previewPicture.set_can_shrink(True)
+        self.previewPicture.set_size_request(file_preview.IMAGE_SIZE, file_preview.IMAGE_SIZE)
+        self.previewPicture.set_visible(False)
+        self.previewText = Gtk.TextView()
+        self.previewText.set_editable(False)
+        self.previewText.set_cursor_visible(False)
+        self.previewText.set_monospace(True)
+        self.scrolledPreview = Gtk.ScrolledWindow()
+        self.scrolledPreview.set_size_request(360, -1)
+        self.scrolledPreview.set_vexpand(True)
+        self.scrolledPreview.set_child(self.previewText)
+        self.boxPreview = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.boxPreview.append(self.previewPicture)
+        self.boxPreview.append(self.scrolledPreview)
+        self.boxDetails.append(self.boxPreview)
+
         # Add a MenuButton.
         #self.menuButton = Gtk.MenuButton()
         #self.menuButton.set_icon_name('open-menu-symbolic')
@@ -151,10 +234,36 @@ class MainWindow(Gtk.ApplicationWindow):
         action = Gio.SimpleAction.new('about', None)
         action.connect('activate', self._actionAbout)
         self.add_action(action)
+        # The parameter is the depth to expand to, -1 for every level.
+        action = Gio.SimpleAction.new('expand', GLib.VariantType.new('i'))
+        action.connect('activate', self._actionExpand)
+        self.add_action(action)
+        action = Gio.SimpleAction.new('stopexpand', None)
+        action.connect('activate', lambda action, param: self._stopExpansion())
+        self.add_action(action)
+        action = Gio.SimpleAction.new('duplicates', None)
+        action.connect('activate', self._actionDuplicates)
+        self.add_action(action)
+        action = Gio.SimpleAction.new('newwindow', None)
+        action.connect('activate', self._actionNewWindow)
+        self.add_action(action)
+        action = Gio.SimpleAction.new_stateful('foldersizes', None, GLib.Variant.new_boolean(self.isFolderSizes))
+        action.connect('change-state', self._actionFolderSizes)
+        self.add_action(action)
 
         # Create a new menu, containing the simple actions.
         menu = Gio.Menu.new()
+        menu.append('New Window', 'win.newwindow')
         menu.append('Do Something', 'win.something')
+        menu.append('Folder Sizes', 'win.foldersizes')
+        menu.append('Find Duplicates', 'win.duplicates')
+        expandMenu = Gio.Menu.new()
+        expandMenu.append('Expand 1 Level', 'win.expand(1)')
+        expandMenu.append('Expand 2 Levels', 'win.expand(2)')
+        expandMenu.append('Expand 3 Levels', 'win.expand(3)')
+        expandMenu.append('Expand All', 'win.expand(-1)')
+        expandMenu.append('Stop Expanding', 'win.stopexpand')
+        menu.append_section(None, expandMenu)
         menu.append('About', 'win.about')
 
         # Create a popover.
@@ -180,64 +289,383 @@ class MainWindow(Gtk.ApplicationWindow):
         self.openButton.connect('clicked', self._fileOpen)
         self.header.pack_start(self.openButton)
 
+        # Add a refresh button into the header bar.
+        self.refreshButton = Gtk.Button()
+        self.refreshButton.set_icon_name('view-refresh-symbolic')
+        self.refreshButton.connect('clicked', self._fileRefresh)
+        self.header.pack_start(self.refreshButton)
+
+        # Add the extension filter into the header bar.
+        extensions = getattr(self.args, 'ext', None)
+        self.extensionsButton = Gtk.ToggleButton(label='Extensions')
+        self.extensionsButton.set_active(extensions is not None)
+        self.extensionsButton.connect('toggled', self._extensionsChanged)
+        self.extensionsEntry = Gtk.Entry()
+        self.extensionsEntry.set_placeholder_text('jpg,png')
+        self.extensionsEntry.set_width_chars(12)
+        self.extensionsEntry.set_text(extensions if extensions is not None else '')
+        self.extensionsEntry.connect('activate', self._extensionsChanged)
+        self.header.pack_end(self.extensionsEntry)
+        self.header.pack_end(self.extensionsButton)
+        self._extensionsChanged(None)
+
+        # Add the progress of expanding the folders into the header bar.  They are hidden unless folders are being expanded.
+        self.expandStopButton = Gtk.Button()
+        self.expandStopButton.set_icon_name('process-stop-symbolic')
+        self.expandStopButton.set_tooltip_text('Stop expanding the folders')
+        self.expandStopButton.set_action_name('win.stopexpand')
+        self.expandStopButton.set_visible(False)
+        self.expandLabel = Gtk.Label()
+        self.expandLabel.set_visible(False)
+        self.header.pack_end(self.expandStopButton)
+        self.header.pack_end(self.expandLabel)
+
         # Initialise the dialog.
-        self.folderName = os.path.dirname(os.path.realpath(__file__))
+        self.folderName = os.path.realpath(folderName) if folderName is not None else os.path.dirname(os.path.realpath(__file__))
+        self.scanCancellable = None
+        self.isScanning = False
+        # The folder monitor for the live mode.
+        self.isLive = getattr(self.args, 'live', False)
+        self.folderMonitor = None
+        # The names reported by the folder monitor that have not been applied yet.
+        self.monitorPending = set()
+        self.monitorSourceId = 0
+        # The cancellables of folder rows that are loading their children.
+        self.childCancellables = []
+        # The collapsed folder rows that still hold their children, oldest first.
+        self.collapsedFolders = collections.OrderedDict()
+        self.maxCollapsedFolders = getattr(self.args, 'max_collapsed', MAX_COLLAPSED_FOLDERS)
+        # The running expansion of the folder rows or None.
+        self.treeExpansion = None
+        self.expandBudget = getattr(self.args, 'expand_budget', tree_expansion.MAX_ROWS)
+        # The persistent index of scanned folders or None if it is turned off.  The index and the recently scanned folders are kept by the scan service.
+        self.folderIndex = self.scanService.folderIndex
+
+        # Scan the initial folder after the first frame has been presented.
+        self.connect('realize', self._onRealize)
+        startup_timing.mark('Create window')
+
+
+
+    def _onRealize(self, widget):
+        ''' Signal handler for the window being realized.  The frame clock is available now. '''
+        self.firstFrameHandler = self.get_frame_clock().connect('after-paint', self._onFirstFrame)
+        if profiler.enabled:
+            self.get_frame_clock().connect('after-paint', lambda frameClock: profiler.frame())
+
+
+
+    def _onFirstFrame(self, frameClock):
+        ''' Signal handler for the first frame being painted.  Starts the initial scan. '''
+        frameClock.disconnect(self.firstFrameHandler)
+        startup_timing.mark('First frame')
+        GLib.idle_add(self._initialScan)
+
+
+
+    def _initialScan(self):
+        '''
+        Idle handler to start the initial scan.
+
+        :returns: False to remove the idle handler.
+        '''
         self.scanFolder()
+        return False
 
 
 
     def setupExpanderLabel(self, widget, item):
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        image = Gtk.Image()
+        image.set_pixel_size(self.thumbnailSize)
+        image.set_size_request(self.thumbnailSize, self.thumbnailSize)
+        image.set_visible(self.thumbnailLoader is not None)
+        box.append(image)
         label = Gtk.Label()
+        box.append(label)
         expander = Gtk.TreeExpander.new()
-        expander.set_child(label)
+        expander.set_child(box)
         item.set_child(expander)
 
 
 
+    @profiler.timed()
     def bindMyFileRow(self, widget, item):
         expander = item.get_child()
-        label = expander.get_child()
+        image = expander.get_child().get_first_child()
+        label = expander.get_child().get_last_child()
         row = item.get_item()
         expander.set_list_row(row)
         obj = row.get_item()
         label.set_label(obj.fileName)
+        item.expandedHandler = row.connect('notify::expanded', self._treeRowExpanded)
+        if self.thumbnailLoader is not None:
+            self._bindThumbnail(image, obj)
+            item.thumbnailHandler = obj.connect('metadata-changed', lambda obj: self._bindThumbnail(image, obj))
+
+
+
+    def unbindMyFileRow(self, widget, item):
+        row = item.get_item()
+        if row is not None:
+            row.disconnect(item.expandedHandler)
+            if self.thumbnailLoader is not None:
+                obj = row.get_item()
+                obj.disconnect(item.thumbnailHandler)
+                image = item.get_child().get_child().get_first_child()
+                waiting = self.thumbnailImages.get(obj.path)
+                if waiting is not None and waiting[0] is image:
+                    del self.thumbnailImages[obj.path]
+                    self.thumbnailLoader.cancel(obj.path, self._thumbnailMade)
+
+
+
+    def _bindThumbnail(self, image, obj):
+        '''
+        Show the thumbnail of a bound row.
+        The thumbnail comes from the texture cache if it can, otherwise it is asked for and shown by :py:meth:`_thumbnailLoaded`.
+        Only the rows that are bound ask for thumbnails, so only the visible images are read.
+
+        :param Gtk.Image image: The image in the row.
+        :param MyFileRow obj: The row.
+        '''
+        image.clear()
+        if not thumbnails.isImage(obj.contentType) or obj.modified == file_metadata.UNKNOWN:
+            # Not an image or the metadata has not arrived yet.
+            return
+        texture = self.textureCache.get(obj.path, obj.modified)
+        if texture is not None:
+            if texture:
+                image.set_from_paintable(texture)
+            return
+        self.thumbnailImages[obj.path] = (image, obj.modified)
+        self.thumbnailLoader.request(obj.path, obj.modified, self._thumbnailMade)
 
 
 
+    def _thumbnailMade(self, path, modified, thumbnailPath):
+        '''
+        Callback for the thumbnail loader.
+        This is called on a worker thread, so the thumbnail is decoded here and handed to the main thread.
+
+        :param str path: The path of the image.
+        :param float modified: The modified time of the image when it was asked for.
+        :param str thumbnailPath: The path of the thumbnail or None if there is no thumbnail.
+        '''
+        texture = False
+        if thumbnailPath is not None:
+            try:
+                texture = Gdk.Texture.new_from_filename(thumbnailPath)
+            except GLib.Error:
+                pass
+        GLib.idle_add(self._thumbnailLoaded, path, modified, texture)
+
+
+
+    @profiler.timed()
+    def _thumbnailLoaded(self, path, modified, texture):
+        '''
+        Idle handler to show a decoded thumbnail.
+        The texture is cached even if its row is no longer bound, so scrolling back shows it at once.
+
+        :returns: False to remove the idle handler.
+        '''
+        self.textureCache.put(path, modified, texture)
+        waiting = self.thumbnailImages.get(path)
+        if waiting is not None and waiting[1] == modified:
+            del self.thumbnailImages[path]
+            if texture:
+                waiting[0].set_from_paintable(texture)
+        return False
+
+
+
+    def _onDestroy(self, widget):
+        '''
+        Signal handler for the window being destroyed.
+        Cancels the requests of the window, the shared worker processes and threads are stopped with the scan service.
+        '''
+        if self.thumbnailLoader is not None:
+            self.thumbnailLoader.cancelExcept(set(), self._thumbnailMade)
+        self.folderSizes.cancelExcept(set(), self._folderSizeMade)
+        self.previewLoader.shutdown()
+        if self.isOwnScanService:
+            self.scanService.shutdown()
+
+
+
+    def _addMetadataColumn(self, title, xalign, getText):
+        '''
+        Add a column that shows the metadata of the rows.
+        The cells never read the filesystem, they show the metadata the row already has and update when 'metadata-changed' is emitted.
+
+        :param str title: The title of the column.
+        :param float xalign: The horizontal alignment of the text.
+        :param getText: Function that takes a :py:class:`MyFileRow` and returns the text for the cell.
+        :returns: The new column.
+        '''
+        factory = Gtk.SignalListItemFactory()
+        factory.connect('setup', self.setupMetadataLabel, xalign)
+        factory.connect('bind', self.bindMetadataLabel, getText)
+        factory.connect('unbind', self.unbindMetadataLabel)
+        column = Gtk.ColumnViewColumn.new(title, factory)
+        self.columnviewFiles.append_column(column)
+        return column
+
+
+
+    def setupMetadataLabel(self, widget, item, xalign):
+        label = Gtk.Label()
+        label.set_xalign(xalign)
+        item.set_child(label)
+
+
+
+    def bindMetadataLabel(self, widget, item, getText):
+        label = item.get_child()
+        obj = item.get_item().get_item()
+        label.set_label(getText(obj))
+        item.metadataHandler = obj.connect('metadata-changed', lambda obj: label.set_label(getText(obj)))
+
+
+
+    def unbindMetadataLabel(self, widget, item):
+        row = item.get_item()
+        if row is not None:
+            row.get_item().disconnect(item.metadataHandler)
+
+
+
+    @profiler.timed()
     def addTreeNode(self, item):
-        if not (item):
-            print("no item")
-            return model
-        else:
-            if type(item) == Gtk.TreeListRow:
-                item = item.get_item()
+        '''
+        Create function for the treelist model.
+        This is also called when a row is bound to find out if it can be expanded, so it must not do any I/O.
+        The children are loaded by :py:meth:`_treeRowExpanded` when the row is expanded.
+
+        :param MyFileRow item: The row to return the children of.
+        :returns: The child store of a folder or None if the row can not be expanded.
+        '''
+        if type(item) == Gtk.TreeListRow:
+            item = item.get_item()
+        if not item.isFolder:
+            return None
+        if item.childState == CHILDREN_NOT_LOADED or item.childStore is None:
+            item.childStore = FileListModel(item.path)
+        return item.childStore
 
-                print("converteu")
-                print(item)
 
-            if not item.children:
-                return None
-            store = Gio.ListStore.new(MyFileRow)
-            for child in item.children:
-                store.append(child)
-            return store
+
+    def _treeRowExpanded(self, row, param):
+        '''
+        Signal handler for a row in the treelist being expanded or collapsed.
+        Expanding a folder loads its children in the background.
+        Collapsing a folder keeps its children until more than :py:attr:`maxCollapsedFolders` other folders are collapsed.
+        '''
+        obj = row.get_item()
+        if not obj.isFolder:
+            return
+        if row.get_expanded():
+            self.collapsedFolders.pop(obj, None)
+            if obj.childState == CHILDREN_NOT_LOADED:
+                obj.childState = CHILDREN_LOADING
+                obj.cancellable = Gio.Cancellable()
+                self.childCancellables.append(obj.cancellable)
+                self._loadFolder(obj.path, obj.cancellable, obj.childStore, obj)
+        elif obj.childState != CHILDREN_NOT_LOADED:
+            self.collapsedFolders[obj] = True
+            while len(self.collapsedFolders) > self.maxCollapsedFolders:
+                oldest, _ = self.collapsedFolders.popitem(last=False)
+                self._releaseChildren(oldest)
+
+
+
+    def _releaseChildren(self, obj):
+        '''
+        Release the children of a collapsed folder row.
+        They are loaded again if the row is expanded again.
+
+        :param MyFileRow obj: The folder row to release the children of.
+        '''
+        if obj.cancellable is not None:
+            obj.cancellable.cancel()
+            if obj.cancellable in self.childCancellables:
+                self.childCancellables.remove(obj.cancellable)
+            obj.cancellable = None
+        obj.childStore = None
+        obj.childState = CHILDREN_NOT_LOADED
+        self.collapsedFolders.pop(obj, None)
 
 
 
     def _treeviewFilesRightClick(self, controller, click_count, x, y):
-        print(f'_treeviewFilesRightClick {x=} {y=}')
-        print(self.popoverTreeview.set_pointing_to(Gdk.Rectangle(0,0,x,y)))
+        logger.debug('_treeviewFilesRightClick x=%s y=%s', x, y)
+        self.popoverTreeview.set_pointing_to(Gdk.Rectangle(0,0,x,y))
         self.popoverTreeview.set_position(Gtk.PositionType.RIGHT)
         self.popoverTreeview.popup()
 
 
 
     def _actionSomething(self, action, param):
-        print('Something is done.')
+        logger.info('Something is done.')
+
+
+
+    def _actionExpand(self, action, param):
+        '''
+        Signal handler for the expand actions.
+        The folder rows are expanded a slice per frame, so the window stays responsive however deep the tree is.
+
+        :param GLib.Variant param: The depth to expand to, -1 for every level.
+        '''
+        self._stopExpansion()
+        depth = param.get_int32()
+        self.treeExpansion = tree_expansion.TreeExpansion(self.treelistFiles, self.columnviewFiles, depth if depth > 0 else None, self.expandBudget, self._expansionProgress)
+        self.expandLabel.set_label('Expanding…')
+        self.expandLabel.set_visible(True)
+        self.expandStopButton.set_visible(True)
+        self.treeExpansion.start()
+
+
+
+    def _stopExpansion(self):
+        ''' Stop expanding the folder rows.  The folders already expanded stay expanded. '''
+        if self.treeExpansion is not None:
+            self.treeExpansion.cancel()
+            self.treeExpansion = None
+        self.expandLabel.set_visible(False)
+        self.expandStopButton.set_visible(False)
+
+
+
+    def _expansionProgress(self, expansion):
+        '''
+        Progress function for the expansion of the folder rows.
+
+        :param TreeExpansion expansion: The expansion.
+        '''
+        if expansion is not self.treeExpansion:
+            return
+        profiler.counter('Expansion', folders=expansion.numExpanded, rows=expansion.numRows)
+        if expansion.isRunning():
+            self.expandLabel.set_label(f'Expanding {expansion.numExpanded} folders, {expansion.numRows} rows')
+            return
+        self.treeExpansion = None
+        self.expandStopButton.set_visible(False)
+        if expansion.isBudgetReached:
+            self.expandLabel.set_label(f'Stopped at {expansion.numRows} rows')
+            logger.info('Expanding stopped after %d folders at the budget of %d rows.', expansion.numExpanded, expansion.budget)
+        else:
+            self.expandLabel.set_visible(False)
+            logger.debug('Expanded %d folders, %d rows.', expansion.numExpanded, expansion.numRows)
 
 
 
     def _actionAbout(self, action, param):
+        # Libadwaita is only loaded when the about window is first shown.
+        gi.require_version('Adw', '1')
+        from gi.repository import Adw
+        Adw.init()
         dialog = Adw.AboutWindow(transient_for=self)
         dialog.set_application_name("GTK TreeView Example")
         dialog.set_version("1.0")
@@ -256,53 +684,200 @@ class MainWindow(Gtk.ApplicationWindow):
 
 
 
+    @profiler.timed()
     def columnviewSelectionChanged(self, selectionModel, position, numItems):
-        ''' Signal handler for the selection on the columnview changing. '''
-        itemSelected = selectionModel.get_selected_item().get_item()
-        self.labelSelection.set_text(itemSelected.fileName)
+        '''
+        Signal handler for the selection on the columnview changing.
+        The selected positions are read from the selection bitset in one pass.
+        '''
+        summary = selection_summary.SelectionSummary()
+        bitset = selectionModel.get_selection()
+        if self.treelistFiles.get_n_items() == self.sortFiles.get_n_items():
+            # No folders are expanded so the positions are positions in the sort model and no rows need to be created.
+            for position in iterateBitset(bitset):
+                size = self.sortFiles.getSize(position)
+                summary.add(self.sortFiles.getName(position), self.sortFiles.isFolder(position), None if size == file_metadata.UNKNOWN else size)
+        else:
+            for position in iterateBitset(bitset):
+                itemSelected = self.treelistFiles.get_item(position).get_item()
+                summary.add(itemSelected.fileName, itemSelected.isFolder, None if itemSelected.size == file_metadata.UNKNOWN else itemSelected.size)
+        self.labelSelection.set_text(summary.getText())
+        # Only a single selected row has a preview.
+        path = None
+        if bitset.get_size() == 1:
+            path = self.treelistFiles.get_item(bitset.get_nth(0)).get_item().path
+        self._schedulePreview(path)
+
+
+
+    def _schedulePreview(self, path):
+        '''
+        Show the preview of a file once the selection has stayed on it for :py:const:`~common.file_preview.PREVIEW_DELAY` milliseconds.
+        Moving quickly through the rows only reads the file that the selection stops on.
+
+        :param str path: The path of the file or None to clear the preview.
+        '''
+        if path == self.previewPath:
+            return
+        self.previewPath = path
+        if self.previewSourceId != 0:
+            GLib.source_remove(self.previewSourceId)
+            self.previewSourceId = 0
+        if path is None:
+            self.previewLoader.cancel()
+            self.previewPicture.set_visible(False)
+            self.previewText.get_buffer().set_text('')
+            return
+        self.previewSourceId = GLib.timeout_add(file_preview.PREVIEW_DELAY, self._previewTimeout, path)
+
+
+
+    def _previewTimeout(self, path):
+        '''
+        Timeout handler to read the preview of the selected file.
+
+        :returns: False to remove the timeout handler.
+        '''
+        self.previewSourceId = 0
+        self.previewLoader.request(path)
+        return False
+
+
+
+    def _decodePreviewImage(self, path, size):
+        '''
+        Returns a scaled down image for the preview or None if the image can not be read.
+        This is called on the worker thread of the preview loader.
+
+        :param str path: The path of the image.
+        :param int size: The largest width and height.
+        '''
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, size, size).apply_embedded_orientation()
+        except GLib.Error:
+            return None
+        return Gdk.Texture.new_for_pixbuf(pixbuf)
+
+
+
+    def _previewRead(self, preview):
+        '''
+        Callback for the preview loader.  This is called on a worker thread.
+
+        :param Preview preview: The preview.
+        '''
+        GLib.idle_add(self._showPreview, preview)
+
+
+
+    def _showPreview(self, preview):
+        '''
+        Idle handler to show a preview if its file is still selected.
+
+        :returns: False to remove the idle handler.
+        '''
+        if preview.path != self.previewPath:
+            return False
+        isImage = preview.kind == file_preview.KIND_IMAGE
+        if isImage:
+            self.previewPicture.set_paintable(preview.image)
+        self.previewPicture.set_visible(isImage)
+        self.previewText.get_buffer().set_text(preview.text)
+        return False
+
+
+
+    def _searchChanged(self, searchEntry):
+        ''' Signal handler for the text in the search entry changing. '''
+        query = searchEntry.get_text()
+        if query != '' and self.filterFiles.index is None:
+            self._startNameIndex()
+        self.filterFiles.setQuery(query)
+
+
+
+    def _extensionsChanged(self, widget):
+        '''
+        Signal handler for the extension filter being toggled or its extensions being changed.
+        The rows to show come from the extension index of the filter model, nothing is read from the filesystem.
+        '''
+        extensions = None
+        if self.extensionsButton.get_active():
+            extensions = extension_index.parseExtensions(self.extensionsEntry.get_text())
+        self.filterFiles.setExtensions(extensions)
+        self._updateFilesTitle()
+
+
 
+    def _sortChanged(self, sorter, change):
+        ''' Signal handler for a column header being clicked to change the order of the rows. '''
+        column = sorter.get_primary_sort_column()
+        sortKey = self.sortColumns.get(column, SORT_NAME) if column is not None else SORT_NAME
+        self.sortFiles.setSort(sortKey, sorter.get_primary_sort_order() == Gtk.SortType.DESCENDING)
 
 
 
-    def _treeSelectionChanged(self, treeSelection):
-        ''' Signal handler for the selection on tree changing. '''
-        selection = ''
+    def _filterFilesChanged(self, model, position, numRemoved, numAdded):
+        ''' Signal handler for the rows in the filter model changing. '''
+        self._updateFilesTitle()
 
-        # liststoreFiles = self.builder.get_object('liststoreFiles')
-        liststoreFiles = self.liststoreFiles
-        mode = treeSelection.get_mode()
-        if mode == Gtk.SelectionMode.SINGLE or mode == Gtk.SelectionMode.BROWSE:
-            model, treeIter = treeSelection.get_selected()
-            if treeIter is not None:
-                fileName = liststoreFiles.get_value(treeIter, 0)
-                selection = fileName
-        elif mode == Gtk.SelectionMode.MULTIPLE:
-            model, pathList = treeSelection.get_selected_rows()
 
-            for path in pathList:
-                treeIter = liststoreFiles.get_iter(path)
-                fileName = liststoreFiles.get_value(treeIter, 0)
-                if selection == '':
-                    selection = fileName
-                else:
-                    selection = '{}\n{}'.format(selection, fileName)
 
-        # Display the filename.
-        # labelSelection = self.builder.get_object('labelSelection')
-        self.labelSelection.set_text(selection)
+    def _updateFilesTitle(self):
+        ''' Show the number of files of each extension in the title of the files column. '''
+        self.columnFiles.set_title(self.filterFiles.getTitle())
+
+
+
+    def _startNameIndex(self):
+        ''' Start building the name index for the filter on a worker thread. '''
+        if self.isIndexing:
+            return
+        self.isIndexing = True
+        names = self.liststoreFiles.getNames()
+        self.scanService.submit(self._nameIndexThread, names, self.filterFiles.layoutGeneration)
+
+
+
+    def _nameIndexThread(self, names, layoutGeneration):
+        '''
+        Worker thread for :py:meth:`_startNameIndex`.
+
+        :param list names: The names in the liststore.
+        :param int layoutGeneration: The layout generation of the filter model when the names were read.
+        '''
+        index = name_index.NameIndex(names)
+        GLib.idle_add(self._nameIndexBuilt, index, layoutGeneration)
+
+
+
+    def _nameIndexBuilt(self, index, layoutGeneration):
+        '''
+        Idle handler for the name index being built.
+
+        :param NameIndex index: The index.
+        :param int layoutGeneration: The layout generation of the filter model when the names were read.
+        :returns: False to remove the idle handler.
+        '''
+        self.isIndexing = False
+        if not self.filterFiles.setIndex(index, layoutGeneration):
+            # The liststore has changed since, build the index again if it is needed.
+            if self.filterFiles.query != '':
+                self._startNameIndex()
+        return False
 
 
 
     def _fileRefresh(self, widget):
         ''' Signal handler for the 'File' → 'Refresh' menu point. '''
-        self.scanFolder()
+        self.refreshFolder()
 
 
 
     def _fileOpen(self, widget):
         ''' Signal handler for the 'File' → 'Open' menu point. '''
         # Create a folder chooser dialog.
-        print('_fileOpen() Start')
+        logger.debug('_fileOpen() Start')
         dialog = Gtk.FileChooserDialog(title = 'Select Source Folder', transient_for=self, action=Gtk.FileChooserAction.SELECT_FOLDER)
         dialog.add_buttons(("_Cancel"), Gtk.ResponseType.CANCEL, ("_Open"), Gtk.ResponseType.ACCEPT)
         dialog.connect('response', self.fileChooserDialogCallBack)
@@ -314,12 +889,11 @@ class MainWindow(Gtk.ApplicationWindow):
         # dialog.set_current_folder(self.folderName)
 
         # Display the file chooser dialog.
-        response = dialog.present()
-        print(f'{response=}')
+        dialog.present()
 
         # Close the file chooser dialog.
         # dialog.destroy()
-        print('_fileOpen() Finished')
+        logger.debug('_fileOpen() Finished')
 
 
 
@@ -345,58 +919,561 @@ class MainWindow(Gtk.ApplicationWindow):
 
     def _viewOpenFolder(self, widget):
         ''' Signal handler for the 'View' → 'Open Folder' menu point. '''
+        import subprocess
         subprocess.Popen(['xdg-open', self.folderName])
 
 
 
+    @profiler.timed()
     def scanFolder(self):
-        ''' Scan the images in the specified folder. '''
-        self.liststoreFiles.remove_all()
+        '''
+        Scan the images in the specified folder.
+        The folder is listed on a worker thread and the rows arrive in batches via :py:meth:`_scanFolderBatch`.
+        Any scan that is still running is cancelled first.
+        '''
+        if self.scanCancellable is not None:
+            self.scanCancellable.cancel()
+        self._stopExpansion()
+        self.folderSizes.cancelExcept(set(), self._folderSizeMade)
+        self.folderSizeRows.clear()
+        for cancellable in self.childCancellables:
+            cancellable.cancel()
+        self.childCancellables = []
+        self.collapsedFolders.clear()
+        if self.thumbnailLoader is not None:
+            self.thumbnailLoader.cancelExcept(set(), self._thumbnailMade)
+        self.scanCancellable = Gio.Cancellable()
+        self.isScanning = True
+        self.liststoreFiles.removeAll()
+        self.liststoreFiles.folderName = self.folderName
+        self._startFolderMonitor()
+        self._loadFolder(self.folderName, self.scanCancellable, self.liststoreFiles, None)
+
+
+
+    def _loadFolder(self, folderName, cancellable, store, parent):
+        '''
+        Fill an empty store with the rows of a folder.
+        If the listing cache has the folder and the folder has not changed then the cached listing is used without any I/O.
+        The cache is shared by the windows, so a folder shown in another window is not scanned again.
+        Otherwise the folder is scanned by the scan service.
+
+        :param str folderName: The folder to scan.
+        :param Gio.Cancellable cancellable: Cancelled when this scan is no longer wanted.
+        :param FileListModel store: The store to add the rows to.
+        :param MyFileRow parent: The folder row that owns the store or None for the top level.
+        '''
+        snapshot = self.scanService.getListing(folderName)
+        if snapshot is not None:
+            store.restoreSnapshot(snapshot)
+            self._scanFolderFinished(folderName, None, store, parent, cancellable)
+            return
+
+        self.scanService.submit(self._scanFolderThread, folderName, cancellable, store, parent)
+
+
+
+    @profiler.timed()
+    def _scanFolderThread(self, folderName, cancellable, store, parent):
+        '''
+        Worker thread for :py:meth:`scanFolder` and for loading the children of a folder row.
+        This runs on the threads of the scan service, so a folder that another window is scanning is only scanned once.
+        This must not touch any GTK objects, the entries are passed back to the main thread with GLib.idle_add().
+
+        :param str folderName: The folder to scan.
+        :param Gio.Cancellable cancellable: Cancelled when this scan is no longer wanted.
+        :param FileListModel store: The store to add the rows to.
+        :param MyFileRow parent: The folder row that owns the store or None for the top level.
+        '''
+        stamp = listing_cache.folderStamp(folderName)
+        indexed = self.folderIndex.get(folderName) if self.folderIndex is not None else None
+        if indexed is not None:
+            # Show the indexed listing at once, then scan the folder only if it has changed.
+            indexedStamp, indexedEntries = indexed
+            for batch in scanner.batches(indexedEntries):
+                if cancellable.is_cancelled():
+                    return
+                GLib.idle_add(self._scanFolderBatch, batch, cancellable, store)
+            if indexedStamp == stamp:
+                GLib.idle_add(self._scanFolderFinished, folderName, stamp, store, parent, cancellable, True)
+                return
+            listing = self.scanService.listFolder(folderName, cancellable.is_cancelled)
+            if listing is None:
+                return
+            stamp, entries = listing
+            oldKeys = [scanner.naturalKey(entry.name) for entry in indexedEntries]
+            splices = scanner.diffSorted(oldKeys, entries)
+            if not cancellable.is_cancelled():
+                GLib.idle_add(self._refreshFolderApply, folderName, stamp, store, parent, splices, cancellable)
+            return
+
+        listing = self.scanService.listFolder(folderName, cancellable.is_cancelled, lambda batch: GLib.idle_add(self._scanFolderBatch, batch, cancellable, store))
+        if listing is None:
+            return
+        GLib.idle_add(self._scanFolderFinished, folderName, listing[0], store, parent, cancellable)
+
+
+
+    @profiler.timed()
+    def _scanFolderBatch(self, batch, cancellable, store):
+        '''
+        Idle handler to insert a batch of scanned entries into a liststore.
+        A single splice() fires a single items-changed signal for the whole batch.
+        The entries are packed into the store, no row objects are created here.
+
+        :param list batch: The :py:class:`~common.scanner.ScanEntry` objects to append.
+        :param Gio.Cancellable cancellable: The cancellable of the scan that produced the batch.
+        :param FileListModel store: The store to add the rows to.
+        :returns: False to remove the idle handler.
+        '''
+        if cancellable.is_cancelled():
+            # The batch is from an old scan.
+            return False
+        store.splice(store.get_n_items(), 0, batch)
+        startup_timing.mark('First rows')
+        return False
+
+
+
+    @profiler.timed()
+    def _scanFolderFinished(self, folderName, stamp, store, parent, cancellable, isIndexed=False):
+        '''
+        Idle handler for a scan being completely loaded.
+
+        :param str folderName: The folder that was scanned.
+        :param tuple stamp: The stamp of the folder from before the scan or None to not update the listing cache.
+        :param FileListModel store: The store that holds the rows.
+        :param MyFileRow parent: The folder row that has loaded its children or None for the top level.
+        :param Gio.Cancellable cancellable: The cancellable of the scan.
+        :param bool isIndexed: True if the rows are from the folder index and the folder has not changed, so the index is not written again.
+        :returns: False to remove the idle handler.
+        '''
+        if cancellable.is_cancelled():
+            return False
+        if stamp is not None:
+            self.scanService.putListing(folderName, stamp, store.getSnapshot(), store.get_n_items())
+        self._startMetadata(folderName, store, cancellable, None, None if isIndexed else stamp)
+        if parent is None:
+            self.isScanning = False
+            startup_timing.mark('Scan finished')
+            startup_timing.report()
+            if self.filterFiles.index is None:
+                self._startNameIndex()
+            if len(self.monitorPending) > 0:
+                self._folderMonitorFlush()
+        else:
+            # The cancellable is kept to cancel reading the metadata if the children are released.
+            parent.childState = CHILDREN_LOADED
+        return False
+
+
+
+    def _startMetadata(self, folderName, store, cancellable, positions, stamp=None):
+        '''
+        Read the size, modified time and content type of the rows in a store on a worker thread.
+        Any earlier read for the same store is stopped.
+
+        :param str folderName: The folder that holds the files.
+        :param FileListModel store: The store to read the metadata for.
+        :param Gio.Cancellable cancellable: Cancelled when the store is no longer wanted.
+        :param list positions: The positions of the rows to read or None to read every row.
+        :param tuple stamp: The stamp of a new scan to write the rows to the folder index or None.
+        '''
+        store.metadataSerial += 1
+        serial = store.metadataSerial
+        isCancelled = lambda: cancellable.is_cancelled() or store.metadataSerial != serial
+        self.scanService.submit(self._metadataThread, folderName, store.getSnapshot(), positions, store, store.layoutGeneration, cancellable, isCancelled, stamp)
+
+
+
+    def _metadataThread(self, folderName, snapshot, positions, store, layoutGeneration, cancellable, isCancelled, stamp):
+        '''
+        Worker thread for :py:meth:`_startMetadata`.
+        This must not touch the store, the batches are passed back to the main thread with GLib.idle_add().
+        The folder index is written here too, first the listing and then the metadata when every row has been read.
+        A read of every row is shared with the other windows by the scan service.
+
+        :param str folderName: The folder that holds the files.
+        :param tuple snapshot: The snapshot of the store.
+        :param list positions: The positions of the rows to read or None to read every row.
+        :param FileListModel store: The store to read the metadata for.
+        :param int layoutGeneration: The layout generation of the store when the snapshot was taken.
+        :param Gio.Cancellable cancellable: Cancelled when the store is no longer wanted.
+        :param isCancelled: Function that returns True when this read is no longer wanted.
+        :param tuple stamp: The stamp of a new scan to write the listing to the folder index or None.
+        '''
+        names = getSnapshotNames(snapshot)
+        if self.folderIndex is not None and stamp is not None:
+            self.folderIndex.put(folderName, stamp, names, snapshot[2])
+        batches = []
+        for batch in self.scanService.readMetadata(folderName, names, positions, isCancelled):
+            GLib.idle_add(self._metadataBatch, folderName, batch, store, layoutGeneration, cancellable, isCancelled)
+            batches.append(batch)
+        if self.folderIndex is not None and positions is None and not isCancelled():
+            self.folderIndex.putMetadata(folderName, names, batches)
+        GLib.idle_add(self._metadataFinished, store, isCancelled)
+
+
+
+    @profiler.timed()
+    def _metadataBatch(self, folderName, batch, store, layoutGeneration, cancellable, isCancelled):
+        '''
+        Idle handler to store a batch of metadata.
+        If rows have been inserted or removed since the snapshot then the rows that are still missing their metadata are read again.
+
+        :returns: False to remove the idle handler.
+        '''
+        if isCancelled():
+            return False
+        if layoutGeneration == store.layoutGeneration:
+            store.setMetadata(batch)
+        else:
+            self._startMetadata(folderName, store, cancellable, store.getUnknownPositions())
+        return False
+
+
+
+    def _metadataFinished(self, store, isCancelled):
+        '''
+        Idle handler for the metadata of a store being read.
+        The top level rows are sorted again if they are sorted by size or modified time.
+
+        :returns: False to remove the idle handler.
+        '''
+        if isCancelled():
+            return False
+        if store is self.liststoreFiles:
+            self.sortFiles.resort()
+        if self.isFolderSizes:
+            self._requestFolderSizes(store)
+        return False
+
+
+
+    def _actionNewWindow(self, action, param):
+        ''' Signal handler for the new window action.  The new window shows the current folder and shares the scan service of this window. '''
+        application = self.get_application()
+        if application is not None:
+            application.newWindow(self.folderName)
+        else:
+            MainWindow(self.args, scanService=self.scanService, folderName=self.folderName).present()
+
+
+
+    def _actionDuplicates(self, action, param):
+        ''' Signal handler for the find duplicates action.  The duplicates under the current folder are shown in a window of their own. '''
+        window = DuplicatesWindow(self, self.scanService.duplicateFinder, self.folderName)
+        window.present()
+
+
+
+    def _actionFolderSizes(self, action, value):
+        '''
+        Signal handler for the folder sizes action being toggled.
+        Turning it on works out the total sizes of the top level folders, the children get theirs as they are loaded.
+        Turning it off stops the walks, the totals already shown stay until the folder is scanned again.
+        '''
+        action.set_state(value)
+        self.isFolderSizes = value.get_boolean()
+        if self.isFolderSizes:
+            self._requestFolderSizes(self.liststoreFiles)
+        else:
+            self.folderSizes.cancelExcept(set(), self._folderSizeMade)
+            self.folderSizeRows.clear()
 
+
+
+    def _requestFolderSizes(self, store):
+        '''
+        Ask for the total sizes of the folder rows in a store.
+
+        :param FileListModel store: The store.
+        '''
+        for position in range(store.get_n_items()):
+            if store.isFolder(position):
+                name = store.getName(position)
+                path = os.path.join(store.folderName, name)
+                self.folderSizeRows[path] = (store, name)
+                self.folderSizes.request(path, self._folderSizeMade)
+
+
+
+    def _folderSizeMade(self, path, total, isFinal):
+        '''
+        Callback for a total size of a folder.  This is called on a worker thread.
+
+        :param str path: The path of the folder.
+        :param int total: The total size of the files under the folder so far.
+        :param bool isFinal: True if the total is final.
+        '''
+        GLib.idle_add(self._folderSizeChanged, path, total, isFinal)
+
+
+
+    @profiler.timed()
+    def _folderSizeChanged(self, path, total, isFinal):
+        '''
+        Idle handler to show a total size of a folder in its row.
+        The row is found by its name, so it does not matter if rows have been inserted or removed since.
+
+        :returns: False to remove the idle handler.
+        '''
+        waiting = self.folderSizeRows.get(path)
+        if waiting is None:
+            return False
+        store, name = waiting
+        if isFinal:
+            del self.folderSizeRows[path]
+        count = store.get_n_items()
+        position = scanner.bisectSorted(count, lambda position: scanner.naturalKey(store.getName(position)), scanner.naturalKey(name))
+        if position < count and store.getName(position) == name:
+            store.setSize(position, total)
+            if store is self.liststoreFiles and self.folderSizeSortId == 0:
+                # Sort by size again once the totals settle, not for every total.
+                self.folderSizeSortId = GLib.timeout_add(FOLDER_SIZE_SORT_DELAY, self._folderSizeSort)
+        return False
+
+
+
+    def _folderSizeSort(self):
+        '''
+        Timeout handler to sort the top level rows again after their total sizes have changed.
+
+        :returns: False to remove the timeout handler.
+        '''
+        self.folderSizeSortId = 0
+        self.sortFiles.resort()
+        return False
+
+
+
+    def refreshFolder(self):
+        '''
+        Scan the folder again and apply only the differences to the liststore.
+        This keeps the selection and the scroll position.
+        '''
+        if self.scanCancellable is not None:
+            self.scanCancellable.cancel()
+        self.scanCancellable = Gio.Cancellable()
+        self.isScanning = True
+        # A file that has changed size does not change the stamp of its folder, so the folder sizes are worked out again from scratch.
+        self.folderSizes.clear(self._folderSizeMade)
+        # The children of the collapsed folders might be out of date.
+        for obj in list(self.collapsedFolders):
+            self._releaseChildren(obj)
+
+        # The other windows see the changes too.
+        self.scanService.forget(self.folderName)
+        self.scanService.submit(self._refreshFolderThread, self.folderName, self.liststoreFiles.getSnapshot(), self.scanCancellable)
+
+
+
+    @profiler.timed()
+    def _refreshFolderThread(self, folderName, snapshot, cancellable):
+        '''
+        Worker thread for :py:meth:`refreshFolder`.
+        The differences are worked out here, so the main thread only applies them.
+
+        :param str folderName: The folder to scan.
+        :param tuple snapshot: The snapshot of the liststore.
+        :param Gio.Cancellable cancellable: Cancelled when this scan is no longer wanted.
+        '''
+        listing = self.scanService.listFolder(folderName, cancellable.is_cancelled)
+        if listing is None:
+            return
+        stamp, entries = listing
+        oldKeys = [scanner.naturalKey(name) for name in getSnapshotNames(snapshot)]
+        splices = scanner.diffSorted(oldKeys, entries)
+        if not cancellable.is_cancelled():
+            GLib.idle_add(self._refreshFolderApply, folderName, stamp, self.liststoreFiles, None, splices, cancellable)
+
+
+
+    @profiler.timed()
+    def _refreshFolderApply(self, folderName, stamp, store, parent, splices, cancellable):
+        '''
+        Idle handler to apply the differences between a store and a new scan.
+        This finishes a refresh and the check of an indexed listing.
+        The monitor changes are held back while scanning, so the store still matches the listing the differences are from.
+
+        :param str folderName: The folder that was scanned.
+        :param tuple stamp: The stamp of the folder from before the scan.
+        :param FileListModel store: The store that holds the rows.
+        :param MyFileRow parent: The folder row that owns the store or None for the top level.
+        :param list splices: The changes from :py:func:`~common.scanner.diffSorted`.
+        :param Gio.Cancellable cancellable: The cancellable of the scan.
+        :returns: False to remove the idle handler.
+        '''
+        if cancellable.is_cancelled():
+            return False
+        for position, numberToRemove, entriesToInsert in splices:
+            store.splice(position, numberToRemove, entriesToInsert)
+        self._scanFolderFinished(folderName, stamp, store, parent, cancellable)
+        return False
+
+
+
+    def _startFolderMonitor(self):
+        ''' Start monitoring the current folder for changes if the live mode is enabled. '''
+        if self.folderMonitor is not None:
+            self.folderMonitor.cancel()
+            self.folderMonitor = None
+        self.monitorPending.clear()
+        if not self.isLive:
+            return
         try:
-            everyThing = os.listdir(self.folderName)
-        except:
-            everyThing = []
+            self.folderMonitor = Gio.File.new_for_path(self.folderName).monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        except GLib.Error as error:
+            logger.warning('Can not monitor "%s". %s', self.folderName, error.message)
+            return
+        self.folderMonitor.connect('changed', self._folderMonitorChanged)
+
+
+
+    def _folderMonitorChanged(self, monitor, file, otherFile, eventType):
+        '''
+        Signal handler for the folder monitor reporting a change.
+        The changes are collected for :py:const:`MONITOR_DELAY` milliseconds and then applied together.
+        '''
+        if monitor is not self.folderMonitor:
+            return
+        if eventType in (Gio.FileMonitorEvent.CREATED, Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_IN, Gio.FileMonitorEvent.MOVED_OUT):
+            self.monitorPending.add(file.get_basename())
+        elif eventType == Gio.FileMonitorEvent.RENAMED:
+            self.monitorPending.add(file.get_basename())
+            self.monitorPending.add(otherFile.get_basename())
+        else:
+            return
+        if self.monitorSourceId == 0:
+            self.monitorSourceId = GLib.timeout_add(MONITOR_DELAY, self._folderMonitorFlush)
+
+
+
+    @profiler.timed()
+    def _folderMonitorFlush(self):
+        '''
+        Timeout handler to apply the collected folder monitor changes.
+        Each changed name is checked on disk and inserted or removed at its sorted position.
+
+        :returns: False to remove the timeout handler.
+        '''
+        self.monitorSourceId = 0
+        if self.isScanning:
+            # The changes are applied when the scan finishes.
+            return False
+        pending = self.monitorPending
+        self.monitorPending = set()
+        if len(pending) > MONITOR_MAX_CHANGES:
+            self.refreshFolder()
+            return False
+
+        getKey = lambda position: scanner.naturalKey(self.liststoreFiles.getName(position))
+        for name in sorted(pending):
+            count = self.liststoreFiles.get_n_items()
+            position = scanner.bisectSorted(count, getKey, scanner.naturalKey(name))
+            isListed = position < count and self.liststoreFiles.getName(position) == name
+            path = os.path.join(self.folderName, name)
+            # Only the totals above the changed path are worked out again.
+            self.folderSizes.invalidate(path)
+            entry = scanner.entryFromPath(path, withStat=True)
+            if entry is None and isListed:
+                self.liststoreFiles.splice(position, 1, [])
+            elif entry is not None and not isListed:
+                self.liststoreFiles.splice(position, 0, [entry])
+                if self.isFolderSizes and entry.isFolder:
+                    self.folderSizeRows[path] = (self.liststoreFiles, name)
+                    self.folderSizes.request(path, self._folderSizeMade)
+        return False
+
+
+
+def iterateBitset(bitset):
+    '''
+    Generator for the values in a Gtk.Bitset in ascending order.
+
+    :param Gtk.Bitset bitset: The bitset, for example from Gtk.SelectionModel.get_selection().
+    '''
+    isValid, bitsetIter, value = Gtk.BitsetIter.init_first(bitset)
+    while isValid:
+        yield value
+        isValid, value = bitsetIter.next()
 
-        everyThing.sort()
 
-        count = 0
-        for theFile in everyThing:
-            fileName, extension = os.path.splitext(theFile)
-            extension = extension.lower()
-            if True:
-                count += 1
-                if count == 1:
-                    self.liststoreFiles.append(MyFileRow(theFile, [MyFileRow('Example', None)]))
-                else:
-                    self.liststoreFiles.append(MyFileRow(theFile, None))
 
+def loadResources():
+    '''
+    Register the compiled application resources if they have been built.
+    Build them with 'glib-compile-resources --sourcedir=gtk4 gtk4/gtk4.gresource.xml'.
 
+    :returns: True if the resources are registered, False to use the source files instead.
+    '''
+    try:
+        resource = Gio.Resource.load(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'gtk4.gresource'))
+    except GLib.Error:
+        return False
+    Gio.resources_register(resource)
+    return True
 
-class TreeViewApp(Adw.Application):
+
+
+class TreeViewApp(Gtk.Application):
+    '''
+    Class to represent the application.
+    All the windows share one scan service, so a folder open in several windows is scanned once and its listing is cached once.
+
+    :ivar ScanService scanService: The scan service shared by the windows.
+    '''
 
 
 
     def __init__(self, myArgs, **kwargs):
         self.args = myArgs
         super().__init__(**kwargs)
+        self.scanService = scan_service.ScanService(getattr(self.args, 'scan_workers', scan_service.MAX_WORKERS), getattr(self.args, 'cache_entries', listing_cache.MAX_ENTRIES), getattr(self.args, 'index', False))
 
         # An initial message.
         print('GTK+ Version {}.{}.{} (expecting GTK+4).'.format(Gtk.get_major_version(), Gtk.get_minor_version(), Gtk.get_micro_version()))
 
         cssProvider = Gtk.CssProvider()
-        cssProvider.load_from_path('gtk4/style.css')
+        if loadResources():
+            cssProvider.load_from_resource(f'{RESOURCE_PATH}/style.css')
+        else:
+            cssProvider.load_from_path(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'style.css'))
         Gtk.StyleContext.add_provider_for_display(Gdk.Display.get_default(), cssProvider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+        startup_timing.mark('Load style')
 
         self.connect('activate', self.onActivate)
+        self.connect('shutdown', self.onShutdown)
 
 
 
 
     def onActivate(self, app):
-        ''' Create the main window. '''
-        self.window = MainWindow(self.args, application=app)
-        self.window.present()
+        ''' Create a main window for each folder on the command line or one for the folder of the program. '''
+        folderNames = getattr(self.args, 'folders', None) or [None]
+        for folderName in folderNames:
+            self.window = self.newWindow(folderName)
+        startup_timing.mark('Present window')
+
+
+
+    def newWindow(self, folderName):
+        '''
+        Create and show a main window that shares the scan service of the application.
+
+        :param str folderName: The folder to show or None for the folder of the program.
+        :returns: The new :py:class:`MainWindow`.
+        '''
+        window = MainWindow(self.args, application=self, scanService=self.scanService, folderName=folderName)
+        window.present()
+        return window
+
+
+
+    def onShutdown(self, app):
+        ''' Signal handler for the application shutting down after the last window has closed.  Stops the scan service. '''
+        logger.info('Scan service %s', self.scanService.getStatistics())
+        self.scanService.shutdown()
 
 
 
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Module to expand many folder rows of a Gtk.TreeListModel without blocking the window.
+The folders are walked breadth first, a slice of work per frame, and the walk stops at a depth or a number of rows.
+'''
+
+import time
+
+from gi.repository import GLib
+
+# Application libraries.
+from gtk4.file_list_model import CHILDREN_NOT_LOADED, CHILDREN_LOADED
+
+
+
+# The time in seconds of work per frame.
+SLICE_SECONDS = 0.004
+# The default largest number of rows that an expansion shows.
+MAX_ROWS = 100000
+# The largest number of folders that load their children at the same time.
+MAX_LOADING = 8
+
+
+
+class TreeExpansion():
+    '''
+    Class to represent the expansion of the folder rows of a Gtk.TreeListModel down to a depth.
+    Expanding a row starts loading its children in the background.
+    When the children arrive the walk looks through them for more folders.
+    At most :py:const:`MAX_LOADING` folders load at a time, so a wide tree does not start a thread per folder.
+    The walk stops expanding folders once the expanded folders hold the budget of rows, so a deep tree can not fill the memory.
+
+    :ivar int maxDepth: The deepest rows to show, 1 shows the children of the top level folders, None for no limit.
+    :ivar int budget: The largest number of rows to show.
+    :ivar int numExpanded: The number of folders expanded so far.
+    :ivar int numRows: The number of rows shown by the expanded folders so far.
+    :ivar bool isBudgetReached: True if the walk stopped because of the budget.
+    '''
+
+
+
+    def __init__(self, treelist, widget, maxDepth=None, budget=MAX_ROWS, onProgress=None):
+        '''
+        Class constructor for the :py:class:`TreeExpansion` class.
+        Call :py:meth:`start` to start the walk.
+
+        :param Gtk.TreeListModel treelist: The treelist to expand.  The items of its root model must have an isFolder() method.
+        :param Gtk.Widget widget: The widget whose frame clock runs the walk.
+        :param int maxDepth: The deepest rows to show, 1 shows the children of the top level folders, None for no limit.
+        :param int budget: The largest number of rows to show.
+        :param onProgress: Optional function that takes this object, called after each slice and when the walk ends.
+        '''
+        self.treelist = treelist
+        self.widget = widget
+        self.maxDepth = maxDepth
+        self.budget = budget
+        self.onProgress = onProgress
+        self.numExpanded = 0
+        self.numRows = 0
+        self.isBudgetReached = False
+        self.tickId = 0
+        # The [row, position] of the folders whose children are being looked through.  The row is None for the top level.
+        self.parents = [[None, 0]]
+        # The expanded rows that are loading their children.
+        self.loading = []
+
+
+
+    def isRunning(self):
+        ''' Returns True until the walk has finished or been cancelled. '''
+        return self.tickId != 0
+
+
+
+    def start(self):
+        ''' Start the walk on the frame clock of the widget. '''
+        if self.tickId == 0:
+            self.tickId = self.widget.add_tick_callback(self._tick)
+
+
+
+    def cancel(self):
+        ''' Stop the walk.  The rows that are already expanded stay expanded. '''
+        if self.tickId != 0:
+            self.widget.remove_tick_callback(self.tickId)
+            self.tickId = 0
+            self.parents = []
+            self.loading = []
+            if self.onProgress is not None:
+                self.onProgress(self)
+
+
+
+    def _tick(self, widget, frameClock):
+        '''
+        Tick callback to do a slice of the walk.
+
+        :returns: GLib.SOURCE_CONTINUE until the walk is finished.
+        '''
+        deadline = time.perf_counter() + SLICE_SECONDS
+
+        # The folders that have loaded their children are looked through next.
+        stillLoading = []
+        for row in self.loading:
+            obj = row.get_item()
+            if obj.childState == CHILDREN_LOADED:
+                self._addLoaded(row)
+            elif obj.childState != CHILDREN_NOT_LOADED and row.get_expanded():
+                stillLoading.append(row)
+        self.loading = stillLoading
+
+        while len(self.parents) > 0 and len(self.loading) < MAX_LOADING and not self.isBudgetReached:
+            if time.perf_counter() > deadline:
+                break
+            self._step(deadline)
+
+        isFinished = len(self.loading) == 0 and (len(self.parents) == 0 or self.isBudgetReached)
+        if isFinished:
+            self.tickId = 0
+            self.parents = []
+        if self.onProgress is not None:
+            self.onProgress(self)
+        return GLib.SOURCE_REMOVE if isFinished else GLib.SOURCE_CONTINUE
+
+
+
+    def _step(self, deadline):
+        '''
+        Look through the children of the first folder in :py:attr:`parents` and expand its folders.
+        This stops at the deadline or when enough folders are loading and carries on from the same child next time.
+
+        :param float deadline: The time to stop.
+        '''
+        parent = self.parents[0]
+        row, position = parent
+        if row is None:
+            model = self.treelist.get_model()
+            getRow = self.treelist.get_child_row
+            childDepth = 0
+        else:
+            model = row.get_item().childStore
+            getRow = row.get_child_row
+            childDepth = row.get_depth() + 1
+        if model is None or (self.maxDepth is not None and childDepth >= self.maxDepth):
+            # The folder was released or its children are as deep as the walk goes.
+            self.parents.pop(0)
+            return
+        numItems = model.get_n_items()
+        while position < numItems:
+            if len(self.loading) >= MAX_LOADING or self.isBudgetReached or (position & 63 == 0 and time.perf_counter() > deadline):
+                parent[1] = position
+                return
+            if model.isFolder(position):
+                childRow = getRow(position)
+                if childRow is not None:
+                    self._expand(childRow)
+            position += 1
+        self.parents.pop(0)
+
+
+
+    def _expand(self, row):
+        '''
+        Expand a folder row.  Its children are looked through when they have loaded.
+
+        :param Gtk.TreeListRow row: The folder row.
+        '''
+        if self.numRows >= self.budget:
+            self.isBudgetReached = True
+            return
+        obj = row.get_item()
+        row.set_expanded(True)
+        self.numExpanded += 1
+        if obj.childState == CHILDREN_LOADED:
+            self._addLoaded(row)
+        else:
+            self.loading.append(row)
+
+
+
+    def _addLoaded(self, row):
+        '''
+        Count the children of a folder that has loaded and queue it to be looked through.
+
+        :param Gtk.TreeListRow row: The folder row.
+        '''
+        childStore = row.get_item().childStore
+        if childStore is None:
+            return
+        self.numRows += childStore.get_n_items()
+        self.parents.append([row, 0])
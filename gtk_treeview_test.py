@@ -5,11 +5,14 @@
 Module to a GTK window with a treeview control.
 '''
 
+# Start the startup timing before anything else.
+import common.startup_timing as startup_timing
+
 # System libraries for the initial phase.
 import sys
 import os
-import platform
 import argparse
+import logging
 
 # Application librararies.
 
@@ -25,7 +28,41 @@ if __name__ == '__main__':
     argParse.add_argument('-u', '--uninstall', help='Uninstall the program.', action='store_true')
     argParse.add_argument('-3', '--gtk3', help='Use GTK3.', action='store_true')
     argParse.add_argument('-4', '--gtk4', help='Use GTK3.', action='store_true')
+    argParse.add_argument('-l', '--live', help='Monitor the folder and update the list when files change.', action='store_true')
+    argParse.add_argument('--cache-entries', help='The largest total number of entries in the cache of recently scanned folders.', type=int, default=1000000)
+    argParse.add_argument('--startup-timing', help='Report where the time goes during startup.', action='store_true')
+    argParse.add_argument('--index', help='Keep the listings of scanned folders on disk, so that they show at once after a restart.', action='store_true')
+    argParse.add_argument('--ext', help='Only show the folders and the files with these comma separated extensions, for example "jpg,png".', default=None)
+    argParse.add_argument('--thumbnail-size', help='The size in pixels of the image thumbnails in the rows, 0 to not show thumbnails.', type=int, default=48)
+    argParse.add_argument('--thumbnail-cache', help='The number of decoded thumbnails kept in memory.', type=int, default=2000)
+    argParse.add_argument('--profile', help='Record where the time goes and write it to this file as a Chrome trace.', metavar='FILE', default=None)
+    argParse.add_argument('--log-level', help='The level of the messages to show.', choices=['debug', 'info', 'warning', 'error'], default='warning')
+    argParse.add_argument('--scan-only', help='Scan this folder without a window and write the rows to stdout.', metavar='PATH', default=None)
+    argParse.add_argument('--format', help='The format of the rows from --scan-only.', choices=['jsonl', 'csv'], default='jsonl')
+    argParse.add_argument('--sort', help='The order of the rows from --scan-only.', choices=['name', 'size', 'modified'], default='name')
+    argParse.add_argument('--reverse', help='Sort the rows from --scan-only in descending order.', action='store_true')
+    argParse.add_argument('--filter', help='Only write the rows from --scan-only whose names contain this text.', default='')
+    argParse.add_argument('--max-collapsed', help='The number of collapsed folders that keep their children in memory (GTK4).', type=int, default=64)
+    argParse.add_argument('--folder-sizes', help='Show the total size of the files under each folder.', action='store_true')
+    argParse.add_argument('--expand-budget', help='The largest number of rows that Expand All shows (GTK4).', type=int, default=100000)
+    argParse.add_argument('--scan-workers', help='The number of threads that scan the folders for all the windows (GTK4).', type=int, default=8)
+    argParse.add_argument('folders', help='The folders to show, each in a window of its own (GTK4).', nargs='*', metavar='FOLDER')
     args = argParse.parse_args()
+    startup_timing.enabled = args.startup_timing
+    startup_timing.mark('Parse arguments')
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()), format='%(levelname)s %(name)s: %(message)s')
+    if args.profile is not None:
+        # This must be before the windows are imported.
+        import common.profiler as profiler
+        profiler.start(args.profile)
+
+    if args.scan_only is not None:
+        # No window, so gi is never imported.
+        import common.headless as headless
+        import common.extension_index as extension_index
+        # Names that are not valid UTF-8 are written as their original bytes, in the CSV and in the JSON Lines.
+        sys.stdout.reconfigure(errors='surrogateescape')
+        sys.exit(headless.scanOnly(args.scan_only, args.format, args.sort, args.reverse, args.filter, extension_index.parseExtensions(args.ext) if args.ext is not None else None))
 
     if args.install:
         print('Not implemented.')
@@ -36,17 +73,20 @@ if __name__ == '__main__':
         sys.exit(0)
 
     # Welcome message.
+    import platform
     print('\033[1;93mGTK Treeview Test\033[0;m by Steve Walton.')
     print(f'Python Version {sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro} (expecting 3).')
-    print(f'Operating System is "{platform.system()}".  Desktop is "{os.environ.get('DESKTOP_SESSION')}".')
+    print(f'Operating System is "{platform.system()}".  Desktop is "{os.environ.get("DESKTOP_SESSION")}".')
 
     if args.gtk3:
         import gtk3.main_window
+        startup_timing.mark('Import GTK3')
         # Main GTK loop.
         mainWindow = gtk3.main_window.MainWindow(args)
         mainWindow.runMainLoop()
     else:
         import gtk4.main_window
+        startup_timing.mark('Import GTK4')
         # Main GTK loop.
         app = gtk4.main_window.TreeViewApp(args, application_id='com.example.GtkApplication')
         app.run()
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Configuration for the unit tests of the common modules.
+The folder above is added to the path so that the common package can be imported without installing it.
+'''
+
+# System libraries.
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
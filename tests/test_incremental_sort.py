@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the incremental sort and the merge of sorted positions, checked against the built in sort.
+'''
+
+# System libraries.
+import random
+
+# Application libraries.
+import common.incremental_sort as incremental_sort
+
+
+
+def runSort(keys, reverse=False, chunkSize=7):
+    '''
+    Returns the positions of the keys sorted by :py:class:`IncrementalSort` with small chunks, so that many merges are done.
+
+    :param list keys: The keys by position.
+    :param bool reverse: True to sort in descending order.
+    :param int chunkSize: The number of positions sorted or merged by each step.
+    '''
+    sort = incremental_sort.IncrementalSort(len(keys), lambda start, stop: keys[start:stop], reverse, chunkSize)
+    while not sort.step():
+        pass
+    return sort.result
+
+
+
+def testSortMatchesSorted():
+    ''' The sort gives the same order as the built in sort, including the order of equal keys. '''
+    generator = random.Random(1)
+    for count in [0, 1, 2, 7, 8, 50, 333]:
+        keys = [generator.randrange(20) for index in range(count)]
+        assert runSort(keys) == sorted(range(count), key=keys.__getitem__)
+        assert runSort(keys, reverse=True) == sorted(range(count), key=lambda position: -keys[position])
+
+
+
+def testRemapPositions():
+    ''' Remapped positions are the positions of the same rows in the list after the splice. '''
+    generator = random.Random(2)
+    for trial in range(200):
+        rows = list(range(generator.randrange(40)))
+        positions = sorted(generator.sample(range(len(rows)), generator.randrange(len(rows) + 1)))
+        position = generator.randrange(len(rows) + 1)
+        numRemoved = generator.randrange(len(rows) - position + 1)
+        numAdded = generator.randrange(5)
+        kept = [rows[index] for index in positions if not position <= index < position + numRemoved]
+        rows[position:position + numRemoved] = [None] * numAdded
+        remapped = incremental_sort.remapPositions(positions, position, numRemoved, numAdded)
+        assert [rows[index] for index in remapped] == kept
+
+
+
+def testMergePositions():
+    ''' Merging new positions into sorted positions gives the same order as sorting all of them. '''
+    generator = random.Random(3)
+    for trial in range(200):
+        keys = [generator.randrange(10) for index in range(generator.randrange(60))]
+        newPositions = generator.sample(range(len(keys)), generator.randrange(len(keys) + 1))
+        positions = sorted(set(range(len(keys))) - set(newPositions), key=keys.__getitem__)
+        merged, first, last = incremental_sort.mergePositions(positions, newPositions, keys.__getitem__)
+        assert [keys[index] for index in merged] == sorted(keys)
+        assert sorted(merged) == list(range(len(keys)))
+        # The rows outside the reported places are unchanged.
+        if len(newPositions) > 0:
+            assert list(merged[:first]) == positions[:first]
+            assert list(merged[last + len(newPositions):]) == positions[last:]
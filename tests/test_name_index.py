@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the name index, checked against a search of every name.
+'''
+
+# System libraries.
+import random
+
+# Application libraries.
+import common.name_index as name_index
+
+
+
+# The queries to search for, short and long, common and rare.
+QUERIES = ['', 'a', 'ab', 'abc', 'bca', 'cab', 'abca', 'zzz', 'ABC']
+
+
+
+def randomName(generator):
+    '''
+    Returns a short random name from few letters, so that the queries often match.
+
+    :param random.Random generator: The random number generator.
+    '''
+    return ''.join(generator.choice('abcAB') for index in range(generator.randrange(1, 8)))
+
+
+
+def testSearchAfterSplice():
+    ''' The index gives the same results as a linear search after random splices. '''
+    generator = random.Random(5)
+    for trial in range(100):
+        names = [randomName(generator) for index in range(generator.randrange(30))]
+        index = name_index.NameIndex(names)
+        for splice in range(10):
+            position = generator.randrange(len(names) + 1)
+            numberToRemove = generator.randrange(len(names) - position + 1)
+            newNames = [randomName(generator) for newIndex in range(generator.randrange(4))]
+            names[position:position + numberToRemove] = newNames
+            index.splice(position, numberToRemove, newNames)
+            assert index.size == len(names)
+            for query in generator.sample(QUERIES, 3):
+                assert index.search(query) == name_index.searchLinear(names, query)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Unit tests for the diff of two sorted lists, checked by applying the splices.
+'''
+
+# System libraries.
+import random
+
+# Application libraries.
+import common.scanner as scanner
+
+
+
+def testDiffSorted():
+    ''' Applying the splices in order to the old list gives the new list. '''
+    generator = random.Random(4)
+    for trial in range(300):
+        names = ['file{}.txt'.format(index) for index in range(30)]
+        oldNames = sorted(generator.sample(names, generator.randrange(len(names) + 1)), key=scanner.naturalKey)
+        newNames = sorted(generator.sample(names, generator.randrange(len(names) + 1)), key=scanner.naturalKey)
+        splices = scanner.diffSorted([scanner.naturalKey(name) for name in oldNames], newNames, key=scanner.naturalKey)
+        rows = list(oldNames)
+        for position, numberToRemove, names in splices:
+            assert numberToRemove > 0 or len(names) > 0
+            rows[position:position + numberToRemove] = names
+        assert rows == newNames